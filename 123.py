@@ -1,113 +1,77 @@
+import bisect
 import datetime
-import os
-import csv
-import uuid
-from typing import Dict, List
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog, scrolledtext
+from tkinter import ttk, messagebox, scrolledtext
+from journal import FsyncPolicy
+from ledger import Ledger, ACCOUNT_TYPES, TRANSACTION_TYPES, format_statement
+from limits import DAY, HOUR, Limit, VelocityLimits
+from metrics import JsonExporter, LedgerMetrics, PrometheusExporter
 
 # Placeholder file path (modify this as needed)
 DATA_FILE = "bank_transactions.csv"
 
-# Transaction limit
-TRANSFER_LIMIT = 5000.0
+# Persistence mode: "journal" appends each commit to JOURNAL_DIR, "sqlite" commits to SQLITE_FILE,
+# "csv" rewrites DATA_FILE
+PERSISTENCE_MODE = "journal"
+JOURNAL_DIR = "bank_journal"
+SQLITE_FILE = "bank.sqlite3"
 
-# Valid transaction types
-TRANSACTION_TYPES = ["UPI", "Bank Transfer", "Net Banking"]
+# When journal commits are forced to disk: FsyncPolicy.always(), .every(n) or .interval(ms)
+JOURNAL_FSYNC_POLICY = FsyncPolicy.always()
 
-# Initial customer data with unique IDs, name, DOB, address, area, balance, and account type
-customers: Dict[str, Dict] = {
-    "CUST001": {
-        "name": "Charan",
-        "dob": "1990-05-15",
-        "address": "123 Main St",
-        "area": "Downtown",
-        "balance": 1000.0,
-        "account_type": "Savings",
-        "transactions": []
-    },
-    "CUST002": {
-        "name": "Baba",
-        "dob": "1985-08-22",
-        "address": "456 Oak Ave",
-        "area": "Suburb",
-        "balance": 1500.0,
-        "account_type": "Current",
-        "transactions": []
-    },
-    "CUST003": {
-        "name": "Gowrav",
-        "dob": "1992-03-10",
-        "address": "789 Pine Rd",
-        "area": "City Center",
-        "balance": 2000.0,
-        "account_type": "Savings",
-        "transactions": []
-    },
-    "CUST004": {
-        "name": "Rahul",
-        "dob": "1988-11-30",
-        "address": "101 Elm St",
-        "area": "Downtown",
-        "balance": 800.0,
-        "account_type": "Current",
-        "transactions": []
-    },
-    "CUST005": {
-        "name": "Priya",
-        "dob": "1995-07-19",
-        "address": "202 Maple Dr",
-        "area": "Suburb",
-        "balance": 1200.0,
-        "account_type": "Savings",
-        "transactions": []
-    },
-    "CUST006": {
-        "name": "Amit",
-        "dob": "1987-04-25",
-        "address": "303 Cedar Ln",
-        "area": "City Center",
-        "balance": 1800.0,
-        "account_type": "Current",
-        "transactions": []
-    },
-    "CUST007": {
-        "name": "Sneha",
-        "dob": "1993-09-12",
-        "address": "404 Birch Ave",
-        "area": "Downtown",
-        "balance": 900.0,
-        "account_type": "Savings",
-        "transactions": []
-    },
-    "CUST008": {
-        "name": "Vikram",
-        "dob": "1986-02-17",
-        "address": "505 Spruce St",
-        "area": "Suburb",
-        "balance": 2500.0,
-        "account_type": "Current",
-        "transactions": []
-    },
-    "CUST009": {
-        "name": "Anjali",
-        "dob": "1991-12-05",
-        "address": "606 Willow Rd",
-        "area": "City Center",
-        "balance": 1100.0,
-        "account_type": "Savings",
-        "transactions": []
-    },
-    "CUST010": {
-        "name": "Rohan",
-        "dob": "1989-06-08",
-        "address": "707 Ash Dr",
-        "area": "Downtown",
-        "balance": 1700.0,
-        "account_type": "Current",
-        "transactions": []
-    },
+# Number of journal commits between snapshot checkpoints
+CHECKPOINT_EVERY = 10000
+
+# Hand journal commits to a background group-commit writer instead of writing on the Tk thread
+ASYNC_COMMIT = True
+GROUP_COMMIT_DELAY_MS = 2.0
+
+# How often the GUI checks whether a submitted commit has been acknowledged
+COMMIT_POLL_MS = 20
+
+# Rolling limits on each account's outgoing transfers, by account type; accounts listed in
+# ACCOUNT_VELOCITY_LIMITS get their own limits instead
+VELOCITY_LIMITS = {
+    "Savings": [Limit(DAY, max_amount=20000.0), Limit(HOUR, max_count=10), Limit(DAY, max_amount=10000.0, trans_type="UPI")],
+    "Current": [Limit(DAY, max_amount=100000.0), Limit(HOUR, max_count=50)],
 }
+ACCOUNT_VELOCITY_LIMITS = {}
+
+# Days of each customer's history kept in memory; older transactions are spilled to compressed
+# segments in SPILL_DIR (None keeps everything in memory; not available in "csv" mode)
+HOT_HISTORY_DAYS = 30
+SPILL_DIR = "bank_spill"
+
+# Built-in metrics: Prometheus text at http://127.0.0.1:METRICS_PORT/metrics and a JSON dump
+# written to METRICS_DUMP on exit (None disables either)
+METRICS_PORT = 9108
+METRICS_DUMP = "bank_metrics.json"
+
+# How long customer change events are gathered before the summary rows are updated
+SUMMARY_REFRESH_MS = 100
+
+# Filter value on the summary tab that matches every area or account type
+SUMMARY_ALL = "All"
+
+# Customer fields behind the sortable summary columns (Customer ID and Balance sort specially)
+SUMMARY_SORT_FIELDS = {"Name": "name", "Account Type": "account_type", "DOB": "dob", "Area": "area"}
+
+# History rows fetched per page; the next page loads when the list is scrolled near its end
+HISTORY_PAGE_SIZE = 100
+
+# Reports on the Analytics tab (see analytics.QUERIES; analytics itself needs NumPy)
+ANALYTICS_QUERIES = ["Volume by type per day", "Net flow by area", "Balances by account type", "Top counterparties"]
+
+# Notebook tabs and the methods that fill them; a tab is only filled the first time it is selected
+TABS = [
+    ("Welcome", "create_welcome_tab"),
+    ("Register Customer", "create_register_tab"),
+    ("Process Transfer", "create_transfer_tab"),
+    ("Customer Summary", "create_summary_tab"),
+    ("Transaction History", "create_history_tab"),
+    ("Analytics", "create_analytics_tab"),
+]
 
 class BankApp:
     def __init__(self, root):
@@ -119,21 +83,56 @@ class BankApp:
         self.notebook = ttk.Notebook(root)
         self.notebook.pack(fill=tk.BOTH, expand=True)
        
-        # Create tabs
-        self.create_welcome_tab()
-        self.create_register_tab()
-        self.create_transfer_tab()
-        self.create_summary_tab()
-        self.create_history_tab()
-       
-        # Load data
+        self.metrics = LedgerMetrics()
+        self.ledger = Ledger(PERSISTENCE_MODE, JOURNAL_DIR, DATA_FILE, JOURNAL_FSYNC_POLICY, CHECKPOINT_EVERY,
+                             async_commit=ASYNC_COMMIT, group_commit_delay_ms=GROUP_COMMIT_DELAY_MS,
+                             sqlite_path=SQLITE_FILE,
+                             velocity_limits=VelocityLimits(VELOCITY_LIMITS, ACCOUNT_VELOCITY_LIMITS),
+                             hot_days=HOT_HISTORY_DAYS if PERSISTENCE_MODE != "csv" else None,
+                             spill_dir=SPILL_DIR, metrics=self.metrics)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+       
+        # Metrics exporters
+        self.metrics_exporters = []
+        if METRICS_PORT is not None:
+            self.metrics_exporters.append(PrometheusExporter(self.metrics.registry, METRICS_PORT))
+        if METRICS_DUMP is not None:
+            self.metrics_exporters.append(JsonExporter(self.metrics.registry, METRICS_DUMP))
+        for exporter in list(self.metrics_exporters):
+            try:
+                exporter.start()
+            except OSError as e:
+                print(f"Metrics exporter {type(exporter).__name__} not started: {e}")
+                self.metrics_exporters.remove(exporter)
+       
+        # Create empty tabs; each is filled the first time it is selected
+        self.tab_builders = {}
+        for title, builder in TABS:
+            tab = ttk.Frame(self.notebook)
+            self.notebook.add(tab, text=title)
+            self.tab_builders[str(tab)] = getattr(self, builder)
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+       
+        # Load data, then fill the tab shown first
         self.load_transactions()
-       
-    def create_welcome_tab(self):
+        self.on_tab_changed()
+       
+    def on_close(self):
+        """Flush the journal, stop the metrics exporters and close the window"""
+        self.ledger.close()
+        for exporter in self.metrics_exporters:
+            exporter.close()
+        self.root.destroy()
+   
+    def on_tab_changed(self, event=None):
+        """Fill the selected tab if this is the first time it is shown"""
+        tab = self.notebook.select()
+        builder = self.tab_builders.pop(tab, None)
+        if builder is not None:
+            builder(self.notebook.nametowidget(tab))
+   
+    def create_welcome_tab(self, tab):
         """Create the welcome tab with basic information"""
-        tab = ttk.Frame(self.notebook)
-        self.notebook.add(tab, text="Welcome")
-       
         welcome_label = ttk.Label(tab, text="Bank Transaction System", font=("Arial", 16, "bold"))
         welcome_label.pack(pady=20)
        
@@ -161,11 +160,8 @@ Please select the appropriate tab to perform your desired action."""
        
         update_time()
    
-    def create_register_tab(self):
+    def create_register_tab(self, tab):
         """Create the customer registration tab"""
-        tab = ttk.Frame(self.notebook)
-        self.notebook.add(tab, text="Register Customer")
-       
         # Form fields
         ttk.Label(tab, text="Register New Customer", font=("Arial", 12, "bold")).grid(row=0, column=0, columnspan=2, pady=10)
        
@@ -176,7 +172,7 @@ Please select the appropriate tab to perform your desired action."""
         ttk.Label(tab, text="Account Type:").grid(row=2, column=0, padx=5, pady=5, sticky=tk.E)
         self.account_type_var = tk.StringVar()
         self.account_type_combobox = ttk.Combobox(tab, textvariable=self.account_type_var,
-                                                values=["Savings", "Current"], state="readonly", width=27)
+                                                values=ACCOUNT_TYPES, state="readonly", width=27)
         self.account_type_combobox.grid(row=2, column=1, padx=5, pady=5)
        
         ttk.Label(tab, text="Date of Birth (YYYY-MM-DD):").grid(row=3, column=0, padx=5, pady=5, sticky=tk.E)
@@ -203,11 +199,8 @@ Please select the appropriate tab to perform your desired action."""
         self.register_status = ttk.Label(tab, text="", foreground="green")
         self.register_status.grid(row=8, column=0, columnspan=2)
    
-    def create_transfer_tab(self):
+    def create_transfer_tab(self, tab):
         """Create the money transfer tab"""
-        tab = ttk.Frame(self.notebook)
-        self.notebook.add(tab, text="Process Transfer")
-       
         # Form fields
         ttk.Label(tab, text="Process Money Transfer", font=("Arial", 12, "bold")).grid(row=0, column=0, columnspan=2, pady=10)
        
@@ -245,24 +238,35 @@ Please select the appropriate tab to perform your desired action."""
         self.transaction_details = scrolledtext.ScrolledText(tab, width=60, height=10, state=tk.DISABLED)
         self.transaction_details.grid(row=8, column=0, columnspan=2, padx=10, pady=10)
    
-    def create_summary_tab(self):
+    def create_summary_tab(self, tab):
         """Create the customer summary tab"""
-        tab = ttk.Frame(self.notebook)
-        self.notebook.add(tab, text="Customer Summary")
-       
         # Title
         ttk.Label(tab, text="Customer Summary", font=("Arial", 12, "bold")).pack(pady=10)
        
+        # Filters
+        filter_frame = ttk.Frame(tab)
+        filter_frame.pack(pady=5)
+        ttk.Label(filter_frame, text="Area:").pack(side=tk.LEFT, padx=5)
+        self.summary_area_combo = ttk.Combobox(filter_frame, values=[SUMMARY_ALL], state="readonly", width=20)
+        self.summary_area_combo.current(0)
+        self.summary_area_combo.pack(side=tk.LEFT, padx=5)
+        self.summary_area_combo.bind("<<ComboboxSelected>>", lambda event: self.apply_summary_view())
+        ttk.Label(filter_frame, text="Account Type:").pack(side=tk.LEFT, padx=5)
+        self.summary_type_combo = ttk.Combobox(filter_frame, values=[SUMMARY_ALL] + ACCOUNT_TYPES, state="readonly", width=15)
+        self.summary_type_combo.current(0)
+        self.summary_type_combo.pack(side=tk.LEFT, padx=5)
+        self.summary_type_combo.bind("<<ComboboxSelected>>", lambda event: self.apply_summary_view())
+       
         # Treeview for displaying customer data
         self.summary_tree = ttk.Treeview(tab, columns=("ID", "Name", "Account Type", "DOB", "Area", "Balance"), show="headings")
        
-        # Define headings
-        self.summary_tree.heading("ID", text="Customer ID")
-        self.summary_tree.heading("Name", text="Name")
-        self.summary_tree.heading("Account Type", text="Account Type")
-        self.summary_tree.heading("DOB", text="DOB")
-        self.summary_tree.heading("Area", text="Area")
-        self.summary_tree.heading("Balance", text="Balance")
+        # Define headings; clicking one sorts by that column
+        self.summary_tree.heading("ID", text="Customer ID", command=lambda: self.sort_summary("ID"))
+        self.summary_tree.heading("Name", text="Name", command=lambda: self.sort_summary("Name"))
+        self.summary_tree.heading("Account Type", text="Account Type", command=lambda: self.sort_summary("Account Type"))
+        self.summary_tree.heading("DOB", text="DOB", command=lambda: self.sort_summary("DOB"))
+        self.summary_tree.heading("Area", text="Area", command=lambda: self.sort_summary("Area"))
+        self.summary_tree.heading("Balance", text="Balance", command=lambda: self.sort_summary("Balance"))
        
         # Set column widths
         self.summary_tree.column("ID", width=100)
@@ -281,12 +285,23 @@ Please select the appropriate tab to perform your desired action."""
         # Refresh button
         refresh_btn = ttk.Button(tab, text="Refresh Summary", command=self.display_customer_summary_gui)
         refresh_btn.pack(pady=5)
+       
+        # Rows are keyed by customer ID; rows hidden by the filters stay in the tree, detached
+        self.summary_rows = set()
+        self.summary_areas = set()
+        self.summary_sort_column = "ID"
+        self.summary_sort_reverse = False
+        # Sort keys of the shown rows in ascending order, and each shown customer's key
+        self.summary_order = []
+        self.summary_keys = {}
+        # Customers changed since the last update, applied together after SUMMARY_REFRESH_MS
+        self.summary_pending = set()
+        self.summary_update_scheduled = False
+        self.ledger.add_listener(self.queue_summary_update)
+        self.display_customer_summary_gui()
    
-    def create_history_tab(self):
+    def create_history_tab(self, tab):
         """Create the transaction history tab"""
-        tab = ttk.Frame(self.notebook)
-        self.notebook.add(tab, text="Transaction History")
-       
         # Form fields
         ttk.Label(tab, text="View Transaction History", font=("Arial", 12, "bold")).grid(row=0, column=0, columnspan=2, pady=10)
        
@@ -294,13 +309,26 @@ Please select the appropriate tab to perform your desired action."""
         self.history_cust_id_entry = ttk.Entry(tab, width=30)
         self.history_cust_id_entry.grid(row=1, column=1, padx=5, pady=5)
        
-        # View button
-        view_btn = ttk.Button(tab, text="View History", command=self.display_history_gui)
-        view_btn.grid(row=2, column=0, columnspan=2, pady=10)
+        # Optional date range (YYYY-MM-DD); blank means unbounded
+        ttk.Label(tab, text="From (YYYY-MM-DD):").grid(row=2, column=0, padx=5, pady=5, sticky=tk.E)
+        self.history_from_entry = ttk.Entry(tab, width=30)
+        self.history_from_entry.grid(row=2, column=1, padx=5, pady=5)
+       
+        ttk.Label(tab, text="To (YYYY-MM-DD):").grid(row=3, column=0, padx=5, pady=5, sticky=tk.E)
+        self.history_to_entry = ttk.Entry(tab, width=30)
+        self.history_to_entry.grid(row=3, column=1, padx=5, pady=5)
+       
+        # View and statement buttons
+        button_frame = ttk.Frame(tab)
+        button_frame.grid(row=4, column=0, columnspan=2, pady=10)
+        view_btn = ttk.Button(button_frame, text="View History", command=self.display_history_gui)
+        view_btn.pack(side=tk.LEFT, padx=5)
+        statement_btn = ttk.Button(button_frame, text="Generate Statement", command=self.display_statement_gui)
+        statement_btn.pack(side=tk.LEFT, padx=5)
        
         # Current balance display
         self.current_balance_label = ttk.Label(tab, text="", font=("Arial", 10, "bold"))
-        self.current_balance_label.grid(row=3, column=0, columnspan=2)
+        self.current_balance_label.grid(row=5, column=0, columnspan=2)
        
         # Treeview for displaying transaction history
         self.history_tree = ttk.Treeview(tab, columns=("Date", "Type", "Amount", "Balance", "Recipient", "Txn ID", "UTR"), show="headings")
@@ -323,127 +351,88 @@ Please select the appropriate tab to perform your desired action."""
         self.history_tree.column("Txn ID", width=100)
         self.history_tree.column("UTR", width=120)
        
-        # Add scrollbar
+        # Add scrollbar; scrolling near the bottom fetches the next page of history
         scrollbar = ttk.Scrollbar(tab, orient=tk.VERTICAL, command=self.history_tree.yview)
-        self.history_tree.configure(yscroll=scrollbar.set)
+       
+        def on_history_scroll(first, last):
+            scrollbar.set(first, last)
+            if float(last) > 0.9:
+                self.root.after_idle(self.load_history_page)
+       
+        self.history_tree.configure(yscroll=on_history_scroll)
+        self.history_cust_id = None
+        self.history_loaded_rows = 0
+        self.history_range = (None, None)
+        scrollbar.grid(row=6, column=2, sticky=tk.NS)
+        self.history_tree.grid(row=6, column=0, columnspan=2, sticky=tk.NSEW, padx=5, pady=5)
+       
+        # Configure grid weights
+        tab.grid_rowconfigure(6, weight=1)
+        tab.grid_columnconfigure(0, weight=1)
+        tab.grid_columnconfigure(1, weight=1)
+   
+    def create_analytics_tab(self, tab):
+        """Create the analytics tab"""
+        ttk.Label(tab, text="Transaction Analytics", font=("Arial", 12, "bold")).grid(row=0, column=0, columnspan=2, pady=10)
+       
+        ttk.Label(tab, text="Report:").grid(row=1, column=0, padx=5, pady=5, sticky=tk.E)
+        self.analytics_query_combo = ttk.Combobox(tab, values=ANALYTICS_QUERIES, state="readonly", width=28)
+        self.analytics_query_combo.current(0)
+        self.analytics_query_combo.grid(row=1, column=1, padx=5, pady=5)
+       
+        # Only used by the top counterparties report
+        ttk.Label(tab, text="Customer ID:").grid(row=2, column=0, padx=5, pady=5, sticky=tk.E)
+        self.analytics_cust_id_entry = ttk.Entry(tab, width=30)
+        self.analytics_cust_id_entry.grid(row=2, column=1, padx=5, pady=5)
+       
+        # Run and reload buttons
+        button_frame = ttk.Frame(tab)
+        button_frame.grid(row=3, column=0, columnspan=2, pady=10)
+        run_btn = ttk.Button(button_frame, text="Run Report", command=self.display_analytics_gui)
+        run_btn.pack(side=tk.LEFT, padx=5)
+        reload_btn = ttk.Button(button_frame, text="Reload Data", command=lambda: self.display_analytics_gui(reload=True))
+        reload_btn.pack(side=tk.LEFT, padx=5)
+       
+        # Treeview for the report; its columns are set per report
+        self.analytics_tree = ttk.Treeview(tab, show="headings")
+        scrollbar = ttk.Scrollbar(tab, orient=tk.VERTICAL, command=self.analytics_tree.yview)
+        self.analytics_tree.configure(yscroll=scrollbar.set)
         scrollbar.grid(row=4, column=2, sticky=tk.NS)
-        self.history_tree.grid(row=4, column=0, columnspan=2, sticky=tk.NSEW, padx=5, pady=5)
+        self.analytics_tree.grid(row=4, column=0, columnspan=2, sticky=tk.NSEW, padx=5, pady=5)
+        self.analytics = None
        
         # Configure grid weights
         tab.grid_rowconfigure(4, weight=1)
         tab.grid_columnconfigure(0, weight=1)
         tab.grid_columnconfigure(1, weight=1)
    
-    def save_transactions(self):
-        """Save all transactions and customer details to CSV file"""
-        try:
-            with open(DATA_FILE, 'w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(["Customer ID", "Name", "Account Type", "DOB", "Address", "Area", "Date", "Type", "Amount", "Balance", "Recipient ID", "Transaction ID", "UTR"])
-                for cust_id, info in customers.items():
-                    for trans in info["transactions"]:
-                        writer.writerow([
-                            cust_id,
-                            info["name"],
-                            info["account_type"],
-                            info["dob"],
-                            info["address"],
-                            info["area"],
-                            trans["date"],
-                            trans["type"],
-                            trans["amount"],
-                            trans["balance"],
-                            trans.get("recipient_id", ""),
-                            trans.get("transaction_id", ""),
-                            trans.get("utr", "")
-                        ])
-                    # Write customer details even if no transactions
-                    if not info["transactions"]:
-                        writer.writerow([
-                            cust_id,
-                            info["name"],
-                            info["account_type"],
-                            info["dob"],
-                            info["address"],
-                            info["area"],
-                            "", "", "", "", "", "", ""
-                        ])
-            print(f"Transactions and customer details saved to {DATA_FILE}")
-        except PermissionError:
-            messagebox.showerror("Error", f"No permission to write to {DATA_FILE}. Check file permissions.")
-        except Exception as e:
-            messagebox.showerror("Error", f"Error saving transactions: {e}")
+    def when_committed(self, future, on_committed, on_failed):
+        """Run a callback on the Tk thread once a commit future resolves"""
+        if future is None:
+            on_committed()
+            return
+       
+        def poll():
+            if not future.done():
+                self.root.after(COMMIT_POLL_MS, poll)
+                return
+            error = future.exception()
+            if error is None:
+                on_committed()
+            else:
+                on_failed(error)
+       
+        poll()
    
     def load_transactions(self):
-        """Load transactions and customer details from CSV file if it exists"""
-        if not os.path.exists(DATA_FILE):
-            print(f"No transaction file found at {DATA_FILE}. Starting fresh.")
-            return
+        """Load customers and transactions through the ledger"""
         try:
-            with open(DATA_FILE, 'r') as file:
-                reader = csv.reader(file)
-                header = next(reader, None)  # Skip header
-                expected_header = ["Customer ID", "Name", "Account Type", "DOB", "Address", "Area", "Date", "Type", "Amount", "Balance", "Recipient ID", "Transaction ID", "UTR"]
-                if header != expected_header:
-                    print(f"Invalid CSV header in {DATA_FILE}. Expected {expected_header}, got {header}")
-                    return
-                for row in reader:
-                    if len(row) >= 13 and row[6]:  # Transaction row
-                        cust_id = row[0].upper()
-                        if cust_id in customers:
-                            try:
-                                customers[cust_id]["transactions"].append({
-                                    "date": row[6],
-                                    "type": row[7],
-                                    "amount": float(row[8]),
-                                    "balance": float(row[9]),
-                                    "recipient_id": row[10],
-                                    "transaction_id": row[11],
-                                    "utr": row[12]
-                                })
-                                # Update customer details
-                                customers[cust_id]["name"] = row[1]
-                                customers[cust_id]["account_type"] = row[2]
-                                customers[cust_id]["dob"] = row[3]
-                                customers[cust_id]["address"] = row[4]
-                                customers[cust_id]["area"] = row[5]
-                            except ValueError as e:
-                                print(f"Skipping invalid transaction row {row}: {e}")
-                        else:
-                            print(f"Skipping transaction for unknown customer ID: {cust_id}")
-                    elif len(row) >= 6:  # Customer details row
-                        cust_id = row[0].upper()
-                        if cust_id in customers:
-                            customers[cust_id]["name"] = row[1]
-                            customers[cust_id]["account_type"] = row[2]
-                            customers[cust_id]["dob"] = row[3]
-                            customers[cust_id]["address"] = row[4]
-                            customers[cust_id]["area"] = row[5]
-                        else:
-                            print(f"Skipping details for unknown customer ID: {cust_id}")
-                    else:
-                        print(f"Skipping invalid row: {row}")
-            print(f"Transactions and customer details loaded from {DATA_FILE}")
+            self.ledger.load()
         except PermissionError:
-            messagebox.showerror("Error", f"No permission to read {DATA_FILE}. Check file permissions.")
+            messagebox.showerror("Error", "No permission to read the ledger data. Check file permissions.")
         except Exception as e:
             messagebox.showerror("Error", f"Error loading transactions: {e}")
    
-    def verify_customer_details(self, cust_id: str, expected_details: Dict) -> bool:
-        """Verify customer details against stored data (simulated automatic check)"""
-        if cust_id not in customers:
-            messagebox.showerror("Error", f"Customer ID {cust_id} not found!")
-            return False
-        customer = customers[cust_id]
-        # Simulate server verification (in a real system, this would query a database)
-        if (customer["name"].lower() != expected_details["name"].lower() or
-            customer["dob"] != expected_details["dob"] or
-            customer["address"].lower() != expected_details["address"].lower() or
-            customer["area"].lower() != expected_details["area"].lower()):
-            messagebox.showerror("Error", f"Verification failed for Customer ID {cust_id}! Details do not match.")
-            return False
-        return True
-   
     def process_transfer_gui(self):
         """Process a transfer from the GUI"""
         cust_id = self.sender_id_entry.get().strip().upper()
@@ -458,118 +447,55 @@ Please select the appropriate tab to perform your desired action."""
         self.transaction_details.delete(1.0, tk.END)
         self.transaction_details.config(state=tk.DISABLED)
        
-        # Validate inputs
-        if not cust_id or not recipient_id or not amount_str or not trans_type:
-            self.transfer_status.config(text="Please fill all fields!", foreground="red")
-            return
-       
+        customers = self.ledger.customers
+        balance_before = customers[cust_id]["balance"] if cust_id in customers else 0.0
         try:
-            amount = float(amount_str)
-        except ValueError:
-            self.transfer_status.config(text="Invalid amount! Please enter a number.", foreground="red")
-            return
-       
-        if cust_id not in customers:
-            self.transfer_status.config(text="Sender ID not found!", foreground="red")
-            return
-        if recipient_id not in customers:
-            self.transfer_status.config(text="Recipient ID not found!", foreground="red")
-            return
-        if cust_id == recipient_id:
-            self.transfer_status.config(text="Cannot transfer to the same account!", foreground="red")
-            return
-       
-        if trans_type not in TRANSACTION_TYPES:
-            self.transfer_status.config(text=f"Invalid transaction type! Choose from {TRANSACTION_TYPES}", foreground="red")
-            return
-       
-        if amount <= 0:
-            self.transfer_status.config(text="Amount must be positive!", foreground="red")
-            return
-       
-        if amount > TRANSFER_LIMIT:
-            self.transfer_status.config(text=f"Amount exceeds limit of ₹{TRANSFER_LIMIT:.2f}!", foreground="red")
-            return
-       
-        if customers[cust_id]["balance"] < amount:
-            self.transfer_status.config(text="Insufficient funds!", foreground="red")
+            result = self.ledger.transfer(cust_id, recipient_id, amount_str, trans_type)
+        except PermissionError:
+            messagebox.showerror("Error", "No permission to write the ledger data. Check file permissions.")
             return
-       
-        # Automatic verification of sender and recipient details
-        sender_details = {
-            "name": customers[cust_id]["name"],
-            "dob": customers[cust_id]["dob"],
-            "address": customers[cust_id]["address"],
-            "area": customers[cust_id]["area"]
-        }
-        recipient_details = {
-            "name": customers[recipient_id]["name"],
-            "dob": customers[recipient_id]["dob"],
-            "address": customers[recipient_id]["address"],
-            "area": customers[recipient_id]["area"]
-        }
-       
-        if not self.verify_customer_details(cust_id, sender_details):
+        except Exception as e:
+            messagebox.showerror("Error", f"Error saving transactions: {e}")
             return
-        if not self.verify_customer_details(recipient_id, recipient_details):
+        render_began = time.perf_counter()
+        if not result.ok:
+            self.transfer_status.config(text=result.message, foreground="red")
+            self.metrics.observe("ui_render", time.perf_counter() - render_began)
             return
        
-        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        transaction_id = str(uuid.uuid4())[:8].upper()  # Shortened random Transaction ID
-        utr = str(uuid.uuid4())[:12].upper()  # Shortened random UTR
+        sender = customers[cust_id]
+        recipient = customers[recipient_id]
        
         # Display balance before transaction
         self.sender_balance_label.config(
-            text=f"Current Balance for {customers[cust_id]['name']}: ₹{customers[cust_id]['balance']:.2f}",
+            text=f"Current Balance for {sender['name']}: ₹{balance_before:.2f}",
             foreground="blue"
         )
        
-        # Process transaction
-        customers[cust_id]["balance"] -= amount
-        customers[recipient_id]["balance"] += amount
-       
-        # Record sender's transaction
-        customers[cust_id]["transactions"].append({
-            "date": current_time,
-            "type": f"{trans_type.lower()}_out",
-            "amount": amount,
-            "balance": customers[cust_id]["balance"],
-            "recipient_id": recipient_id,
-            "transaction_id": transaction_id,
-            "utr": utr
-        })
-       
-        # Record recipient's transaction
-        customers[recipient_id]["transactions"].append({
-            "date": current_time,
-            "type": f"{trans_type.lower()}_in",
-            "amount": amount,
-            "balance": customers[recipient_id]["balance"],
-            "recipient_id": cust_id,
-            "transaction_id": transaction_id,
-            "utr": utr
-        })
-       
-        self.save_transactions()
-       
         # Display transaction details
         details = f"Transaction successful!\n\n"
-        details += f"Sender: {customers[cust_id]['name']} (ID: {cust_id}, {customers[cust_id]['account_type']})\n"
-        details += f"Recipient: {customers[recipient_id]['name']} (ID: {recipient_id}, {customers[recipient_id]['account_type']})\n"
+        details += f"Sender: {sender['name']} (ID: {cust_id}, {sender['account_type']})\n"
+        details += f"Recipient: {recipient['name']} (ID: {recipient_id}, {recipient['account_type']})\n"
         details += f"Transaction Type: {trans_type}\n"
-        details += f"Amount: ₹{amount:.2f}\n"
-        details += f"Date and Time: {current_time}\n"
-        details += f"Transaction ID: {transaction_id}\n"
-        details += f"UTR: {utr}\n"
-        details += f"\nUpdated Balance for {customers[cust_id]['name']}: ₹{customers[cust_id]['balance']:.2f}\n"
-        details += f"Updated Balance for {customers[recipient_id]['name']}: ₹{customers[recipient_id]['balance']:.2f}"
+        details += f"Amount: ₹{result.amount:.2f}\n"
+        details += f"Date and Time: {result.date}\n"
+        details += f"Transaction ID: {result.transaction_id}\n"
+        details += f"UTR: {result.utr}\n"
+        details += f"\nUpdated Balance for {sender['name']}: ₹{result.sender_balance:.2f}\n"
+        details += f"Updated Balance for {recipient['name']}: ₹{result.recipient_balance:.2f}"
        
         self.transaction_details.config(state=tk.NORMAL)
         self.transaction_details.delete(1.0, tk.END)
         self.transaction_details.insert(tk.END, details)
         self.transaction_details.config(state=tk.DISABLED)
        
-        self.transfer_status.config(text="Transfer completed successfully!", foreground="green")
+        self.transfer_status.config(text="Transfer applied, committing to disk...", foreground="orange")
+        self.when_committed(
+            result.commit,
+            lambda: self.transfer_status.config(text="Transfer committed successfully!", foreground="green"),
+            lambda e: messagebox.showerror("Error", f"Error saving transactions: {e}")
+        )
+        self.metrics.observe("ui_render", time.perf_counter() - render_began)
    
     def register_customer_gui(self):
         """Register a new customer from the GUI"""
@@ -583,40 +509,19 @@ Please select the appropriate tab to perform your desired action."""
         # Clear previous status
         self.register_status.config(text="")
        
-        # Validate inputs
-        if not name or not account_type or not dob or not address or not area or not balance_str:
-            self.register_status.config(text="Please fill all fields!", foreground="red")
-            return
-       
-        # Check if customer with this name already exists
-        for cust_id, info in customers.items():
-            if info["name"].lower() == name.lower():
-                self.register_status.config(text="Customer with this name already exists!", foreground="red")
-                return
-       
         try:
-            initial_balance = float(balance_str)
-            if initial_balance < 0:
-                self.register_status.config(text="Initial balance cannot be negative!", foreground="red")
-                return
-        except ValueError:
-            self.register_status.config(text="Invalid amount! Please enter a number.", foreground="red")
+            result = self.ledger.register_customer(name, account_type, dob, address, area, balance_str)
+        except PermissionError:
+            messagebox.showerror("Error", "No permission to write the ledger data. Check file permissions.")
             return
-       
-        # Generate unique customer ID
-        cust_id = f"CUST{len(customers) + 1:03d}"
-       
-        customers[cust_id] = {
-            "name": name,
-            "dob": dob,
-            "address": address,
-            "area": area,
-            "balance": initial_balance,
-            "account_type": account_type,
-            "transactions": []
-        }
-       
-        self.save_transactions()
+        except Exception as e:
+            messagebox.showerror("Error", f"Error saving customer: {e}")
+            return
+        if not result.ok:
+            self.register_status.config(text=result.message, foreground="red")
+            return
+        cust_id = result.customer_id
+        initial_balance = self.ledger.balance(cust_id)
        
         # Clear form
         self.name_entry.delete(0, tk.END)
@@ -628,33 +533,129 @@ Please select the appropriate tab to perform your desired action."""
        
         # Show success message
         message = f"Account created successfully for {name} ({account_type})!\nCustomer ID: {cust_id}\nCurrent Balance: ₹{initial_balance:.2f}"
-        self.register_status.config(text=message, foreground="green")
-       
-        # Update summary tab
-        self.display_customer_summary_gui()
+        self.register_status.config(text=message + "\nCommitting to disk...", foreground="orange")
+        self.when_committed(
+            result.commit,
+            lambda: self.register_status.config(text=message + "\nCommitted.", foreground="green"),
+            lambda e: messagebox.showerror("Error", f"Error saving customer: {e}")
+        )
    
     def display_customer_summary_gui(self):
-        """Display customer summary in the GUI"""
-        # Clear existing data
-        for item in self.summary_tree.get_children():
-            self.summary_tree.delete(item)
+        """Rebuild the customer summary from the ledger (later changes arrive as events)"""
+        # Clear existing data, including rows hidden by the filters
+        self.summary_tree.delete(*self.summary_rows)
+        self.summary_rows = set()
+        self.summary_areas = set()
+        self.summary_pending = set()
        
         # Add customer data to treeview
-        for cust_id, info in customers.items():
-            self.summary_tree.insert("", tk.END, values=(
-                cust_id,
-                info["name"],
-                info["account_type"],
-                info["dob"],
-                info["area"],
-                f"₹{info['balance']:.2f}"
-            ))
+        for cust_id, info in self.ledger.customers.items():
+            self.summary_tree.insert("", tk.END, iid=cust_id, values=self.summary_values(cust_id, info))
+            self.summary_rows.add(cust_id)
+            self.summary_areas.add(info["area"])
+        self.summary_area_combo.config(values=[SUMMARY_ALL] + sorted(self.summary_areas))
+        self.apply_summary_view()
+   
+    def summary_values(self, cust_id, info):
+        """Column values of a customer's summary row"""
+        return (
+            cust_id,
+            info["name"],
+            info["account_type"],
+            info["dob"],
+            info["area"],
+            f"₹{info['balance']:.2f}"
+        )
+   
+    def summary_sort_key(self, cust_id, info):
+        """Sort key of a customer's row for the current sort column (unique, as it ends with the ID)"""
+        column = self.summary_sort_column
+        if column == "Balance":
+            value = info["balance"]
+        elif column == "ID":
+            # CUST1000 sorts after CUST999
+            value = len(cust_id)
+        else:
+            value = info[SUMMARY_SORT_FIELDS[column]].lower()
+        return value, cust_id
+   
+    def summary_shown(self, info):
+        """Whether a customer passes the area and account type filters"""
+        area = self.summary_area_combo.get()
+        account_type = self.summary_type_combo.get()
+        return area in (SUMMARY_ALL, info["area"]) and account_type in (SUMMARY_ALL, info["account_type"])
+   
+    def sort_summary(self, column):
+        """Sort the summary by a column, reversing the order if it is already sorted by it"""
+        if column == self.summary_sort_column:
+            self.summary_sort_reverse = not self.summary_sort_reverse
+        else:
+            self.summary_sort_column = column
+            self.summary_sort_reverse = False
+        self.apply_summary_view()
+   
+    def apply_summary_view(self):
+        """Re-sort and re-filter the existing rows in place"""
+        customers = self.ledger.customers
+        shown = [cust_id for cust_id in self.summary_rows if self.summary_shown(customers[cust_id])]
+        self.summary_order = sorted(self.summary_sort_key(cust_id, customers[cust_id]) for cust_id in shown)
+        self.summary_keys = {key[-1]: key for key in self.summary_order}
+        self.summary_tree.detach(*(self.summary_rows - self.summary_keys.keys()))
+        order = reversed(self.summary_order) if self.summary_sort_reverse else self.summary_order
+        for index, key in enumerate(order):
+            self.summary_tree.move(key[-1], "", index)
+   
+    def queue_summary_update(self, cust_ids):
+        """Ledger listener: remember changed customers and schedule one update for the burst"""
+        self.summary_pending.update(cust_ids)
+        if not self.summary_update_scheduled:
+            self.summary_update_scheduled = True
+            self.root.after(SUMMARY_REFRESH_MS, self.flush_summary_updates)
+   
+    def flush_summary_updates(self):
+        """Update the rows of every customer changed since the last update"""
+        self.summary_update_scheduled = False
+        pending, self.summary_pending = self.summary_pending, set()
+        for cust_id in pending:
+            self.update_summary_row(cust_id)
+   
+    def update_summary_row(self, cust_id):
+        """Refresh one customer's row and move it to its sorted place (or hide it)"""
+        info = self.ledger.customers.get(cust_id)
+        if info is None:
+            return
+        values = self.summary_values(cust_id, info)
+        if cust_id in self.summary_rows:
+            self.summary_tree.item(cust_id, values=values)
+        else:
+            self.summary_tree.insert("", tk.END, iid=cust_id, values=values)
+            self.summary_tree.detach(cust_id)
+            self.summary_rows.add(cust_id)
+            if info["area"] not in self.summary_areas:
+                self.summary_areas.add(info["area"])
+                self.summary_area_combo.config(values=[SUMMARY_ALL] + sorted(self.summary_areas))
+       
+        # Take the row out of the sorted order, then put it back where its new key belongs
+        old_key = self.summary_keys.pop(cust_id, None)
+        if old_key is not None:
+            del self.summary_order[bisect.bisect_left(self.summary_order, old_key)]
+        if not self.summary_shown(info):
+            self.summary_tree.detach(cust_id)
+            return
+        key = self.summary_sort_key(cust_id, info)
+        index = bisect.bisect_left(self.summary_order, key)
+        self.summary_order.insert(index, key)
+        self.summary_keys[cust_id] = key
+        if self.summary_sort_reverse:
+            index = len(self.summary_order) - 1 - index
+        self.summary_tree.move(cust_id, "", index)
    
     def display_history_gui(self):
         """Display transaction history in the GUI"""
         cust_id = self.history_cust_id_entry.get().strip().upper()
        
         # Clear existing data
+        self.history_cust_id = None
         for item in self.history_tree.get_children():
             self.history_tree.delete(item)
         self.current_balance_label.config(text="")
@@ -663,11 +664,15 @@ Please select the appropriate tab to perform your desired action."""
             messagebox.showerror("Error", "Please enter a Customer ID")
             return
        
-        if cust_id not in customers:
+        if cust_id not in self.ledger.customers:
             messagebox.showerror("Error", "Customer ID not found!")
             return
        
-        customer = customers[cust_id]
+        date_range = self.history_date_range()
+        if date_range is None:
+            return
+       
+        customer = self.ledger.customers[cust_id]
        
         # Display current balance
         self.current_balance_label.config(
@@ -675,12 +680,41 @@ Please select the appropriate tab to perform your desired action."""
             foreground="blue"
         )
        
-        if not customer["transactions"]:
+        if self.ledger.history_count(cust_id, *date_range) == 0:
             self.history_tree.insert("", tk.END, values=("No transactions found", "", "", "", "", "", ""))
             return
        
+        # Newest transactions first; older pages load as the list is scrolled
+        self.history_cust_id = cust_id
+        self.history_loaded_rows = 0
+        self.history_range = date_range
+        self.load_history_page()
+   
+    def history_date_range(self):
+        """The From/To dates entered on the history tab, or None after showing an error"""
+        start = self.history_from_entry.get().strip() or None
+        end = self.history_to_entry.get().strip() or None
+        for value in (start, end):
+            if value is None:
+                continue
+            try:
+                datetime.datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format")
+                return None
+        return start, end
+   
+    def load_history_page(self):
+        """Append the next page of the selected customer's history to the treeview"""
+        cust_id = self.history_cust_id
+        if cust_id is None or self.history_loaded_rows >= self.ledger.history_count(cust_id, *self.history_range):
+            return
+        page = self.ledger.history(cust_id, self.history_loaded_rows, HISTORY_PAGE_SIZE, newest_first=True,
+                                   start=self.history_range[0], end=self.history_range[1])
+        self.history_loaded_rows += len(page)
+       
         # Add transactions to treeview
-        for trans in customer["transactions"]:
+        for trans in page:
             recipient_id = trans.get("recipient_id", "")
             trans_type = trans["type"].replace("_", " ").title()
             transaction_id = trans.get("transaction_id", "")
@@ -695,6 +729,74 @@ Please select the appropriate tab to perform your desired action."""
                 transaction_id,
                 utr
             ))
+   
+    def display_statement_gui(self):
+        """Show an account statement for the entered customer and date range"""
+        cust_id = self.history_cust_id_entry.get().strip().upper()
+        if not cust_id:
+            messagebox.showerror("Error", "Please enter a Customer ID")
+            return
+       
+        if cust_id not in self.ledger.customers:
+            messagebox.showerror("Error", "Customer ID not found!")
+            return
+       
+        date_range = self.history_date_range()
+        if date_range is None:
+            return
+        if None in date_range:
+            messagebox.showerror("Error", "Please enter both From and To dates for a statement")
+            return
+       
+        statement = self.ledger.statement(cust_id, *date_range)
+       
+        window = tk.Toplevel(self.root)
+        window.title(f"Statement - {cust_id}")
+        text = scrolledtext.ScrolledText(window, width=110, height=30, font=("Courier", 9))
+        text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        text.insert(tk.END, format_statement(statement))
+        text.config(state=tk.DISABLED)
+   
+    def display_analytics_gui(self, reload=False):
+        """Run the selected analytics report and show it in the treeview"""
+        try:
+            from analytics import QUERIES, Analytics
+        except ImportError:
+            messagebox.showerror("Error", "The analytics reports need NumPy (pip install numpy)")
+            return
+       
+        name = self.analytics_query_combo.get()
+        cust_id = self.analytics_cust_id_entry.get().strip().upper()
+        if QUERIES[name][0] == "top_counterparties":
+            if not cust_id:
+                messagebox.showerror("Error", "Please enter a Customer ID")
+                return
+            if cust_id not in self.ledger.customers:
+                messagebox.showerror("Error", "Customer ID not found!")
+                return
+       
+        # The column arrays are a snapshot: built on first use and on Reload Data
+        if self.analytics is None or reload:
+            self.analytics = Analytics.from_ledger(self.ledger)
+        if cust_id and cust_id not in self.analytics.customer_index:
+            self.analytics = Analytics.from_ledger(self.ledger)
+        rows = self.analytics.run(name, cust_id)
+       
+        columns = QUERIES[name][1]
+        for item in self.analytics_tree.get_children():
+            self.analytics_tree.delete(item)
+        self.analytics_tree.configure(columns=columns)
+        for column in columns:
+            self.analytics_tree.heading(column, text=column)
+            self.analytics_tree.column(column, width=120)
+       
+        if not rows:
+            self.analytics_tree.insert("", tk.END, values=("No transactions found",))
+            return
+        for row in rows:
+            self.analytics_tree.insert("", tk.END, values=[
+                f"₹{value:,.2f}" if isinstance(value, float) else value for value in row
+            ])
 
 def main():
     """Main function to run the application"""
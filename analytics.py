@@ -0,0 +1,220 @@
+"""Vectorized aggregates over the ledger's transfers (requires numpy)"""
+import datetime
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ledger import DATE_FORMAT, TRANSACTION_TYPES, Ledger, parse_date_bound
+from storage import JournalStorage, SqliteStorage
+from txstore import to_paise
+
+# Queries offered by the Analytics tab: name -> (method, column headings)
+QUERIES = {
+    "Volume by type per day": ("volume_by_type_per_day", ["Day", "Type", "Transfers", "Volume"]),
+    "Net flow by area": ("net_flow_by_area", ["Area", "Inflow", "Outflow", "Net"]),
+    "Balances by account type": ("balance_distribution", ["Account Type", "Customers", "Total", "Mean",
+                                                          "Median", "90th Percentile", "Max"]),
+    "Top counterparties": ("top_counterparties", ["Counterparty", "Transfers", "Volume"]),
+}
+
+
+def _codes(values: List[str]) -> Tuple[np.ndarray, List[str]]:
+    """Integer code per value plus the sorted list of distinct values"""
+    names = sorted(set(values))
+    lookup = {name: code for code, name in enumerate(names)}
+    return np.fromiter((lookup[value] for value in values), dtype=np.int32, count=len(values)), names
+
+
+def _local_seconds(epochs: np.ndarray) -> np.ndarray:
+    """Shift epoch seconds to local wall-clock seconds (so days split at local midnight)"""
+    if not len(epochs):
+        return epochs
+    hours, inverse = np.unique(epochs // 3600, return_inverse=True)
+    offsets = np.fromiter((time.localtime(int(hour) * 3600).tm_gmtoff for hour in hours),
+                          dtype=np.int64, count=len(hours))
+    return epochs + offsets[inverse.reshape(-1)]
+
+
+class Analytics:
+    """Column arrays of every transfer and customer, with group-by queries
+
+    Each transfer is one row (its sender leg): local timestamp in seconds,
+    amount in paise, a type code into `types`, and sender and recipient
+    row numbers into `customer_ids` (-1 for counterparties that are not
+    customers).  Build it with from_ledger(); it is a snapshot and does not
+    follow later transfers.
+    """
+
+    def __init__(self, customer_ids: List[str], areas: List[str], account_types: List[str], balances: List[float]):
+        self.customer_ids = customer_ids
+        self.customer_index = {cust_id: row for row, cust_id in enumerate(customer_ids)}
+        self.area, self.area_names = _codes(areas)
+        self.account_type, self.account_type_names = _codes(account_types)
+        self.balance = np.array([to_paise(balance) for balance in balances], dtype=np.int64)
+        self.types: List[str] = list(TRANSACTION_TYPES)
+        self.timestamp = np.zeros(0, dtype=np.int64)
+        self.amount = np.zeros(0, dtype=np.int64)
+        self.type_code = np.zeros(0, dtype=np.int16)
+        self.sender = np.zeros(0, dtype=np.int32)
+        self.recipient = np.zeros(0, dtype=np.int32)
+
+    @classmethod
+    def from_ledger(cls, ledger: Ledger) -> "Analytics":
+        """Load the ledger's customers and all of its transfers, checkpointed and in memory"""
+        customers = list(ledger.customers.items())
+        analytics = cls([cust_id for cust_id, _ in customers], [info["area"] for _, info in customers],
+                        [info["account_type"] for _, info in customers], [info["balance"] for _, info in customers])
+        storage = ledger.storage
+        if isinstance(storage, JournalStorage):
+            analytics._add_store(storage)
+        elif isinstance(storage, SqliteStorage):
+            analytics._add_sqlite(storage)
+        recent = ledger.recent_transfers()
+        analytics._append(
+            np.array([timestamp for timestamp, _, _ in recent], dtype=np.int64),
+            np.array([leg.amount_paise for _, _, leg in recent], dtype=np.int64),
+            [leg.type for _, _, leg in recent],
+            [sender for _, sender, _ in recent],
+            [leg.recipient_id for _, _, leg in recent],
+        )
+        return analytics
+
+    def _type_code(self, leg_type: str) -> int:
+        """Code of a leg type such as "upi_out", adding unknown types to `types`"""
+        name = leg_type.rsplit("_", 1)[0]
+        for code, known in enumerate(self.types):
+            if known.lower() == name:
+                return code
+        self.types.append(name)
+        return len(self.types) - 1
+
+    def _rows(self, cust_ids: np.ndarray) -> np.ndarray:
+        """Customer row per ID (-1 if unknown), decoding each distinct ID once"""
+        distinct, inverse = np.unique(cust_ids, return_inverse=True)
+        rows = np.fromiter(
+            (self.customer_index.get(cust_id.decode("ascii") if isinstance(cust_id, bytes) else cust_id, -1)
+             for cust_id in distinct.tolist()), dtype=np.int32, count=len(distinct))
+        return rows[inverse.reshape(-1)]
+
+    def _append(self, epochs: np.ndarray, amounts: np.ndarray, leg_types, senders, recipients):
+        if not len(epochs):
+            return
+        distinct, inverse = np.unique(np.asarray(leg_types), return_inverse=True)
+        codes = np.array([self._type_code(str(leg_type)) for leg_type in distinct.tolist()], dtype=np.int16)
+        self.timestamp = np.concatenate([self.timestamp, _local_seconds(epochs)])
+        self.amount = np.concatenate([self.amount, amounts])
+        self.type_code = np.concatenate([self.type_code, codes[inverse.reshape(-1)]])
+        self.sender = np.concatenate([self.sender, self._rows(np.asarray(senders))])
+        self.recipient = np.concatenate([self.recipient, self._rows(np.asarray(recipients))])
+
+    def _add_store(self, storage: JournalStorage):
+        """Transfers checkpointed into the binary transaction store, read without decoding"""
+        store = storage.checkpointer.store
+        records = store.to_numpy()[:storage.checkpointer.history_boundary]
+        if not len(records):
+            return
+        is_out = np.array([False] + [name.endswith("_out") for name in store.types.names])
+        out = records[is_out[records["type_code"]]]
+        type_names = np.array([""] + store.types.names)
+        self._append(out["timestamp"].astype(np.int64), out["amount"].astype(np.int64),
+                     type_names[out["type_code"]], out["customer_id"], out["counterparty_id"])
+
+    def _add_sqlite(self, storage: SqliteStorage):
+        """Transfers stored in SQLite before the ledger was loaded"""
+        with storage._reader() as connection:
+            rows = connection.execute(
+                "SELECT date, amount_paise, type, customer_id, recipient_id FROM transactions "
+                "WHERE seq <= ? AND type LIKE '%\\_out' ESCAPE '\\' ORDER BY seq",
+                (storage.history_boundary,)).fetchall()
+        if not rows:
+            return
+        dates, amounts, leg_types, senders, recipients = zip(*rows)
+        distinct, inverse = np.unique(np.array(dates), return_inverse=True)
+        epochs = np.array([datetime.datetime.strptime(date, DATE_FORMAT).timestamp() for date in distinct.tolist()],
+                          dtype=np.int64)
+        self._append(epochs[inverse.reshape(-1)], np.array(amounts, dtype=np.int64), leg_types, senders, recipients)
+
+    def _period(self, start=None, end=None) -> np.ndarray:
+        """Boolean mask of transfers dated within start..end (None = unbounded)"""
+        mask = np.ones(len(self.timestamp), dtype=bool)
+        if start is not None:
+            start_text = parse_date_bound(start)
+            mask &= self.timestamp >= _naive_seconds(start_text)
+        if end is not None:
+            end_text = parse_date_bound(end, end=True)
+            mask &= self.timestamp <= _naive_seconds(end_text)
+        return mask
+
+    def volume_by_type_per_day(self, start=None, end=None) -> List[Tuple[str, str, int, float]]:
+        """(day, transaction type, transfers, volume) for every day and type with transfers"""
+        mask = self._period(start, end)
+        days = self.timestamp[mask] // 86400
+        codes = self.type_code[mask].astype(np.int64)
+        keys, inverse = np.unique(days * len(self.types) + codes, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, minlength=len(keys))
+        volumes = np.bincount(inverse, weights=self.amount[mask], minlength=len(keys))
+        epoch = datetime.date(1970, 1, 1)
+        return [
+            ((epoch + datetime.timedelta(days=int(key // len(self.types)))).isoformat(),
+             self.types[int(key % len(self.types))], int(count), volume / 100)
+            for key, count, volume in zip(keys.tolist(), counts.tolist(), volumes.tolist())
+        ]
+
+    def net_flow_by_area(self, start=None, end=None) -> List[Tuple[str, float, float, float]]:
+        """(area, money received, money sent, net) between customers, by the customer's area"""
+        mask = self._period(start, end)
+        sent_mask = mask & (self.sender >= 0)
+        received_mask = mask & (self.recipient >= 0)
+        areas = len(self.area_names)
+        outflow = np.bincount(self.area[self.sender[sent_mask]], weights=self.amount[sent_mask], minlength=areas)
+        inflow = np.bincount(self.area[self.recipient[received_mask]], weights=self.amount[received_mask],
+                             minlength=areas)
+        return [(name, received / 100, sent / 100, (received - sent) / 100)
+                for name, received, sent in zip(self.area_names, inflow.tolist(), outflow.tolist())]
+
+    def balance_distribution(self) -> List[Tuple[str, int, float, float, float, float, float]]:
+        """(account type, customers, total, mean, median, 90th percentile, max) of current balances"""
+        order = np.argsort(self.account_type, kind="stable")
+        groups = np.split(self.balance[order], np.cumsum(np.bincount(self.account_type,
+                                                                      minlength=len(self.account_type_names)))[:-1])
+        results = []
+        for name, balances in zip(self.account_type_names, groups):
+            if not len(balances):
+                continue
+            median, p90 = np.percentile(balances, [50, 90])
+            results.append((name, len(balances), int(balances.sum()) / 100, float(balances.mean()) / 100,
+                            float(median) / 100, float(p90) / 100, int(balances.max()) / 100))
+        return results
+
+    def top_counterparties(self, cust_id: str, limit: int = 10) -> List[Tuple[str, int, float]]:
+        """(counterparty, transfers, volume) of the customers a customer deals with most, by volume"""
+        row = self.customer_index.get(cust_id)
+        if row is None:
+            raise KeyError(cust_id)
+        sent = self.sender == row
+        received = self.recipient == row
+        counterparties = np.concatenate([self.recipient[sent], self.sender[received]])
+        amounts = np.concatenate([self.amount[sent], self.amount[received]])
+        known = counterparties >= 0
+        counterparties, amounts = counterparties[known], amounts[known]
+        counts = np.bincount(counterparties, minlength=len(self.customer_ids))
+        volumes = np.bincount(counterparties, weights=amounts, minlength=len(self.customer_ids))
+        top = np.argsort(-volumes, kind="stable")[:limit]
+        return [(self.customer_ids[other], int(counts[other]), float(volumes[other]) / 100)
+                for other in top.tolist() if counts[other]]
+
+    def run(self, name: str, cust_id: Optional[str] = None, start=None, end=None) -> List[Tuple]:
+        """Run one of QUERIES by name"""
+        method = QUERIES[name][0]
+        if method == "top_counterparties":
+            return self.top_counterparties(cust_id)
+        if method == "balance_distribution":
+            return self.balance_distribution()
+        return getattr(self, method)(start, end)
+
+
+def _naive_seconds(text: str) -> int:
+    """Wall-clock seconds of a DATE_FORMAT timestamp, comparable with Analytics.timestamp"""
+    return int((datetime.datetime.strptime(text, DATE_FORMAT) - datetime.datetime(1970, 1, 1)).total_seconds())
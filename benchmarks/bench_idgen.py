@@ -0,0 +1,53 @@
+"""Compare the snowflake ID generator with the original uuid4-based IDs
+
+Usage: python benchmarks/bench_idgen.py [count]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idgen import SnowflakeGenerator, Uuid4Generator  # noqa: E402
+
+
+def time_calls(generate, count: int) -> float:
+    """Seconds taken by count calls of generate()"""
+    start = time.perf_counter()
+    for _ in range(count):
+        generate()
+    return time.perf_counter() - start
+
+
+def collisions(ids) -> int:
+    """Number of IDs that repeat an earlier one"""
+    seen = set()
+    repeats = 0
+    for value in ids:
+        if value in seen:
+            repeats += 1
+        seen.add(value)
+    return repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the snowflake ID generator with the original uuid4-based IDs")
+    parser.add_argument("count", nargs="?", type=int, default=200000, help="IDs to generate (default: 200000)")
+    args = parser.parse_args()
+    if args.count < 1:
+        parser.error("count must be positive")
+    count = args.count
+    generators = [("uuid4 (original)", Uuid4Generator()), ("snowflake", SnowflakeGenerator(0))]
+    print(f"{'generator':<20} {'next_ids/s':>12} {'batch/s':>12} {'txn ID repeats':>15} {'UTR repeats':>12}")
+    for name, generator in generators:
+        single = time_calls(generator.next_ids, count)
+        start = time.perf_counter()
+        pairs = generator.batch(count)
+        batched = time.perf_counter() - start
+        print(f"{name:<20} {count / single:>12,.0f} {count / batched:>12,.0f} "
+              f"{collisions(pair[0] for pair in pairs):>15} {collisions(pair[1] for pair in pairs):>12}")
+
+
+if __name__ == "__main__":
+    main()
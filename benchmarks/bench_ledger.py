@@ -0,0 +1,200 @@
+"""Ledger benchmark suite: throughput, latency, load time, disk use and memory as the ledger grows
+
+Runs without a display.  Each scenario (persistence mode x transfer
+distribution x customer count) runs in a fresh process on a seeded
+workload, so its peak RSS is its own and runs on different commits do
+identical work.  Results are printed as JSON (or written to --output).
+
+Usage: python benchmarks/bench_ledger.py [--modes journal,sqlite] [--sizes 1000,10000]
+           [--transfers-per-customer 10] [--distributions uniform,skewed] [--fsync always|every:N|interval:MS]
+           [--seed 42] [--output results.json]
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import FsyncPolicy  # noqa: E402
+from ledger import Ledger  # noqa: E402
+from workload import DISTRIBUTIONS, WorkloadGenerator  # noqa: E402
+
+# Customers whose first history page is timed per scenario (the History tab's first query)
+HISTORY_SAMPLES = 200
+
+# Rows per history page, as on the History tab
+HISTORY_PAGE_SIZE = 100
+
+
+def fsync_policy(text: str) -> FsyncPolicy:
+    """Parse "always", "every:N" or "interval:MS\""""
+    name, _, value = text.partition(":")
+    if name == "always":
+        return FsyncPolicy.always()
+    if name == "every":
+        return FsyncPolicy.every(int(value))
+    if name == "interval":
+        return FsyncPolicy.interval(int(value))
+    raise argparse.ArgumentTypeError(f"Unknown fsync policy: {text}")
+
+
+def make_ledger(mode: str, directory: str, fsync: str) -> Ledger:
+    """A ledger with no default customers, persisting under directory"""
+    return Ledger(mode, os.path.join(directory, "journal"), os.path.join(directory, "bank.csv"), fsync_policy(fsync),
+                  sqlite_path=os.path.join(directory, "bank.sqlite3"), customers={})
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50 and p99 of samples in milliseconds"""
+    if len(samples) < 2:
+        value = samples[0] * 1000 if samples else None
+        return {"p50": value, "p99": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49] * 1000, "p99": cuts[98] * 1000}
+
+
+def disk_bytes(directory: str) -> int:
+    """Total size of the files under directory"""
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def peak_rss() -> Optional[int]:
+    """Peak resident set size of this process in bytes (None where the resource module is missing)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_scenario(mode: str, distribution: str, customers: int, transfers: int, fsync: str, seed: int,
+                 workdir: Optional[str]) -> Dict:
+    """Register customers, run the transfer stream, time history pages and a reload; return the measurements"""
+    directory = tempfile.mkdtemp(prefix=f"bench-{mode}-", dir=workdir)
+    generator = WorkloadGenerator(seed)
+    # The ledger reports progress with print(); keep stdout for the JSON results
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            ledger = make_ledger(mode, directory, fsync)
+            ledger.load()
+            start = time.perf_counter()
+            registered = ledger.register_many(generator.customers(customers))
+            register_seconds = time.perf_counter() - start
+            cust_ids = [result.customer_id for result in registered if result.ok]
+            requests = generator.transfers(cust_ids, transfers, distribution)
+
+            latencies = []
+            rejected = 0
+            start = time.perf_counter()
+            for request in requests:
+                began = time.perf_counter()
+                result = ledger.transfer(*request)
+                latencies.append(time.perf_counter() - began)
+                rejected += not result.ok
+            transfer_seconds = time.perf_counter() - start
+
+            history = []
+            sample = random.Random(seed).sample(cust_ids, min(HISTORY_SAMPLES, len(cust_ids)))
+            for cust_id in sample:
+                began = time.perf_counter()
+                ledger.history_count(cust_id)
+                ledger.history(cust_id, 0, HISTORY_PAGE_SIZE)
+                history.append(time.perf_counter() - began)
+            ledger.close()
+            size = disk_bytes(directory)
+
+            start = time.perf_counter()
+            reloaded = make_ledger(mode, directory, fsync)
+            reloaded.load()
+            load_seconds = time.perf_counter() - start
+            reloaded.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    applied = transfers - rejected
+    return {
+        "mode": mode,
+        "distribution": distribution,
+        "fsync": fsync,
+        "customers": len(cust_ids),
+        "transfers": transfers,
+        "rejected": rejected,
+        "register_seconds": register_seconds,
+        "transfers_per_second": transfers / transfer_seconds if transfer_seconds else None,
+        "transfer_latency_ms": percentiles(latencies),
+        "history_page_ms": percentiles(history),
+        "load_seconds": load_seconds,
+        "disk_bytes": size,
+        "bytes_per_transaction": size / applied if applied else None,
+        "peak_rss_bytes": peak_rss(),
+    }
+
+
+def git_commit() -> Optional[str]:
+    """Commit of the working tree being measured, if it is a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ledger on seeded synthetic workloads")
+    parser.add_argument("--modes", default="journal,sqlite", help="comma-separated persistence modes")
+    parser.add_argument("--sizes", default="1000,10000", help="comma-separated customer counts")
+    parser.add_argument("--transfers-per-customer", type=float, default=10.0)
+    parser.add_argument("--distributions", default=",".join(DISTRIBUTIONS))
+    parser.add_argument("--fsync", default="always", help='"always", "every:N" or "interval:MS"')
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=None, help="where scenario data is written (default: system temp)")
+    parser.add_argument("--output", default=None, help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+    fsync_policy(args.fsync)
+
+    results = []
+    for mode in args.modes.split(","):
+        for distribution in args.distributions.split(","):
+            for customers in (int(size) for size in args.sizes.split(",")):
+                transfers = int(customers * args.transfers_per_customer)
+                # A fresh process per scenario, so peak RSS and caches start clean
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    result = pool.submit(run_scenario, mode, distribution, customers, transfers, args.fsync,
+                                         args.seed, args.workdir).result()
+                print(f"{mode:<8} {distribution:<8} {customers:>8,} customers  "
+                      f"{result['transfers_per_second']:>10,.0f} transfers/s  "
+                      f"load {result['load_seconds']:.3f}s", file=sys.stderr)
+                results.append(result)
+
+    report = {
+        "benchmark": "ledger",
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
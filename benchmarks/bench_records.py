@@ -0,0 +1,81 @@
+"""Memory per in-memory transaction: the original dict legs versus records.Transaction
+
+Usage: python benchmarks/bench_records.py [transfers]
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idgen import SnowflakeGenerator  # noqa: E402
+from ledger import DATE_FORMAT, LEG_TYPES  # noqa: E402
+from records import Transaction  # noqa: E402
+
+# Customers the synthetic transfers move money between
+CUSTOMERS = [f"CUST{number:03d}" for number in range(1, 1001)]
+
+
+def dict_legs(count: int, ids, start: int):
+    """Both legs of count transfers as the dicts the ledger used to build"""
+    trans_type = "UPI"
+    legs = []
+    for number in range(count):
+        sender, recipient = CUSTOMERS[number % 1000], CUSTOMERS[(number * 7 + 1) % 1000]
+        transaction_id, utr = ids[number]
+        amount = float(number % 5000 + 1)
+        current_time = datetime.datetime.fromtimestamp(start + number).strftime(DATE_FORMAT)
+        legs.append({"date": current_time, "type": f"{trans_type.lower()}_out", "amount": amount,
+                     "balance": 10000.0 + number, "recipient_id": recipient, "transaction_id": transaction_id,
+                     "utr": utr})
+        legs.append({"date": current_time, "type": f"{trans_type.lower()}_in", "amount": amount,
+                     "balance": 20000.0 + number, "recipient_id": sender, "transaction_id": transaction_id,
+                     "utr": utr})
+    return legs
+
+
+def record_legs(count: int, ids, start: int):
+    """Both legs of count transfers as Transaction records"""
+    out_type, in_type = LEG_TYPES["UPI"]
+    legs = []
+    for number in range(count):
+        sender, recipient = CUSTOMERS[number % 1000], CUSTOMERS[(number * 7 + 1) % 1000]
+        transaction_id, utr = ids[number]
+        amount = (number % 5000 + 1) * 100
+        timestamp = start + number
+        legs.append(Transaction(timestamp, out_type, amount, 1000000 + number * 100, recipient,
+                                transaction_id, utr))
+        legs.append(Transaction(timestamp, in_type, amount, 2000000 + number * 100, sender,
+                                transaction_id, utr))
+    return legs
+
+
+def measure(build, count: int, ids, start: int) -> float:
+    """Bytes allocated per leg by build() (IDs are pre-generated and not counted)"""
+    tracemalloc.start()
+    legs = build(count, ids, start)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / len(legs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per transaction: dict legs versus records.Transaction")
+    parser.add_argument("transfers", nargs="?", type=int, default=200000, help="transfers to build (default: 200000)")
+    args = parser.parse_args()
+    if args.transfers < 1:
+        parser.error("transfers must be positive")
+    count = args.transfers
+    ids = SnowflakeGenerator(0).batch(count)
+    start = int(time.time())
+    print(f"{'layout':<20} {'bytes/leg':>10} {'bytes/transfer':>15}")
+    for name, build in [("dict (original)", dict_legs), ("Transaction", record_legs)]:
+        per_leg = measure(build, count, ids, start)
+        print(f"{name:<20} {per_leg:>10,.0f} {per_leg * 2:>15,.0f}")
+
+
+if __name__ == "__main__":
+    main()
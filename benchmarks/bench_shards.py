@@ -0,0 +1,112 @@
+"""Sharded ledger benchmark: transfer throughput as the shard count grows
+
+For each shard count, registers a seeded set of customers on a fresh
+ShardedLedger, sends the transfer stream in batches through
+transfer_many() and checks that the money in the bank is unchanged.
+Shards are separate processes, so throughput can only scale while there
+are idle cores: compare counts up to os.cpu_count().  Shard workers log
+to this process's stdout, so use --output for clean JSON.
+
+Usage: python benchmarks/bench_shards.py [--shards 1,2,4,8] [--customers 10000]
+           [--transfers 100000] [--batch 1000] [--distribution uniform|skewed]
+           [--fsync always|every:N|interval:MS] [--seed 42] [--output results.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_ledger import fsync_policy, git_commit  # noqa: E402
+from sharding import ShardedLedger  # noqa: E402
+from workload import DISTRIBUTIONS, WorkloadGenerator  # noqa: E402
+
+
+def run_shards(shards: int, customers: int, transfers: int, batch: int, distribution: str, fsync: str,
+               seed: int, workdir: Optional[str]) -> Dict:
+    """Register customers, run the transfer stream on shards workers and check conservation"""
+    directory = tempfile.mkdtemp(prefix=f"bench-shards-{shards}-", dir=workdir)
+    generator = WorkloadGenerator(seed)
+    try:
+        with ShardedLedger(directory, shards, fsync_policy(fsync), customers={}) as ledger:
+            start = time.perf_counter()
+            registered = ledger.register_many(generator.customers(customers))
+            register_seconds = time.perf_counter() - start
+            cust_ids = [result.customer_id for result in registered if result.ok]
+            requests = generator.transfers(cust_ids, transfers, distribution)
+            cross = sum(ledger.shard_of(sender) != ledger.shard_of(recipient) for sender, recipient, _, _ in requests)
+            before = ledger.totals()
+
+            rejected = 0
+            start = time.perf_counter()
+            for first in range(0, len(requests), batch):
+                rejected += sum(not result.ok for result in ledger.transfer_many(requests[first:first + batch]))
+            transfer_seconds = time.perf_counter() - start
+            after = ledger.totals()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        "shards": shards,
+        "customers": len(cust_ids),
+        "transfers": transfers,
+        "cross_shard": cross,
+        "rejected": rejected,
+        "batch": batch,
+        "distribution": distribution,
+        "fsync": fsync,
+        "register_seconds": register_seconds,
+        "transfers_per_second": transfers / transfer_seconds if transfer_seconds else None,
+        "conserved": before["balance_paise"] == after["balance_paise"] and after["held_paise"] == 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sharded ledger at several shard counts")
+    parser.add_argument("--shards", default="1,2,4", help="comma-separated shard counts")
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--transfers", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=1000, help="transfers per transfer_many() call")
+    parser.add_argument("--distribution", default=DISTRIBUTIONS[0], choices=DISTRIBUTIONS)
+    parser.add_argument("--fsync", default="always", help='"always", "every:N" or "interval:MS"')
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=None, help="where shard data is written (default: system temp)")
+    parser.add_argument("--output", default=None, help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+    fsync_policy(args.fsync)
+
+    results = []
+    for shards in (int(count) for count in args.shards.split(",")):
+        result = run_shards(shards, args.customers, args.transfers, args.batch, args.distribution, args.fsync,
+                            args.seed, args.workdir)
+        print(f"{shards:>3} shards  {result['transfers_per_second']:>10,.0f} transfers/s  "
+              f"{result['cross_shard'] / result['transfers']:.0%} cross-shard  "
+              f"{'conserved' if result['conserved'] else 'NOT CONSERVED'}", file=sys.stderr)
+        results.append(result)
+
+    report = {
+        "benchmark": "shards",
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Start-up benchmark: how long the command-line front end takes to answer a query from cold
+
+Builds a seeded data directory, then times fresh `cli.py balance` and
+`cli.py history` processes against a bare interpreter start (the part no
+code change can remove) and checks that importing cli does not pull in
+tkinter.  Each command runs --runs times; the first run warms the page
+cache and bytecode, so only the rest are reported.
+
+Usage: python benchmarks/bench_startup.py [--mode journal|sqlite] [--customers 10000]
+           [--transfers 200000] [--runs 10] [--seed 42] [--output results.json]
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_ledger import git_commit, percentiles  # noqa: E402
+from ledger import Ledger  # noqa: E402
+from workload import DISTRIBUTIONS, WorkloadGenerator  # noqa: E402
+
+CLI = os.path.join(ROOT, "cli.py")
+
+# Transfers per transfer_many() call while building the data directory
+BUILD_BATCH = 10000
+
+
+def build(mode: str, directory: str, customers: int, transfers: int, seed: int) -> List[str]:
+    """Fill directory with the files cli.py reads; returns the registered customer IDs"""
+    generator = WorkloadGenerator(seed)
+    with contextlib.redirect_stdout(sys.stderr):
+        ledger = Ledger(mode, os.path.join(directory, "bank_journal"), os.path.join(directory, "bank_transactions.csv"),
+                        sqlite_path=os.path.join(directory, "bank.sqlite3"), customers={})
+        ledger.load()
+        cust_ids = [result.customer_id for result in ledger.register_many(generator.customers(customers)) if result.ok]
+        requests = generator.transfers(cust_ids, transfers, DISTRIBUTIONS[0])
+        for first in range(0, len(requests), BUILD_BATCH):
+            ledger.transfer_many(requests[first:first + BUILD_BATCH])
+        ledger.close()
+    return cust_ids
+
+
+def time_command(command: List[str], runs: int) -> Dict:
+    """Wall-clock percentiles of running command in fresh processes, after one warm-up run"""
+    samples = []
+    for run in range(runs + 1):
+        began = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        if run:
+            samples.append(time.perf_counter() - began)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold-start queries through cli.py")
+    parser.add_argument("--mode", default="journal", choices=["journal", "sqlite"])
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--transfers", type=int, default=200000)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=None, help="where the data directory is built (default: system temp)")
+    parser.add_argument("--output", default=None, help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench-startup-", dir=args.workdir)
+    try:
+        cust_ids = build(args.mode, directory, args.customers, args.transfers, args.seed)
+        query = [sys.executable, CLI, "--mode", args.mode, "--data-dir", directory]
+        imports = subprocess.run([sys.executable, "-c", "import sys, cli; print('tkinter' in sys.modules)"],
+                                 capture_output=True, text=True, check=True, cwd=ROOT).stdout.strip()
+        results = {
+            "interpreter_ms": time_command([sys.executable, "-c", "pass"], args.runs),
+            "balance_ms": time_command(query + ["balance", cust_ids[0]], args.runs),
+            "history_ms": time_command(query + ["history", cust_ids[0]], args.runs),
+            "cli_imports_tkinter": imports == "True",
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(f"interpreter {results['interpreter_ms']['p50']:.0f} ms, balance {results['balance_ms']['p50']:.0f} ms, "
+          f"history {results['history_ms']['p50']:.0f} ms (p50)", file=sys.stderr)
+
+    report = {
+        "benchmark": "startup",
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mode": args.mode,
+        "customers": len(cust_ids),
+        "transfers": args.transfers,
+        "seed": args.seed,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Load-test client for server.py: concurrent keep-alive connections replaying a seeded workload
+
+Registers the workload's customers, then sends transfers (and, if asked,
+balance and history reads) over --concurrency connections and reports
+throughput, latency percentiles and status codes as JSON.  With --spawn
+it starts a server on a free local port with a fresh data directory.
+
+Usage: python benchmarks/load_client.py [--host 127.0.0.1 --port 8080 | --spawn [--mode journal]]
+           [--customers 1000] [--requests 20000] [--concurrency 64] [--distribution uniform|skewed]
+           [--batch N] [--read-ratio 0.1] [--seed 42] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workload import DISTRIBUTIONS, WorkloadGenerator  # noqa: E402
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+
+# Seconds to wait for a spawned server to accept connections
+SPAWN_TIMEOUT = 30
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection sending JSON requests"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, payload=None) -> Tuple[int, Dict]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n" \
+               f"Content-Length: {len(body)}\r\n\r\n"
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        data = await self.reader.readexactly(length)
+        return status, json.loads(data) if data else {}
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+def transfer_body(request) -> Dict:
+    sender, recipient, amount, trans_type = request
+    return {"sender_id": sender, "recipient_id": recipient, "amount": amount, "type": trans_type}
+
+
+async def run_requests(host: str, port: int, jobs: List[Tuple[str, str, Optional[Dict]]],
+                       concurrency: int) -> Tuple[List[float], Counter, float]:
+    """Send jobs over concurrency connections; returns (latencies, status counts, seconds)"""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    queue = iter(jobs)
+
+    async def client():
+        connection = Connection(host, port)
+        try:
+            for method, path, payload in queue:
+                began = time.perf_counter()
+                status, _ = await connection.request(method, path, payload)
+                latencies.append(time.perf_counter() - began)
+                statuses[status] += 1
+        finally:
+            await connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50, p99 and max of samples in milliseconds"""
+    if len(samples) < 2:
+        value = samples[0] * 1000 if samples else None
+        return {"p50": value, "p99": value, "max": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49] * 1000, "p99": cuts[98] * 1000, "max": max(samples) * 1000}
+
+
+async def load_test(args, host: str, port: int) -> Dict:
+    generator = WorkloadGenerator(args.seed)
+    # A run tag keeps names unique when the same server is tested again
+    tag = f"{random.getrandbits(32):08x}"
+    registrations = [("POST", "/customers", {"name": f"{name} {tag}", "account_type": account_type, "dob": dob,
+                                             "address": address, "area": area, "balance": balance})
+                     for name, account_type, dob, address, area, balance in generator.customers(args.customers)]
+    connection = Connection(host, port)
+    cust_ids = []
+    start = time.perf_counter()
+    for _, path, payload in registrations:
+        status, body = await connection.request("POST", path, payload)
+        if status == 201:
+            cust_ids.append(body["customer_id"])
+    register_seconds = time.perf_counter() - start
+    await connection.close()
+
+    rng = random.Random(args.seed)
+    transfers = generator.transfers(cust_ids, args.requests * max(args.batch, 1), args.distribution)
+    jobs: List[Tuple[str, str, Optional[Dict]]] = []
+    for number in range(args.requests):
+        if rng.random() < args.read_ratio:
+            cust_id = rng.choice(cust_ids)
+            jobs.append(("GET", f"/customers/{cust_id}/balance", None) if rng.random() < 0.5 else
+                        ("GET", f"/customers/{cust_id}/history?limit=50", None))
+        elif args.batch:
+            chunk = transfers[number * args.batch:(number + 1) * args.batch]
+            jobs.append(("POST", "/transfers/batch", {"transfers": [transfer_body(request) for request in chunk]}))
+        else:
+            jobs.append(("POST", "/transfers", transfer_body(transfers[number])))
+    latencies, statuses, seconds = await run_requests(host, port, jobs, args.concurrency)
+    writes = sum(1 for method, _, _ in jobs if method == "POST")
+    return {
+        "customers": len(cust_ids),
+        "register_seconds": register_seconds,
+        "requests": len(jobs),
+        "transfers": writes * max(args.batch, 1),
+        "concurrency": args.concurrency,
+        "distribution": args.distribution,
+        "batch": args.batch,
+        "read_ratio": args.read_ratio,
+        "seconds": seconds,
+        "requests_per_second": len(jobs) / seconds if seconds else None,
+        "transfers_per_second": writes * max(args.batch, 1) / seconds if seconds else None,
+        "latency_ms": percentiles(latencies),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def spawn_server(mode: str, directory: str, extra: List[str]) -> Tuple[subprocess.Popen, int]:
+    """Start server.py on a free port and wait until it accepts connections"""
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SERVER, "--mode", mode, "--data-dir", directory, "--port", str(port),
+                                *extra], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + SPAWN_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py exited with status {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("server.py did not start listening in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--spawn", action="store_true", help="start a local server with a fresh data directory")
+    parser.add_argument("--mode", default="journal", help="persistence mode of a spawned server")
+    parser.add_argument("--server-args", default="", help="extra arguments for a spawned server")
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--distribution", default=DISTRIBUTIONS[0], choices=DISTRIBUTIONS)
+    parser.add_argument("--batch", type=int, default=0, help="transfers per POST /transfers/batch (0: single)")
+    parser.add_argument("--read-ratio", type=float, default=0.0, help="share of balance/history reads")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    process, directory = None, None
+    host, port = args.host, args.port
+    if args.spawn:
+        directory = tempfile.mkdtemp(prefix="bench-server-")
+        process, port = spawn_server(args.mode, directory, args.server_args.split())
+        host = "127.0.0.1"
+    try:
+        result = asyncio.run(load_test(args, host, port))
+    finally:
+        if process is not None:
+            # SIGINT lets the server close its ledger cleanly
+            process.send_signal(signal.SIGINT)
+            process.wait()
+            shutil.rmtree(directory, ignore_errors=True)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    print(f"{result['requests_per_second']:,.0f} requests/s, p99 {result['latency_ms']['p99']:.2f} ms, "
+          f"statuses {result['statuses']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Seeded synthetic customers and transfer streams for the ledger benchmarks
+
+The same seed always yields the same customers and the same transfers, so
+runs of bench_ledger.py on different commits measure identical work.
+"""
+import bisect
+import itertools
+import os
+import random
+import sys
+from typing import List, Optional, Sequence, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import ACCOUNT_TYPES, TRANSACTION_TYPES, TRANSFER_LIMIT  # noqa: E402
+
+# Transfer streams: every account equally likely, or a few hot accounts doing most of the traffic
+UNIFORM = "uniform"
+SKEWED = "skewed"
+DISTRIBUTIONS = [UNIFORM, SKEWED]
+
+# Zipf exponent of the skewed stream (1.1: the top 1% of accounts take roughly half the transfers)
+ZIPF_EXPONENT = 1.1
+
+AREAS = ["Andheri", "Bandra", "Colaba", "Dadar", "Kurla", "Malad", "Powai", "Thane", "Vashi", "Worli"]
+
+# Syllables for generated names; a serial number keeps every name unique
+NAME_SYLLABLES = ["ra", "vi", "an", "ka", "mi", "sh", "pr", "ya", "de", "su", "ni", "ta", "la", "go", "ve"]
+
+
+class WorkloadGenerator:
+    """Deterministic customers and transfers for a seed"""
+
+    def __init__(self, seed: int = 42):
+        self.seed = seed
+        self.random = random.Random(seed)
+
+    def customers(self, count: int) -> List[Tuple[str, str, str, str, str, float]]:
+        """Registration requests (name, account type, DOB, address, area, balance)"""
+        rng = self.random
+        requests = []
+        for number in range(count):
+            name = "".join(rng.choice(NAME_SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+            requests.append((
+                f"{name} {number}",
+                rng.choice(ACCOUNT_TYPES),
+                f"{rng.randint(1950, 2005)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                f"{rng.randint(1, 999)} {rng.choice(AREAS)} Road",
+                rng.choice(AREAS),
+                # Enough that senders rarely run dry during a run
+                float(rng.randint(1000, 5000) * 1000),
+            ))
+        return requests
+
+    def transfers(self, cust_ids: Sequence[str], count: int,
+                  distribution: str = UNIFORM) -> List[Tuple[str, str, float, str]]:
+        """Transfer requests (sender, recipient, amount, type) between distinct customers"""
+        if len(cust_ids) < 2:
+            raise ValueError("Transfers need at least two customers")
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution: {distribution}")
+        rng = self.random
+        cumulative: Optional[List[float]] = None
+        if distribution == SKEWED:
+            # Rank accounts in a seeded shuffle so hot accounts are not simply the oldest ones
+            cust_ids = list(cust_ids)
+            rng.shuffle(cust_ids)
+            cumulative = list(itertools.accumulate(1 / rank ** ZIPF_EXPONENT for rank in range(1, len(cust_ids) + 1)))
+        requests = []
+        for _ in range(count):
+            sender, recipient = self._pick(rng, cust_ids, cumulative), self._pick(rng, cust_ids, cumulative)
+            while recipient == sender:
+                recipient = self._pick(rng, cust_ids, cumulative)
+            amount = round(rng.uniform(1, TRANSFER_LIMIT / 10), 2)
+            requests.append((sender, recipient, amount, rng.choice(TRANSACTION_TYPES)))
+        return requests
+
+    @staticmethod
+    def _pick(rng: random.Random, cust_ids: Sequence[str], cumulative: Optional[List[float]]) -> str:
+        if cumulative is None:
+            return cust_ids[rng.randrange(len(cust_ids))]
+        index = bisect.bisect_left(cumulative, rng.random() * cumulative[-1])
+        return cust_ids[min(index, len(cust_ids) - 1)]
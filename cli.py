@@ -0,0 +1,237 @@
+"""Command-line front end to the ledger for scripts and display-less servers
+
+    python cli.py [--mode journal|sqlite|csv] [--data-dir .] [--json] COMMAND ...
+
+    balance CUST_ID [CUST_ID ...]         current balances
+    history CUST_ID [--limit 50] [--offset 0] [--oldest-first] [--start DATE] [--end DATE]
+    transfer SENDER RECIPIENT AMOUNT [--type UPI] [--key IDEMPOTENCY_KEY]
+    batch-transfer FILE                   CSV with sender_id, recipient_id, amount, type and an optional
+                                          idempotency_key column, applied in order
+    export [--output FILE] [--format csv|json]   every customer's details and balance
+
+Data files are the GUI's and server.py's (bank_journal/, bank.sqlite3 or
+bank_transactions.csv under --data-dir).  Nothing here imports tkinter,
+and each command loads only what it needs: balance and export read the
+snapshot and the journal tail, not the transaction history, and open the
+journal read-only, so they may run while the GUI or the server appends to
+it.  Other commands must not run while the GUI or the server has the same
+data open.
+Exit status is 0 on success, 1 if any customer was unknown or any
+transfer was rejected.
+"""
+import argparse
+import contextlib
+import csv
+import json
+import math
+import os
+import sys
+from typing import Dict, List
+
+from ledger import ERR_INVALID_AMOUNT, ERROR_MESSAGES, REGISTRATION_FIELDS, TRANSACTION_TYPES, Ledger
+from storage import JournalStorage
+
+# Transfers per commit for batch-transfer
+BATCH_CHUNK = 10000
+
+# Columns of a history line and of an export row
+HISTORY_FIELDS = ["date", "type", "amount", "balance", "recipient_id", "transaction_id", "utr"]
+EXPORT_FIELDS = ["customer_id", "name", "account_type", "dob", "address", "area", "balance"]
+
+# Commands that only load balances, so they leave the data files untouched
+READ_ONLY_COMMANDS = {"balance", "export"}
+
+
+def open_ledger(args, read_only: bool = False) -> Ledger:
+    """A ledger over the data files in --data-dir, not yet loaded (recovery messages go to stderr)
+
+    With read_only, a journal's torn tail is not truncated (it may be a
+    record the GUI or the server is still writing) and only
+    load_balances() may be called.
+    """
+    journal_dir = os.path.join(args.data_dir, "bank_journal")
+    csv_path = os.path.join(args.data_dir, "bank_transactions.csv")
+    storage = None
+    if read_only and args.mode == "journal":
+        storage = JournalStorage(journal_dir, csv_path, read_only=True)
+    with contextlib.redirect_stdout(sys.stderr):
+        return Ledger(args.mode, journal_dir, csv_path, sqlite_path=os.path.join(args.data_dir, "bank.sqlite3"),
+                      storage=storage)
+
+
+def load(ledger: Ledger, balances_only: bool = False):
+    """Load a ledger (or just its balances); its progress messages go to stderr so stdout stays parseable"""
+    with contextlib.redirect_stdout(sys.stderr):
+        if balances_only:
+            ledger.load_balances()
+        else:
+            ledger.load()
+
+
+def emit(args, rows: List[Dict], fields: List[str]):
+    """Print rows as JSON lines with --json, otherwise as tab-separated fields"""
+    for row in rows:
+        if args.json:
+            print(json.dumps(row, ensure_ascii=False))
+        else:
+            print("\t".join(f"{row[field]:.2f}" if isinstance(row[field], float) else str(row[field])
+                            for field in fields))
+
+
+def valid_amount(text: str) -> bool:
+    """Whether text is a finite number (the ledger checks its sign and limits)"""
+    try:
+        return math.isfinite(float(text))
+    except (ValueError, OverflowError):
+        return False
+
+
+def transfer_row(result) -> Dict:
+    row = {"ok": result.ok, "error": result.error, "message": result.message, "sender_id": result.sender_id,
+           "recipient_id": result.recipient_id, "amount": result.amount}
+    if result.ok:
+        row.update(transaction_id=result.transaction_id, utr=result.utr, date=result.date,
+                   sender_balance=result.sender_balance, recipient_balance=result.recipient_balance)
+    return row
+
+
+def command_balance(args, ledger: Ledger) -> int:
+    load(ledger, balances_only=True)
+    status = 0
+    rows = []
+    for cust_id in (cust_id.strip().upper() for cust_id in args.cust_ids):
+        if cust_id not in ledger.customers:
+            print(f"Customer ID not found: {cust_id}", file=sys.stderr)
+            status = 1
+            continue
+        rows.append({"customer_id": cust_id, "balance": ledger.balance(cust_id)})
+    emit(args, rows, ["customer_id", "balance"])
+    return status
+
+
+def command_history(args, ledger: Ledger) -> int:
+    if args.offset < 0 or args.limit < 0:
+        print("offset and limit must not be negative", file=sys.stderr)
+        return 1
+    load(ledger)
+    cust_id = args.cust_id.strip().upper()
+    if cust_id not in ledger.customers:
+        print(f"Customer ID not found: {cust_id}", file=sys.stderr)
+        return 1
+    try:
+        page = ledger.history(cust_id, args.offset, args.limit, not args.oldest_first, args.start, args.end)
+    except ValueError as e:
+        print(f"Invalid date: {e}", file=sys.stderr)
+        return 1
+    emit(args, [{field: trans.get(field, "") for field in HISTORY_FIELDS} for trans in page], HISTORY_FIELDS)
+    return 0
+
+
+def command_transfer(args, ledger: Ledger) -> int:
+    if not valid_amount(args.amount):
+        print(f"{ERROR_MESSAGES[ERR_INVALID_AMOUNT]} ({args.amount!r})", file=sys.stderr)
+        return 1
+    load(ledger)
+    result = ledger.transfer(args.sender_id, args.recipient_id, args.amount, args.type, args.key)
+    if args.json:
+        print(json.dumps(transfer_row(result), ensure_ascii=False))
+    elif result.ok:
+        print(f"{result.transaction_id}\t{result.utr}\t{result.sender_balance:.2f}\t{result.recipient_balance:.2f}")
+    if not result.ok:
+        print(result.message, file=sys.stderr)
+        return 1
+    return 0
+
+
+def command_batch_transfer(args, ledger: Ledger) -> int:
+    try:
+        with open(args.file, "r", newline="", encoding="utf-8") as file:
+            requests = [{"sender_id": row.get("sender_id") or "", "recipient_id": row.get("recipient_id") or "",
+                         "amount": row.get("amount") or "", "trans_type": row.get("type") or "",
+                         "idempotency_key": row.get("idempotency_key") or None}
+                        for row in csv.DictReader(file)]
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        print(f"Cannot read {args.file}: {e}", file=sys.stderr)
+        return 1
+    load(ledger)
+    results = []
+    for first in range(0, len(requests), BATCH_CHUNK):
+        results += ledger.transfer_many(requests[first:first + BATCH_CHUNK])
+    rejected = 0
+    for row_number, result in enumerate(results, start=2):
+        if args.json:
+            print(json.dumps(dict(transfer_row(result), row=row_number), ensure_ascii=False))
+        if not result.ok:
+            rejected += 1
+            if not args.json:
+                print(f"Row {row_number}: {result.message}", file=sys.stderr)
+    print(f"{len(results) - rejected} transfers applied, {rejected} rejected", file=sys.stderr)
+    return 1 if rejected else 0
+
+
+def command_export(args, ledger: Ledger) -> int:
+    load(ledger, balances_only=True)
+    rows = [dict({field: info[field] for field in REGISTRATION_FIELDS}, customer_id=cust_id)
+            for cust_id, info in sorted(ledger.customers.items())]
+    output = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        if args.format == "json":
+            json.dump(rows, output, ensure_ascii=False, indent=2)
+            output.write("\n")
+        else:
+            writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Query and update the ledger without the GUI")
+    parser.add_argument("--mode", default="journal", choices=["journal", "sqlite", "csv"])
+    parser.add_argument("--data-dir", default=".", help="holds bank_journal/, bank.sqlite3 or bank_transactions.csv")
+    parser.add_argument("--json", action="store_true", help="print JSON lines instead of tab-separated text")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    balance = commands.add_parser("balance", help="current balance of customers")
+    balance.add_argument("cust_ids", nargs="+", metavar="CUST_ID")
+    balance.set_defaults(run=command_balance)
+
+    history = commands.add_parser("history", help="a page of a customer's transactions, newest first")
+    history.add_argument("cust_id", metavar="CUST_ID")
+    history.add_argument("--limit", type=int, default=50)
+    history.add_argument("--offset", type=int, default=0)
+    history.add_argument("--oldest-first", action="store_true")
+    history.add_argument("--start", default=None, help="YYYY-MM-DD[ HH:MM:SS]")
+    history.add_argument("--end", default=None, help="YYYY-MM-DD[ HH:MM:SS]")
+    history.set_defaults(run=command_history)
+
+    transfer = commands.add_parser("transfer", help="move money between two customers")
+    transfer.add_argument("sender_id", metavar="SENDER")
+    transfer.add_argument("recipient_id", metavar="RECIPIENT")
+    transfer.add_argument("amount", metavar="AMOUNT")
+    transfer.add_argument("--type", default=TRANSACTION_TYPES[0], choices=TRANSACTION_TYPES)
+    transfer.add_argument("--key", default=None, help="idempotency key: a retry with it moves no more money")
+    transfer.set_defaults(run=command_transfer)
+
+    batch = commands.add_parser("batch-transfer", help="apply the transfers in a CSV file, in order")
+    batch.add_argument("file", metavar="FILE")
+    batch.set_defaults(run=command_batch_transfer)
+
+    export = commands.add_parser("export", help="every customer's details and balance")
+    export.add_argument("--output", default=None, help="write here instead of stdout")
+    export.add_argument("--format", default="csv", choices=["csv", "json"])
+    export.set_defaults(run=command_export)
+
+    args = parser.parse_args(argv)
+    ledger = open_ledger(args, read_only=args.command in READ_ONLY_COMMANDS)
+    try:
+        return args.run(args, ledger)
+    finally:
+        ledger.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
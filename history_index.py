@@ -0,0 +1,164 @@
+"""Per-customer index into the transaction store for paged history queries"""
+import os
+import struct
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from txstore import TransactionStore
+
+INDEX_FILE = "transactions.hidx"
+# Back-pointer file of earlier versions (previous record only); replaced by a rebuild on load
+LEGACY_PREV_FILE = "transactions.prev"
+
+# Per store record: previous record of the same customer, jump pointer, position in the customer's history
+ENTRY_STRUCT = struct.Struct("<qqq")
+
+
+class HistoryIndex:
+    """Maps each customer ID to the indexes of its records in the transaction store
+
+    transactions.hidx runs parallel to transactions.bin and holds, for each
+    record, the index of the previous record of the same customer (-1 for
+    the first), a jump pointer to an older record of that customer and the
+    record's position in the customer's history.  Jump pointers follow
+    Myers' skew-binary scheme, so any position, or the first record at or
+    after a timestamp, is reached from the head in O(log n) steps.  The
+    heads table (customer ID -> [last index, count]) is saved in the
+    snapshot, so the index costs nothing at startup and O(1) per appended
+    record.
+    """
+
+    def __init__(self, store: TransactionStore):
+        self.store = store
+        self.path = os.path.join(store.directory, INDEX_FILE)
+        self.heads: Dict[str, List[int]] = {}
+        self._file = open(self.path, "a+b")
+
+    def __len__(self) -> int:
+        """Number of store records covered by the index"""
+        return os.fstat(self._file.fileno()).st_size // ENTRY_STRUCT.size
+
+    def load(self, heads: Dict[str, List[int]], records: int):
+        """Adopt the heads saved with a snapshot that covered `records` store records"""
+        if len(self) < records:
+            print(f"History index {self.path} is behind the store; rebuilding")
+            self.rebuild()
+            return
+        self._file.truncate(records * ENTRY_STRUCT.size)
+        self.heads = {cust_id: list(head) for cust_id, head in heads.items()}
+
+    def rebuild(self):
+        """Recreate the index by scanning the whole store"""
+        self._file.truncate(0)
+        self.heads = {}
+        chunk = 65536
+        for start in range(0, len(self.store), chunk):
+            legs = self.store.read_range(start, start + chunk)
+            self.add(start, [leg["customer_id"] for leg in legs])
+        legacy = os.path.join(self.store.directory, LEGACY_PREV_FILE)
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+    def add(self, first: int, cust_ids: Iterable[str]):
+        """Index store records first, first + 1, ... belonging to cust_ids"""
+        pending: Dict[int, Tuple[int, int, int]] = {}
+
+        def entry(index: int) -> Tuple[int, int, int]:
+            found = pending.get(index)
+            return found if found is not None else self._entry(index)
+
+        index = first
+        for cust_id in cust_ids:
+            head = self.heads.get(cust_id)
+            if head is None:
+                # A customer's first record jumps to itself
+                pending[index] = (-1, index, 0)
+                self.heads[cust_id] = [index, 1]
+            else:
+                parent = head[0]
+                _, jump, parent_position = entry(parent)
+                _, jump_jump, jump_position = entry(jump)
+                jump_jump_position = entry(jump_jump)[2]
+                if parent_position - jump_position == jump_position - jump_jump_position:
+                    pending[index] = (parent, jump_jump, parent_position + 1)
+                else:
+                    pending[index] = (parent, parent, parent_position + 1)
+                head[0] = index
+                head[1] += 1
+            index += 1
+        self._file.write(b"".join(ENTRY_STRUCT.pack(*pending[index]) for index in range(first, index)))
+        self._file.flush()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def snapshot_heads(self) -> Dict[str, Tuple[int, int]]:
+        """Immutable copy of the heads table"""
+        return {cust_id: (head[0], head[1]) for cust_id, head in self.heads.items()}
+
+    def _entry(self, index: int) -> Tuple[int, int, int]:
+        """(previous index, jump index, position) of a store record"""
+        return ENTRY_STRUCT.unpack(os.pread(self._file.fileno(), ENTRY_STRUCT.size, index * ENTRY_STRUCT.size))
+
+    def _descend(self, head: Tuple[int, int], older: Callable[[int, int], bool]) -> Tuple[int, int]:
+        """(index, position) of the oldest record reachable from head while older(index, position) holds
+
+        older must hold for the head and, along the history, for a newest
+        run of records only; the jump pointers make this O(log n) steps.
+        """
+        index, position = head[0], head[1] - 1
+        while position > 0:
+            previous, jump, _ = self._entry(index)
+            jump_position = self._entry(jump)[2]
+            if older(jump, jump_position):
+                index, position = jump, jump_position
+            elif older(previous, position - 1):
+                index, position = previous, position - 1
+            else:
+                break
+        return index, position
+
+    def _first_from(self, head: Tuple[int, int], stamp: int, inclusive: bool) -> int:
+        """Position of a customer's first record timestamped at or after stamp (after it unless inclusive)"""
+        timestamp = self.store.timestamp
+
+        def older(index: int, _: int) -> bool:
+            return timestamp(index) >= stamp if inclusive else timestamp(index) > stamp
+
+        if not older(head[0], head[1] - 1):
+            return head[1]
+        return self._descend(head, older)[1]
+
+    def bounds(self, cust_id: str, head: Optional[Tuple[int, int]], start: int, end: int) -> Tuple[int, int]:
+        """Positions [lo, hi) of a customer's records timestamped within start..end
+
+        A customer's records are appended in time order, so each bound is one
+        descent along the jump pointers, reading O(log n) entries and timestamps.
+        """
+        if not head:
+            return 0, 0
+        lo = self._first_from(head, start, True)
+        hi = self._first_from(head, end, False)
+        return lo, max(lo, hi)
+
+    def legs(self, cust_id: str, head: Optional[Tuple[int, int]], lo: int, hi: int) -> List[Dict]:
+        """Legs at positions lo..hi-1 of a customer's indexed history, oldest first"""
+        count = head[1] if head else 0
+        hi = min(hi, count)
+        if lo >= hi:
+            return []
+        # Jump to the newest wanted record, then follow the chain back lo..hi-1
+        index, _ = self._descend(head, lambda _, position: position >= hi - 1)
+        indexes = [index]
+        while len(indexes) < hi - lo:
+            index = self._entry(index)[0]
+            indexes.append(index)
+        indexes.reverse()
+        legs = []
+        for index in indexes:
+            leg = self.store.read(index)
+            del leg["customer_id"]
+            legs.append(leg)
+        return legs
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,159 @@
+"""Transaction ID and UTR generators"""
+import os
+import threading
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+# Snowflake layout: 41 bits of milliseconds since EPOCH_MS, 10 bits of node ID, 12 bits of sequence
+EPOCH_MS = 1704067200000  # 2024-01-01 00:00:00 UTC
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Subdirectory of a data directory holding one lock file per leased node ID
+LEASE_DIR = "bank_nodes"
+
+_BASE36 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# Every two-digit base-36 string, so encoding takes half the divisions
+_BASE36_PAIRS = [high + low for high in _BASE36 for low in _BASE36]
+
+
+def to_base36(value: int, width: int) -> str:
+    """Upper-case base-36 digits of value, zero-padded to width"""
+    pairs = []
+    while value:
+        value, pair = divmod(value, 1296)
+        pairs.append(_BASE36_PAIRS[pair])
+    digits = "".join(reversed(pairs)).lstrip("0")
+    return digits.rjust(width, "0")
+
+
+def _try_lock(fd: int) -> bool:
+    """Take an exclusive lock on an open file without waiting; False if another holder has it"""
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        import msvcrt
+
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+class NodeLease:
+    """An exclusive claim on a node ID among everything sharing a data directory
+
+    Node n is held by locking LEASE_DIR/n.lock.  The operating system drops
+    the lock when its holder exits, even after a crash, so the ID can be
+    leased again.  The file keeps the last sequence slot handed out under
+    the ID, written on release(), so a later holder never goes back past it.
+    """
+
+    def __init__(self, directory: str):
+        path = os.path.join(directory, LEASE_DIR)
+        os.makedirs(path, exist_ok=True)
+        for node_id in range(MAX_NODE + 1):
+            fd = os.open(os.path.join(path, f"{node_id}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            if _try_lock(fd):
+                self.node_id = node_id
+                self._fd = fd
+                break
+            os.close(fd)
+        else:
+            raise RuntimeError(f"All {MAX_NODE + 1} node IDs in {path} are leased")
+        data = os.pread(self._fd, 32, 0).strip()
+        # Last (milliseconds << SEQUENCE_BITS | sequence) handed out by earlier holders
+        self.last_slot = int(data) if data.isdigit() else 0
+
+    def release(self, last_slot: int):
+        """Record the last slot handed out and give the node ID up"""
+        os.pwrite(self._fd, str(max(last_slot, self.last_slot)).encode("ascii").ljust(32), 0)
+        os.fsync(self._fd)
+        os.close(self._fd)
+
+
+class SnowflakeGenerator:
+    """Unique, time-ordered 63-bit IDs: timestamp, node ID and per-millisecond sequence
+
+    IDs from one generator strictly increase, even if the wall clock steps
+    back or more than 4096 are drawn in one millisecond (the generator
+    then runs ahead of the clock until it catches up).  Generators sharing
+    data must use distinct node IDs: pass node_id when the caller assigns
+    them (as the shard router does), or lease_dir to lease a free one from
+    that data directory on first use (see NodeLease) and give it back on
+    close().  The transaction ID is the ID in 16 hex digits and the UTR
+    the same ID in 13 base-36 digits, both within the 16 bytes the
+    transaction store keeps.
+    """
+
+    def __init__(self, node_id: Optional[int] = None, lease_dir: Optional[str] = None):
+        if (node_id is None) == (lease_dir is None):
+            raise ValueError("Pass either a node ID or a directory to lease one from")
+        if node_id is not None and not 0 <= node_id <= MAX_NODE:
+            raise ValueError(f"Node ID must be between 0 and {MAX_NODE}")
+        self.node_id = node_id
+        self.lease_dir = lease_dir
+        self._lease: Optional[NodeLease] = None
+        self._last = 0  # Last (milliseconds << SEQUENCE_BITS | sequence) handed out
+        self._lock = threading.Lock()
+
+    def _reserve(self, count: int) -> int:
+        """Reserve count consecutive sequence slots and return the first"""
+        now = (int(time.time() * 1000) - EPOCH_MS) << SEQUENCE_BITS
+        with self._lock:
+            if self.node_id is None:
+                self._lease = NodeLease(self.lease_dir)
+                self.node_id = self._lease.node_id
+                self._last = max(self._last, self._lease.last_slot)
+            first = max(now, self._last + 1)
+            self._last = first + count - 1
+        return first
+
+    def close(self):
+        """Give a leased node ID back (the next ID drawn leases one again)"""
+        with self._lock:
+            if self._lease is not None:
+                self._lease.release(self._last)
+                self._lease = None
+                self.node_id = None
+
+    def _format(self, slot: int) -> Tuple[str, str]:
+        millis, sequence = slot >> SEQUENCE_BITS, slot & MAX_SEQUENCE
+        value = millis << (NODE_BITS + SEQUENCE_BITS) | self.node_id << SEQUENCE_BITS | sequence
+        return f"{value:016X}", to_base36(value, 13)
+
+    def next_ids(self) -> Tuple[str, str]:
+        """A new (transaction ID, UTR) pair"""
+        return self._format(self._reserve(1))
+
+    def batch(self, count: int) -> List[Tuple[str, str]]:
+        """count new (transaction ID, UTR) pairs with a single lock acquisition"""
+        first = self._reserve(count)
+        return [self._format(slot) for slot in range(first, first + count)]
+
+
+class Uuid4Generator:
+    """The original scheme: random IDs truncated from uuid4 (8 and 12 characters)
+
+    The 32-bit transaction IDs collide after tens of thousands of
+    transfers; kept for comparison and for callers that need the old format.
+    """
+
+    def next_ids(self) -> Tuple[str, str]:
+        """A new (transaction ID, UTR) pair"""
+        transaction_id = str(uuid.uuid4())[:8].upper()  # Shortened random Transaction ID
+        utr = str(uuid.uuid4())[:12].upper()  # Shortened random UTR
+        return transaction_id, utr
+
+    def batch(self, count: int) -> List[Tuple[str, str]]:
+        """count new (transaction ID, UTR) pairs"""
+        return [self.next_ids() for _ in range(count)]
@@ -0,0 +1,272 @@
+"""Streaming bulk import of customers and transaction history into a journal directory"""
+import copy
+import csv
+import datetime
+import itertools
+import math
+import os
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from journal import Journal
+from ledger import ACCOUNT_TYPES, DEFAULT_CUSTOMERS
+from registry import CustomerRegistry
+from snapshot import Checkpointer, load_snapshot, snapshot_exists
+from storage import CSV_HEADER
+from txstore import ID_WIDTH, MAX_BALANCE_PAISE, TIMESTAMP_STRUCT, from_paise
+
+# Layout of a customers-only import file
+CUSTOMER_IMPORT_HEADER = ["Customer ID", "Name", "Account Type", "DOB", "Address", "Area", "Balance"]
+
+# Extra columns of the rejects file, after the rejected row
+REJECT_COLUMNS = ["Line", "Error"]
+
+# Rows validated and written together
+CHUNK_ROWS = 10000
+
+# Rows between resumable checkpoints (each one rewrites the snapshot)
+CHECKPOINT_ROWS = 500000
+
+
+class ImportReport(NamedTuple):
+    """Counts from one import run"""
+    rows: int
+    customers: int
+    transactions: int
+    rejected: int
+    resumed_from: int = 0
+
+
+def read_chunks(rows: Iterable[List[str]], size: int = CHUNK_ROWS) -> Iterator[List[List[str]]]:
+    """Group rows into lists of up to size rows"""
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def check_paise(value: float, field: str):
+    """Raise ValueError if value is not a number the transaction store's paise fields can hold"""
+    if not math.isfinite(value):
+        raise ValueError(f"{field} is not a finite number")
+    if abs(value) > from_paise(MAX_BALANCE_PAISE):
+        raise ValueError(f"{field} larger than {MAX_BALANCE_PAISE // 100}")
+
+
+class Importer:
+    """Creates customers and their history from CSV rows without the journal
+
+    Imports go straight into the checkpointed state: customer details and
+    balances into the snapshot, legs into the transaction store and its
+    indexes.  Rows are read and validated a chunk at a time, so memory
+    depends on the number of customers, never on the number of rows.
+    Rejected rows are written to a rejects CSV with their line number and
+    reason.  Every checkpoint_rows rows the snapshot is rewritten together
+    with the import position, so an interrupted import resumes after the
+    last checkpoint.  The ledger must not be running on the directory.
+
+    Two layouts are accepted: the legacy 13-column file (CSV_HEADER), whose
+    rows also create unknown customers, and CUSTOMER_IMPORT_HEADER.
+    """
+
+    def __init__(self, directory: str, chunk_rows: int = CHUNK_ROWS, checkpoint_rows: int = CHECKPOINT_ROWS):
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.checkpoint_rows = checkpoint_rows
+
+    def import_file(self, path: str, rejects_path: Optional[str] = None) -> ImportReport:
+        """Import a CSV file; rejects go to rejects_path (default: <path>.rejects.csv)"""
+        with open(path, "r", newline="", encoding="utf-8") as file:
+            return self.import_rows(csv.reader(file), os.path.abspath(path), rejects_path or path + ".rejects.csv")
+
+    def import_rows(self, rows: Iterable[List[str]], source: str, rejects_path: str) -> ImportReport:
+        """Import rows (header first) identified by source for resuming"""
+        rows = iter(rows)
+        header = next(rows, None)
+        if header not in (CSV_HEADER, CUSTOMER_IMPORT_HEADER):
+            raise ValueError(f"Invalid import header in {source}: {header}")
+        journal = Journal(self.directory)
+        checkpointer = Checkpointer(journal)
+        # Like the ledger, a journal without a snapshot starts from the built-in customers;
+        # a fresh directory holds only what is imported
+        fresh = journal.is_empty() and not snapshot_exists(self.directory)
+        try:
+            if checkpointer.load({} if fresh else copy.deepcopy(DEFAULT_CUSTOMERS)):
+                # Fold the journal tail so the snapshot state is current
+                checkpointer.checkpoint(wait=True)
+            return _ImportRun(checkpointer, header, source, rejects_path, self).run(rows)
+        finally:
+            checkpointer.close()
+            journal.close()
+
+
+class _ImportRun:
+    """State of one import: validates chunks and writes them to the checkpointer"""
+
+    def __init__(self, checkpointer: Checkpointer, header: List[str], source: str, rejects_path: str,
+                 importer: Importer):
+        self.checkpointer = checkpointer
+        self.state = checkpointer.state
+        self.legacy = header == CSV_HEADER
+        self.header = header
+        self.source = source
+        self.rejects_path = rejects_path
+        self.importer = importer
+        self.registry = CustomerRegistry()
+        self.registry.rebuild(self.state)
+        # Timestamp of each customer's newest leg, so history stays in date order
+        self.last_stamp: Dict[str, int] = {}
+        self.customers = 0
+        self.transactions = 0
+        self.rejected = 0
+
+    def run(self, rows: Iterator[List[str]]) -> ImportReport:
+        snapshot = load_snapshot(self.checkpointer.journal.directory) or {}
+        progress = snapshot.get("import") or {}
+        done = progress.get("rows", 0) if progress.get("source") == self.source else 0
+        if done and progress.get("complete"):
+            print(f"{self.source} was already imported")
+            return ImportReport(done, 0, 0, 0, done)
+        if done:
+            print(f"Resuming import of {self.source} after row {done}")
+            rows = itertools.islice(rows, done, None)
+        with open(self.rejects_path, "r+" if done else "w", newline="", encoding="utf-8") as rejects_file:
+            rejects = csv.writer(rejects_file)
+            if done:
+                # Drop rejects written after the checkpoint; those rows are read again
+                rejects_file.truncate(progress["rejects_size"])
+                rejects_file.seek(progress["rejects_size"])
+            else:
+                rejects.writerow(self.header + REJECT_COLUMNS)
+            read = done
+            since_checkpoint = 0
+            for chunk in read_chunks(rows, self.importer.chunk_rows):
+                # Line numbers count the header as line 1
+                for row, error in self._import_chunk(chunk, read + 2):
+                    rejects.writerow(row + error)
+                    self.rejected += 1
+                read += len(chunk)
+                since_checkpoint += len(chunk)
+                if since_checkpoint >= self.importer.checkpoint_rows:
+                    rejects_file.flush()
+                    os.fsync(rejects_file.fileno())
+                    self._save(read, rejects_file.tell(), complete=False)
+                    since_checkpoint = 0
+            rejects_file.flush()
+            self._save(read, rejects_file.tell(), complete=True)
+        print(f"Imported {self.customers} customers and {self.transactions} transactions from {self.source}; "
+              f"{self.rejected} rows rejected (see {self.rejects_path})")
+        return ImportReport(read, self.customers, self.transactions, self.rejected, done)
+
+    def _save(self, rows: int, rejects_size: int, complete: bool):
+        self.checkpointer.save({"import": {"source": self.source, "rows": rows, "rejects_size": rejects_size,
+                                           "complete": complete}})
+
+    def _import_chunk(self, chunk: List[List[str]], first_line: int) -> List[Tuple[List[str], List]]:
+        """Validate and write one chunk, returning (row, [line, error]) for each rejected row"""
+        rejected = []
+        packed: List[bytes] = []
+        cust_ids: List[str] = []
+        store = self.checkpointer.store
+        for line, row in enumerate(chunk, first_line):
+            try:
+                if self.legacy:
+                    leg = self._legacy_row(row)
+                    if leg is None:
+                        continue
+                    data = store.pack(leg)
+                    cust_id = leg["customer_id"]
+                    stamp = TIMESTAMP_STRUCT.unpack_from(data)[0]
+                    if stamp < self._last_stamp(cust_id):
+                        raise ValueError("transaction is older than the customer's previous one")
+                    self.last_stamp[cust_id] = stamp
+                    self.state[cust_id]["balance"] = leg["balance"]
+                    packed.append(data)
+                    cust_ids.append(cust_id)
+                else:
+                    self._customer_row(row)
+            except (ValueError, OverflowError, UnicodeEncodeError) as e:
+                rejected.append((row, [line, str(e)]))
+        if packed:
+            self.checkpointer.append_packed(b"".join(packed), cust_ids)
+            self.transactions += len(packed)
+        return rejected
+
+    def _last_stamp(self, cust_id: str) -> int:
+        stamp = self.last_stamp.get(cust_id)
+        if stamp is None:
+            head = self.checkpointer.index.heads.get(cust_id)
+            stamp = self.checkpointer.store.timestamp(head[0]) if head else 0
+            self.last_stamp[cust_id] = stamp
+        return stamp
+
+    def _add_customer(self, cust_id: str, name: str, account_type: str, dob: str, address: str, area: str,
+                      balance: float):
+        """Validate and create a customer, raising ValueError if it cannot be imported"""
+        if not cust_id or not name or not account_type or not dob or not address or not area:
+            raise ValueError("missing customer fields")
+        if len(cust_id.encode("ascii")) > ID_WIDTH:
+            raise ValueError(f"customer ID longer than {ID_WIDTH} characters")
+        if cust_id in self.state:
+            raise ValueError(f"customer ID {cust_id} already exists")
+        if self.registry.find(name) is not None:
+            raise ValueError(f"a customer named {name!r} already exists")
+        if account_type not in ACCOUNT_TYPES:
+            raise ValueError(f"unknown account type {account_type!r}")
+        datetime.datetime.strptime(dob, "%Y-%m-%d")
+        check_paise(balance, "balance")
+        if balance < 0:
+            raise ValueError("negative balance")
+        self.state[cust_id] = {"name": name, "dob": dob, "address": address, "area": area,
+                               "balance": balance, "account_type": account_type}
+        self.registry.add(cust_id, name)
+        self.customers += 1
+
+    def _customer_row(self, row: List[str]):
+        if len(row) != len(CUSTOMER_IMPORT_HEADER):
+            raise ValueError(f"expected {len(CUSTOMER_IMPORT_HEADER)} columns, got {len(row)}")
+        cust_id, name, account_type, dob, address, area, balance = (value.strip() for value in row)
+        self._add_customer(cust_id.upper(), name, account_type, dob, address, area, float(balance))
+
+    def _legacy_row(self, row: List[str]) -> Optional[Dict]:
+        """Create the row's customer if it is new; return its leg, if the row has one"""
+        if len(row) < 6:
+            raise ValueError(f"expected at least 6 columns, got {len(row)}")
+        cust_id = row[0].strip().upper()
+        has_leg = len(row) >= 13 and row[6]
+        if cust_id not in self.state:
+            # A details-only row keeps the balance in its Balance column, as save_csv writes it;
+            # otherwise the balance follows the customer's legs
+            balance = float(row[9]) if not has_leg and len(row) >= 10 and row[9] else 0.0
+            self._add_customer(cust_id, row[1], row[2], row[3], row[4], row[5], balance)
+        if not has_leg:
+            return None
+        trans_type = row[7]
+        if not trans_type.endswith(("_in", "_out")):
+            raise ValueError(f"unknown transaction type {trans_type!r}")
+        amount = float(row[8])
+        if amount <= 0:
+            raise ValueError("non-positive amount")
+        balance = float(row[9])
+        check_paise(amount, "amount")
+        check_paise(balance, "balance")
+        return {
+            "customer_id": cust_id,
+            "date": row[6],
+            "type": trans_type,
+            "amount": amount,
+            "balance": balance,
+            "recipient_id": row[10],
+            "transaction_id": row[11],
+            "utr": row[12],
+        }
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python importer.py <journal directory> <file.csv> [rejects.csv]")
+        sys.exit(1)
+    Importer(sys.argv[1]).import_file(sys.argv[2], sys.argv[3] if len(sys.argv) == 4 else None)
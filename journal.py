@@ -0,0 +1,400 @@
+"""Append-only journal for the bank ledger"""
+import json
+import os
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Fsync modes
+FSYNC_ALWAYS = "always"
+FSYNC_EVERY_N = "every_n"
+FSYNC_INTERVAL = "interval"
+
+
+class FsyncPolicy:
+    """Decide when appended journal records are forced to disk"""
+
+    def __init__(self, mode: str = FSYNC_ALWAYS, every_n: int = 1, interval_ms: int = 0):
+        if mode not in (FSYNC_ALWAYS, FSYNC_EVERY_N, FSYNC_INTERVAL):
+            raise ValueError(f"Unknown fsync mode: {mode}")
+        if mode == FSYNC_EVERY_N and every_n < 1:
+            raise ValueError("every_n must be at least 1")
+        if mode == FSYNC_INTERVAL and interval_ms <= 0:
+            raise ValueError("interval_ms must be positive")
+        self.mode = mode
+        self.every_n = every_n
+        self.interval_ms = interval_ms
+
+    @classmethod
+    def always(cls) -> "FsyncPolicy":
+        """Fsync after every commit"""
+        return cls(FSYNC_ALWAYS)
+
+    @classmethod
+    def every(cls, n: int) -> "FsyncPolicy":
+        """Fsync after every n commits"""
+        return cls(FSYNC_EVERY_N, every_n=n)
+
+    @classmethod
+    def interval(cls, ms: int) -> "FsyncPolicy":
+        """Fsync at most every ms milliseconds while commits are pending"""
+        return cls(FSYNC_INTERVAL, interval_ms=ms)
+
+    def __repr__(self):
+        if self.mode == FSYNC_EVERY_N:
+            return f"FsyncPolicy.every({self.every_n})"
+        if self.mode == FSYNC_INTERVAL:
+            return f"FsyncPolicy.interval({self.interval_ms})"
+        return "FsyncPolicy.always()"
+
+
+def encode_record(record: Dict) -> bytes:
+    """Encode a record as one checksummed journal line"""
+    payload = json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def line_intact(line: bytes) -> bool:
+    """Whether a journal line is complete and matches its checksum (without decoding it)"""
+    if len(line) < 10 or not line.endswith(b"\n") or line[8:9] != b" ":
+        return False
+    try:
+        return int(line[:8], 16) == zlib.crc32(line[9:-1])
+    except ValueError:
+        return False
+
+
+def decode_line(line: bytes) -> Optional[Dict]:
+    """Decode a journal line, returning None if it is torn or corrupt"""
+    if not line_intact(line):
+        return None
+    try:
+        return json.loads(line[9:-1].decode("utf-8"))
+    except ValueError:
+        return None
+
+
+def read_records(path: str, start: int = 0) -> Iterator[Tuple[int, int, Dict]]:
+    """Yield (offset, end_offset, record) for every intact record from start
+
+    Reading stops at the first torn or corrupt line, which can only be the
+    tail left behind by a crash in the middle of an append.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as file:
+        file.seek(start)
+        offset = start
+        for line in file:
+            record = decode_line(line)
+            if record is None:
+                return
+            end = offset + len(line)
+            yield offset, end, record
+            offset = end
+
+
+def segment_name(segment: int) -> str:
+    """File name of a journal segment"""
+    return f"{segment:08d}.log"
+
+
+def list_segments(directory: str) -> List[int]:
+    """Sorted segment numbers present in a directory"""
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if ext == ".log" and stem.isdigit():
+            segments.append(int(stem))
+    return sorted(segments)
+
+
+class Journal:
+    """Append-only, segmented log of ledger records with a configurable fsync policy
+
+    Each commit is written as a single checksummed line, so a transfer's two
+    legs reach the file together or not at all.  Appending costs the same no
+    matter how long the ledger has grown.  Positions are (segment, offset)
+    pairs; roll() seals the current segment so it can be checkpointed.
+
+    Writes are unbuffered, so an append that fails leaves nothing queued to
+    be written later: its bytes are cut off again before the error is
+    raised.  If even that fails, every later append is refused, as the file
+    may hold a record its caller was told did not commit.
+
+    A read_only journal only replays, so it can be opened while another
+    process appends: a torn tail is left alone, as it may be a record still
+    being written, and appends are refused.
+    """
+
+    def __init__(self, directory: str, policy: Optional[FsyncPolicy] = None, read_only: bool = False):
+        self.directory = directory
+        self.policy = policy or FsyncPolicy.always()
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._closed = False
+        # Error that left the segment in an unknown state; appends are refused once set
+        self._failed: Optional[BaseException] = None
+        segments = list_segments(directory)
+        self._segment = segments[-1] if segments else 1
+        self._end = self._recover()
+        self._file = None if read_only else open(self.segment_path(self._segment), "ab", buffering=0)
+        self._timer = None
+        if self.policy.mode == FSYNC_INTERVAL and not read_only:
+            self._timer = threading.Thread(target=self._sync_loop, name="journal-fsync", daemon=True)
+            self._timer.start()
+
+    def segment_path(self, segment: int) -> str:
+        """Path of a segment file in this journal"""
+        return os.path.join(self.directory, segment_name(segment))
+
+    def _recover(self) -> int:
+        """Drop a torn tail left by a crash (unless read-only) and return the end of valid data"""
+        path = self.segment_path(self._segment)
+        end = 0
+        if not os.path.exists(path):
+            return end
+        # Checksums are enough to find the tail; records are decoded later, if replayed
+        with open(path, "rb") as file:
+            for line in file:
+                if not line_intact(line):
+                    break
+                end += len(line)
+        if os.path.getsize(path) > end and not self.read_only:
+            print(f"Truncating torn journal tail in {path} at offset {end}")
+            with open(path, "r+b") as file:
+                file.truncate(end)
+        return end
+
+    @property
+    def segment(self) -> int:
+        """Number of the segment currently being appended to"""
+        return self._segment
+
+    @property
+    def end_offset(self) -> int:
+        """Offset just past the last committed record in the current segment"""
+        return self._end
+
+    @property
+    def position(self) -> Tuple[int, int]:
+        """(segment, offset) just past the last committed record"""
+        with self._lock:
+            return self._segment, self._end
+
+    def is_empty(self) -> bool:
+        """True if no record has ever been committed to this journal"""
+        return self._segment == 1 and self._end == 0
+
+    def append(self, record: Dict) -> int:
+        """Append one record atomically and return its offset"""
+        return self.append_many([record])[0]
+
+    def append_many(self, records: Iterable[Dict]) -> List[int]:
+        """Append several records in one write and one fsync decision"""
+        lines = [encode_record(record) for record in records]
+        if not lines:
+            return []
+        with self._lock:
+            self._check_writable()
+            offsets = []
+            end = self._end
+            for line in lines:
+                offsets.append(end)
+                end += len(line)
+            try:
+                data = memoryview(b"".join(lines))
+                while data:
+                    data = data[self._file.write(data):]
+                self._unsynced += 1
+                if self._should_sync():
+                    self._sync_locked()
+            except BaseException as e:
+                self._cut_back(e)
+                raise
+            self._end = end
+        return offsets
+
+    def _check_writable(self):
+        if self._closed:
+            raise ValueError("Journal is closed")
+        if self.read_only:
+            raise ValueError(f"Journal {self.directory} is open read-only")
+        if self._failed is not None:
+            raise OSError(f"Journal {self.directory} refuses appends after a failed write: {self._failed}")
+
+    def _cut_back(self, error: BaseException):
+        """Truncate the segment to the last committed record after a failed append"""
+        try:
+            os.ftruncate(self._file.fileno(), self._end)
+            # Whatever reached the disk before the failure is not part of the journal
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            self._failed = error
+            print(f"Could not truncate {self.segment_path(self._segment)} after a failed append: {e}")
+
+    def roll(self) -> int:
+        """Seal the current segment, start a new one and return the sealed number"""
+        with self._lock:
+            self._check_writable()
+            self._sync_locked()
+            self._file.close()
+            sealed = self._segment
+            self._segment += 1
+            self._end = 0
+            self._file = open(self.segment_path(self._segment), "ab", buffering=0)
+            return sealed
+
+    def sealed_segments(self) -> List[int]:
+        """Segments that are no longer appended to"""
+        return [segment for segment in list_segments(self.directory) if segment < self._segment]
+
+    def _should_sync(self) -> bool:
+        if self.policy.mode == FSYNC_ALWAYS:
+            return True
+        if self.policy.mode == FSYNC_EVERY_N:
+            return self._unsynced >= self.policy.every_n
+        return (time.monotonic() - self._last_sync) * 1000 >= self.policy.interval_ms
+
+    def _sync_locked(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _sync_loop(self):
+        """Background fsync for the interval policy so idle periods get flushed"""
+        interval = self.policy.interval_ms / 1000
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                if self._closed:
+                    return
+                if self._unsynced:
+                    self._sync_locked()
+
+    def sync(self):
+        """Force all appended records to disk"""
+        with self._lock:
+            if not self._closed and self._unsynced:
+                self._sync_locked()
+
+    def close(self):
+        """Sync outstanding records and close the file"""
+        with self._lock:
+            if self._closed:
+                return
+            if self._unsynced:
+                self._sync_locked()
+            if self._file is not None:
+                self._file.close()
+            self._closed = True
+
+    def replay(self, start: Tuple[int, int] = (0, 0)) -> Iterator[Dict]:
+        """Yield every committed record from the (segment, offset) position start"""
+        start_segment, start_offset = start
+        for segment in list_segments(self.directory):
+            if segment < start_segment:
+                continue
+            offset = start_offset if segment == start_segment else 0
+            for _, _, record in read_records(self.segment_path(segment), offset):
+                yield record
+
+
+def customer_record(cust_id: str, info: Dict, include_history: bool = False) -> Dict:
+    """Build the journal record that registers (or re-seeds) a customer"""
+    record = {
+        "op": "customer",
+        "id": cust_id,
+        "name": info["name"],
+        "dob": info["dob"],
+        "address": info["address"],
+        "area": info["area"],
+        "balance": info["balance"],
+        "account_type": info["account_type"],
+    }
+    if include_history:
+        record["transactions"] = [dict(trans) for trans in info["transactions"]]
+    return record
+
+
+def transfer_record(sender_id: str, sender_leg: Dict, recipient_id: str, recipient_leg: Dict,
+                    idempotency_key: Optional[str] = None) -> Dict:
+    """Build the journal record holding both legs of one transfer"""
+    record = {
+        "op": "transfer",
+        "legs": [
+            dict(sender_leg, customer_id=sender_id),
+            dict(recipient_leg, customer_id=recipient_id),
+        ],
+    }
+    if idempotency_key is not None:
+        record["key"] = idempotency_key
+    return record
+
+
+def leg_record(cust_id: str, leg: Dict, idempotency_key: Optional[str] = None) -> Dict:
+    """Build the journal record holding one leg of a transfer whose other leg is on another ledger"""
+    record = {"op": "transfer", "legs": [dict(leg, customer_id=cust_id)]}
+    if idempotency_key is not None:
+        record["key"] = idempotency_key
+    return record
+
+
+def record_keys(record: Dict) -> Iterator[Tuple[str, str]]:
+    """Yield (idempotency key, transaction ID) for keyed transfers in a record"""
+    for inner in flatten_record(record):
+        if inner.get("op") == "transfer" and inner.get("key") is not None:
+            yield inner["key"], inner["legs"][0]["transaction_id"]
+
+
+def flatten_record(record: Dict) -> Iterator[Dict]:
+    """Yield the customer and transfer records inside a (possibly batched) record"""
+    if record.get("op") == "batch":
+        for inner in record["records"]:
+            yield from flatten_record(inner)
+    else:
+        yield record
+
+
+def apply_record(customers: Dict[str, Dict], record: Dict, keep_history: bool = True):
+    """Apply one journal record to the in-memory customers dict
+
+    With keep_history=False only details and balances are maintained, which
+    is how checkpoints fold journal segments into a snapshot.
+    """
+    op = record.get("op")
+    if op == "customer":
+        info = {
+            "name": record["name"],
+            "dob": record["dob"],
+            "address": record["address"],
+            "area": record["area"],
+            "balance": record["balance"],
+            "account_type": record["account_type"],
+        }
+        if keep_history:
+            info["transactions"] = list(record.get("transactions", []))
+        customers[record["id"]] = info
+    elif op == "batch":
+        for inner in record["records"]:
+            apply_record(customers, inner, keep_history)
+    elif op == "transfer":
+        for leg in record["legs"]:
+            info = customers.get(leg["customer_id"])
+            if info is None:
+                print(f"Skipping journal leg for unknown customer ID: {leg['customer_id']}")
+                continue
+            if keep_history:
+                trans = dict(leg)
+                del trans["customer_id"]
+                info["transactions"].append(trans)
+            info["balance"] = leg["balance"]
+    else:
+        print(f"Skipping unknown journal record: {op}")
@@ -0,0 +1,1333 @@
+"""Headless ledger engine: customers, transfers and persistence without any GUI"""
+import bisect
+import contextlib
+import copy
+import datetime
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from idgen import SnowflakeGenerator
+from journal import FsyncPolicy, customer_record, leg_record, transfer_record
+from limits import AMOUNT, DAY, VelocityLimits
+from lookup_index import LookupIndex
+from metrics import LedgerMetrics
+from records import Customer, Transaction, date_timestamp
+from registry import CustomerRegistry, details_fingerprint
+from storage import CsvStorage, JournalStorage, SqliteStorage, Storage
+from tiering import SpilledHistory
+from txstore import MAX_BALANCE_PAISE, from_paise, to_paise
+
+# Transaction limit
+TRANSFER_LIMIT = 5000.0
+
+# Seconds between passes that spill history older than the hot window
+EVICTION_INTERVAL = 600
+
+# Valid transaction types
+TRANSACTION_TYPES = ["UPI", "Bank Transfer", "Net Banking"]
+
+# Valid account types
+ACCOUNT_TYPES = ["Savings", "Current"]
+
+# Leg types of each transaction type: (sender's leg, recipient's leg)
+LEG_TYPES = {trans_type: (f"{trans_type.lower()}_out", f"{trans_type.lower()}_in") for trans_type in TRANSACTION_TYPES}
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Error codes returned by the engine
+ERR_MISSING_FIELDS = "missing_fields"
+ERR_INVALID_AMOUNT = "invalid_amount"
+ERR_UNKNOWN_SENDER = "unknown_sender"
+ERR_UNKNOWN_RECIPIENT = "unknown_recipient"
+ERR_UNKNOWN_CUSTOMER = "unknown_customer"
+ERR_SAME_ACCOUNT = "same_account"
+ERR_INVALID_TYPE = "invalid_type"
+ERR_NON_POSITIVE_AMOUNT = "non_positive_amount"
+ERR_LIMIT_EXCEEDED = "limit_exceeded"
+ERR_INSUFFICIENT_FUNDS = "insufficient_funds"
+ERR_VERIFICATION_FAILED = "verification_failed"
+ERR_DUPLICATE_NAME = "duplicate_name"
+ERR_NEGATIVE_BALANCE = "negative_balance"
+ERR_BALANCE_TOO_LARGE = "balance_too_large"
+ERR_KEY_REUSED = "idempotency_key_reused"
+ERR_ROLLING_AMOUNT = "rolling_amount_exceeded"
+ERR_ROLLING_COUNT = "rolling_count_exceeded"
+ERR_SHARD_UNAVAILABLE = "shard_unavailable"
+
+# User-facing text for each error code
+ERROR_MESSAGES = {
+    ERR_MISSING_FIELDS: "Please fill all fields!",
+    ERR_INVALID_AMOUNT: "Invalid amount! Please enter a number.",
+    ERR_UNKNOWN_SENDER: "Sender ID not found!",
+    ERR_UNKNOWN_RECIPIENT: "Recipient ID not found!",
+    ERR_UNKNOWN_CUSTOMER: "Customer ID not found!",
+    ERR_SAME_ACCOUNT: "Cannot transfer to the same account!",
+    ERR_INVALID_TYPE: f"Invalid transaction type! Choose from {TRANSACTION_TYPES}",
+    ERR_NON_POSITIVE_AMOUNT: "Amount must be positive!",
+    ERR_LIMIT_EXCEEDED: f"Amount exceeds limit of ₹{TRANSFER_LIMIT:.2f}!",
+    ERR_INSUFFICIENT_FUNDS: "Insufficient funds!",
+    ERR_VERIFICATION_FAILED: "Verification failed! Details do not match.",
+    ERR_DUPLICATE_NAME: "Customer with this name already exists!",
+    ERR_NEGATIVE_BALANCE: "Initial balance cannot be negative!",
+    ERR_BALANCE_TOO_LARGE: f"Initial balance cannot exceed ₹{from_paise(MAX_BALANCE_PAISE):.2f}!",
+    ERR_KEY_REUSED: "Idempotency key was already used for a different transfer!",
+    ERR_ROLLING_AMOUNT: "Amount exceeds the account's rolling transfer limit!",
+    ERR_ROLLING_COUNT: "Too many transfers from this account in the current period!",
+    ERR_SHARD_UNAVAILABLE: "Account service unavailable! Please retry.",
+}
+
+# Initial customer data with unique IDs, name, DOB, address, area, balance, and account type
+DEFAULT_CUSTOMERS: Dict[str, Dict] = {
+    "CUST001": {
+        "name": "Charan",
+        "dob": "1990-05-15",
+        "address": "123 Main St",
+        "area": "Downtown",
+        "balance": 1000.0,
+        "account_type": "Savings",
+        "transactions": []
+    },
+    "CUST002": {
+        "name": "Baba",
+        "dob": "1985-08-22",
+        "address": "456 Oak Ave",
+        "area": "Suburb",
+        "balance": 1500.0,
+        "account_type": "Current",
+        "transactions": []
+    },
+    "CUST003": {
+        "name": "Gowrav",
+        "dob": "1992-03-10",
+        "address": "789 Pine Rd",
+        "area": "City Center",
+        "balance": 2000.0,
+        "account_type": "Savings",
+        "transactions": []
+    },
+    "CUST004": {
+        "name": "Rahul",
+        "dob": "1988-11-30",
+        "address": "101 Elm St",
+        "area": "Downtown",
+        "balance": 800.0,
+        "account_type": "Current",
+        "transactions": []
+    },
+    "CUST005": {
+        "name": "Priya",
+        "dob": "1995-07-19",
+        "address": "202 Maple Dr",
+        "area": "Suburb",
+        "balance": 1200.0,
+        "account_type": "Savings",
+        "transactions": []
+    },
+    "CUST006": {
+        "name": "Amit",
+        "dob": "1987-04-25",
+        "address": "303 Cedar Ln",
+        "area": "City Center",
+        "balance": 1800.0,
+        "account_type": "Current",
+        "transactions": []
+    },
+    "CUST007": {
+        "name": "Sneha",
+        "dob": "1993-09-12",
+        "address": "404 Birch Ave",
+        "area": "Downtown",
+        "balance": 900.0,
+        "account_type": "Savings",
+        "transactions": []
+    },
+    "CUST008": {
+        "name": "Vikram",
+        "dob": "1986-02-17",
+        "address": "505 Spruce St",
+        "area": "Suburb",
+        "balance": 2500.0,
+        "account_type": "Current",
+        "transactions": []
+    },
+    "CUST009": {
+        "name": "Anjali",
+        "dob": "1991-12-05",
+        "address": "606 Willow Rd",
+        "area": "City Center",
+        "balance": 1100.0,
+        "account_type": "Savings",
+        "transactions": []
+    },
+    "CUST010": {
+        "name": "Rohan",
+        "dob": "1989-06-08",
+        "address": "707 Ash Dr",
+        "area": "Downtown",
+        "balance": 1700.0,
+        "account_type": "Current",
+        "transactions": []
+    },
+}
+
+
+class TransferResult(NamedTuple):
+    """Outcome of one transfer; error is None on success
+
+    With asynchronous commits, commit is a Future that resolves once the
+    transfer is durable; otherwise it is None and the transfer is already
+    persisted when the result is returned.
+    """
+    error: Optional[str]
+    sender_id: str
+    recipient_id: str
+    amount: float = 0.0
+    trans_type: str = ""
+    date: str = ""
+    transaction_id: str = ""
+    utr: str = ""
+    sender_balance: float = 0.0
+    recipient_balance: float = 0.0
+    commit: Optional[Future] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def message(self) -> str:
+        if self.error is None:
+            return "Transfer completed successfully!"
+        return ERROR_MESSAGES.get(self.error, self.error)
+
+
+class RegisterResult(NamedTuple):
+    """Outcome of a customer registration; error is None on success"""
+    error: Optional[str]
+    customer_id: str = ""
+    commit: Optional[Future] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def message(self) -> str:
+        if self.error is None:
+            return "Account created successfully!"
+        return ERROR_MESSAGES.get(self.error, self.error)
+
+
+# A registration: (name, account_type, dob, address, area, balance) or a dict with those keys
+RegistrationRequest = Union[Tuple[str, str, str, str, str, Union[str, float]], Dict]
+
+# Fields of a registration request, in tuple order
+REGISTRATION_FIELDS = ["name", "account_type", "dob", "address", "area", "balance"]
+
+# A transfer request: (sender_id, recipient_id, amount, trans_type[, idempotency_key[, sender_details[,
+# recipient_details]]]) or a dict with those keys
+TransferRequest = Union[Tuple[str, str, Union[str, float], str], Tuple[str, str, Union[str, float], str, str],
+                        Tuple[str, str, Union[str, float], str, Optional[str], Dict],
+                        Tuple[str, str, Union[str, float], str, Optional[str], Optional[Dict], Dict], Dict]
+
+
+class Settlement(NamedTuple):
+    """One side of a transfer between ledgers: the debit on the sender's ledger or the credit on the recipient's"""
+    transaction_id: str
+    sender_id: str
+    recipient_id: str
+    amount_paise: int
+    trans_type: str
+    utr: str
+    debit: bool
+    idempotency_key: Optional[str] = None
+
+
+class Hold(NamedTuple):
+    """Funds reserved for a transfer to another ledger until it settles or is released"""
+    sender_id: str
+    amount_paise: int
+    trans_type: str
+    counted_at: float  # When the transfer was counted against the sender's velocity limits
+
+
+def parse_date_bound(value: Union[str, datetime.date], end: bool = False) -> str:
+    """Normalize a range bound to DATE_FORMAT text
+
+    Accepts a datetime, a date or "YYYY-MM-DD[ HH:MM:SS]" text; a bare date
+    means the start of that day, or its last second when end is True.
+    Raises ValueError for anything else.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, datetime.date):
+        value = value.strftime("%Y-%m-%d")
+    text = str(value).strip()
+    if len(text) == 10:
+        datetime.datetime.strptime(text, "%Y-%m-%d")
+        text += " 23:59:59" if end else " 00:00:00"
+    datetime.datetime.strptime(text, DATE_FORMAT)
+    return text
+
+
+def format_statement(statement: Dict) -> str:
+    """Render a statement from Ledger.statement() as plain text"""
+    lines = [
+        f"Statement for {statement['name']} (ID: {statement['customer_id']}, {statement['account_type']})",
+        f"Period: {statement['start']} to {statement['end']}",
+        f"Opening Balance: ₹{statement['opening_balance']:.2f}",
+        "",
+    ]
+    for trans in statement["entries"]:
+        lines.append(f"{trans['date']}  {trans['type'].replace('_', ' ').title():<20} ₹{trans['amount']:>10.2f}  "
+                     f"₹{trans['balance']:>10.2f}  {trans.get('recipient_id', '')}  {trans.get('utr', '')}")
+    if not statement["entries"]:
+        lines.append("No transactions in this period")
+    lines += [
+        "",
+        f"Total Credits: ₹{statement['total_credits']:.2f}",
+        f"Total Debits: ₹{statement['total_debits']:.2f}",
+        f"Closing Balance: ₹{statement['closing_balance']:.2f}",
+    ]
+    return "\n".join(lines)
+
+
+def registration_error(request: RegistrationRequest, registry: CustomerRegistry) -> Tuple[Optional[str], float]:
+    """Check a registration against the registered names, returning (error code, parsed balance)"""
+    if isinstance(request, dict):
+        request = tuple(request.get(field) for field in REGISTRATION_FIELDS)
+    name, account_type, dob, address, area, balance = request
+    if not name or not account_type or not dob or not address or not area or balance in ("", None):
+        return ERR_MISSING_FIELDS, 0.0
+    # Check if customer with this name already exists
+    if registry.find(name) is not None:
+        return ERR_DUPLICATE_NAME, 0.0
+    try:
+        initial_balance = float(balance)
+    except (TypeError, ValueError, OverflowError):
+        return ERR_INVALID_AMOUNT, 0.0
+    if not math.isfinite(initial_balance):
+        return ERR_INVALID_AMOUNT, 0.0
+    if initial_balance < 0:
+        return ERR_NEGATIVE_BALANCE, initial_balance
+    if initial_balance > from_paise(MAX_BALANCE_PAISE):
+        return ERR_BALANCE_TOO_LARGE, initial_balance
+    return None, initial_balance
+
+
+def unpack_request(request: TransferRequest) -> Tuple[str, str, Union[str, float], str, Optional[str],
+                                                      Optional[Dict], Optional[Dict]]:
+    """Normalize a transfer request to the full 7-tuple of TransferRequest, missing fields as None"""
+    if isinstance(request, dict):
+        request = (request["sender_id"], request["recipient_id"], request["amount"], request["trans_type"],
+                   request.get("idempotency_key"), request.get("sender_details"), request.get("recipient_details"))
+    sender_id, recipient_id, amount, trans_type = request[:4]
+    idempotency_key = request[4] if len(request) > 4 else None
+    sender_details = request[5] if len(request) > 5 else None
+    recipient_details = request[6] if len(request) > 6 else None
+    return (str(sender_id).strip().upper(), str(recipient_id).strip().upper(), amount, str(trans_type).strip(),
+            None if idempotency_key is None else str(idempotency_key), sender_details, recipient_details)
+
+
+class Ledger:
+    """Owns the customers and applies registrations and transfers to them
+
+    Persistence is a Storage backend: the append-only journal with snapshot
+    checkpoints (mode "journal"), the legacy full-rewrite CSV file (mode
+    "csv"), a SQLite database (mode "sqlite") or any Storage passed in.
+    With async_commit in journal mode, commits are handed to a group-commit
+    writer thread and results carry a Future instead of waiting for disk.
+    If one of those writes fails, its Future raises and every later write
+    is refused until the ledger is reloaded from disk.
+
+    All public methods are thread-safe.  Accounts are guarded by a fixed
+    pool of striped locks, always taken in ascending stripe order, so
+    transfers between disjoint accounts run concurrently without deadlock
+    and a balance check cannot be separated from its debit.
+
+    With hot_days, only the last hot_days of each customer's history stay
+    in memory; older legs are spilled to compressed segment files in
+    spill_dir and read back when a query reaches past the hot window.
+    """
+
+    def __init__(self, mode: str = "journal", journal_dir: str = "bank_journal",
+                 csv_path: str = "bank_transactions.csv", fsync_policy: Optional[FsyncPolicy] = None,
+                 checkpoint_every: int = 10000, customers: Optional[Dict[str, Dict]] = None,
+                 lock_stripes: int = 64, async_commit: bool = False, group_commit_delay_ms: float = 0.0,
+                 id_generator=None, sqlite_path: str = "bank.sqlite3", storage: Optional[Storage] = None,
+                 velocity_limits: Optional[VelocityLimits] = None, hot_days: Optional[float] = None,
+                 spill_dir: str = "bank_spill", metrics: Optional[LedgerMetrics] = None):
+        if storage is None:
+            if mode == "journal":
+                storage = JournalStorage(journal_dir, csv_path, fsync_policy, checkpoint_every,
+                                         async_commit, group_commit_delay_ms)
+            elif mode == "csv":
+                storage = CsvStorage(csv_path)
+            elif mode == "sqlite":
+                storage = SqliteStorage(sqlite_path, csv_path)
+            else:
+                raise ValueError(f"Unknown persistence mode: {mode}")
+        if hot_days is not None and isinstance(storage, CsvStorage):
+            raise ValueError("CSV mode rewrites every transaction from memory, so history cannot be spilled")
+        self.mode = mode
+        self.storage = storage
+        self.customers: Dict[str, Dict] = copy.deepcopy(DEFAULT_CUSTOMERS if customers is None else customers)
+        # Source of transaction IDs and UTRs: anything with next_ids() -> (transaction ID, UTR); by
+        # default a node ID is leased in the storage's directory, so processes sharing it never collide
+        self.id_generator = SnowflakeGenerator(lease_dir=storage.directory) if id_generator is None else id_generator
+        # Rolling per-account limits on outgoing transfers (None = only TRANSFER_LIMIT applies)
+        self.limits = velocity_limits
+        # Days of history kept in memory (None = all of it) and where older legs go
+        self.hot_days = hot_days
+        self.spill_dir = spill_dir
+        self.spill: Optional[SpilledHistory] = None
+        self._evict_lock = threading.Lock()
+        self._next_eviction = 0.0
+        self._stripes = [threading.Lock() for _ in range(lock_stripes)]
+        self._key_stripes = [threading.Lock() for _ in range(lock_stripes)]
+        self._registry_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # Sender legs of transfers in memory as (timestamp, sender ID, leg), kept in date order
+        self._recent: List[Tuple[int, str, Transaction]] = []
+        # (timestamp, recipient ID) of credits settled from other ledgers, whose sender legs are not in _recent
+        self._credited: List[Tuple[int, str]] = []
+        self._clock_lock = threading.Lock()
+        self.lookup = LookupIndex()
+        self.registry = CustomerRegistry()
+        self.registry.rebuild(self.customers)
+        # Idempotency key -> result of the keyed transfer (or its transaction ID, if it predates load())
+        self._idempotency: Dict[str, Union[TransferResult, str]] = {}
+        # Funds held for transfers to other ledgers until they settle, by transaction ID
+        self.holds: Dict[str, Hold] = {}
+        self._held: Dict[str, int] = {}
+        # Number of stripe acquisitions that had to wait for another thread
+        self.lock_contention = 0
+        # Called with the IDs of customers whose details or balance changed
+        self._listeners: List[Callable[[List[str]], None]] = []
+        # Phase timings and transfer counters (None = not instrumented)
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.watch(self)
+
+    # ----- change events -----
+
+    def add_listener(self, listener: Callable[[List[str]], None]):
+        """Call listener(customer IDs) after each commit that registers customers or moves their money
+
+        Listeners run on the committing thread, outside every ledger lock,
+        and should read current values back from the ledger: events from
+        concurrent transfers may arrive out of order.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[List[str]], None]):
+        self._listeners.remove(listener)
+
+    def _notify(self, cust_ids: List[str]):
+        for listener in list(self._listeners):
+            listener(cust_ids)
+
+    # ----- locking -----
+
+    def _stripe(self, cust_id: str) -> int:
+        return hash(cust_id) % len(self._stripes)
+
+    @contextlib.contextmanager
+    def _locked(self, cust_ids: Iterable[str], idempotency_keys: Iterable[str] = ()):
+        """Hold the stripe locks of all given accounts and idempotency keys, acquired in a fixed order
+
+        Key stripes are taken before any account stripe, so two submissions
+        of one key never both get past the check for an earlier result.
+        """
+        locks = [self._key_stripes[index]
+                 for index in sorted({hash(key) % len(self._key_stripes) for key in idempotency_keys})]
+        locks += [self._stripes[index] for index in sorted({self._stripe(cust_id) for cust_id in cust_ids})]
+        acquired = []
+        try:
+            for lock in locks:
+                if not lock.acquire(blocking=False):
+                    with self._stats_lock:
+                        self.lock_contention += 1
+                    lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    # ----- persistence -----
+
+    def load(self):
+        """Load customers and transactions from storage"""
+        self.storage.load(self.customers)
+        # Storage backends build plain dicts; keep the compact form in memory
+        for cust_id, info in self.customers.items():
+            if not isinstance(info, Customer):
+                self.customers[cust_id] = Customer.from_dict(info)
+        self._recent = sorted(
+            ((trans.timestamp, cust_id, trans) for cust_id, info in self.customers.items()
+             for trans in info.transactions if trans.type.endswith("_out")),
+            key=lambda entry: entry[0]
+        )
+        self._credited = sorted(
+            (trans.timestamp, cust_id) for cust_id, info in self.customers.items()
+            for trans in info.transactions if trans.type.endswith("_in") and trans.recipient_id not in self.customers
+        )
+        self._idempotency = dict(self.storage.idempotency_keys)
+        self.lookup = LookupIndex()
+        for cust_id, info in self.customers.items():
+            for trans in info["transactions"]:
+                self.lookup.add(cust_id, trans)
+        with self._registry_lock:
+            self.registry.rebuild(self.customers)
+        if self.hot_days is not None:
+            self.spill = SpilledHistory(self.spill_dir)
+            self._evict(self.customers, self._hot_cutoff())
+        if self.limits is not None:
+            self._rebuild_limits()
+
+    def load_balances(self):
+        """Load only customer details and balances, for read-only use
+
+        Skips what load() builds for history and transfers (in-memory legs,
+        lookups, idempotency keys, spilled segments) and leaves customers in
+        the plain dict form storage builds: balance() and customers are
+        current, but nothing else should be called.
+        """
+        self.storage.load_balances(self.customers)
+
+    def _rebuild_limits(self):
+        """Refill the rolling-limit windows from the transfers still inside them"""
+        now = datetime.datetime.now()
+        since = now - datetime.timedelta(seconds=self.limits.longest_window)
+        trans_types = {trans_type.lower(): trans_type for trans_type in TRANSACTION_TYPES}
+        self.limits.rebuild(
+            (leg["customer_id"], self.customers[leg["customer_id"]]["account_type"],
+             trans_types.get(leg["type"][:-len("_out")], ""), leg["amount"],
+             datetime.datetime.strptime(leg["date"], DATE_FORMAT).timestamp())
+            for leg in self.transfers_between(since, now) if leg["customer_id"] in self.customers
+        )
+
+    # ----- hot/cold tiering -----
+
+    def _hot_cutoff(self) -> int:
+        """Timestamp before which legs leave memory"""
+        return int(time.time() - self.hot_days * DAY)
+
+    def evict(self) -> int:
+        """Spill in-memory legs older than the hot window to a segment file; returns how many"""
+        if self.spill is None:
+            return 0
+        with self._clock_lock:
+            cutoff = self._hot_cutoff()
+            expired = self._recent[:bisect.bisect_left(self._recent, cutoff, key=lambda entry: entry[0])]
+            credited = self._credited[:bisect.bisect_left(self._credited, cutoff, key=lambda entry: entry[0])]
+        cust_ids = ({cust_id for _, cust_id, _ in expired} | {leg.recipient_id for _, _, leg in expired}
+                    | {cust_id for _, cust_id in credited})
+        return self._evict(cust_ids, cutoff)
+
+    def _evict(self, cust_ids: Iterable[str], cutoff: int) -> int:
+        """Spill the legs of cust_ids dated before cutoff"""
+        cust_ids = [cust_id for cust_id in cust_ids if cust_id in self.customers]
+        with self._evict_lock, self._locked(cust_ids):
+            self._next_eviction = time.time() + EVICTION_INTERVAL
+            evicted: Dict[str, List[Transaction]] = {}
+            for cust_id in cust_ids:
+                hot = self.customers[cust_id].transactions
+                count = bisect.bisect_left(hot, cutoff, key=lambda trans: trans.timestamp)
+                if count:
+                    evicted[cust_id] = hot[:count]
+            self.spill.spill(evicted)
+            for cust_id, legs in evicted.items():
+                del self.customers[cust_id].transactions[:len(legs)]
+                for trans in legs:
+                    self.lookup.discard(cust_id, trans)
+            with self._clock_lock:
+                del self._recent[:bisect.bisect_left(self._recent, cutoff, key=lambda entry: entry[0])]
+                del self._credited[:bisect.bisect_left(self._credited, cutoff, key=lambda entry: entry[0])]
+        return sum(len(legs) for legs in evicted.values())
+
+    def _maybe_evict(self):
+        """Run an eviction pass if one is due (callers must not hold any account lock)"""
+        if self.spill is not None and time.time() >= self._next_eviction and not self._evict_lock.locked():
+            self.evict()
+
+    def _reading(self, cust_id: str):
+        """Hold a customer's account lock while eviction could shift its history mid-read"""
+        return self._locked([cust_id]) if self.spill is not None else contextlib.nullcontext()
+
+    def _reading_all(self):
+        """Keep eviction from moving legs between tiers during a bank-wide read"""
+        return self._evict_lock if self.spill is not None else contextlib.nullcontext()
+
+    def _check_storage(self):
+        """Refuse writes once storage has fallen behind memory (a failed asynchronous commit)
+
+        Transfers after the failed one would be journaled with balances that
+        include it, so nothing more is written, and keyed replays are not
+        answered from results that never reached disk, until a reload.
+        """
+        failure = self.storage.failure
+        if failure is not None:
+            raise OSError(f"Storage no longer matches memory after a failed commit ({failure}); reload the ledger")
+
+    def _commit(self, records: List[Dict]) -> Optional[Future]:
+        """Persist records as one commit (callers hold the affected accounts' locks)
+
+        Returns a Future when the storage makes commits durable asynchronously.
+        """
+        if self.metrics is None:
+            return self.storage.commit(records)
+        began = time.perf_counter()
+        future = self.storage.commit(records)
+        self._lap("persistence", began)
+        return future
+
+    def _lap(self, phase: str, began: float) -> float:
+        """Record the time since began against a pipeline phase; returns the current perf_counter()"""
+        now = time.perf_counter()
+        self.metrics.observe(phase, now - began)
+        return now
+
+    def _count_result(self, result: TransferResult):
+        if result.ok:
+            self.metrics.transfers.inc()
+        else:
+            self.metrics.rejections.inc(result.error)
+
+    def flush(self):
+        """Wait until every commit submitted so far is durable"""
+        self.storage.flush()
+
+    def close(self):
+        """Flush and close the storage, then give back a leased node ID"""
+        self.storage.close()
+        close_ids = getattr(self.id_generator, "close", None)
+        if close_ids is not None:
+            close_ids()
+
+    # ----- queries -----
+
+    def balance(self, cust_id: str) -> float:
+        """Current balance of a customer"""
+        return self.customers[cust_id]["balance"]
+
+    def _history_bounds(self, cust_id: str, start=None, end=None) -> Tuple[int, int, int, int]:
+        """(cold lo, cold hi, hot lo, hot hi) positions of a customer's history within start..end
+
+        Checkpointed transactions come first, then any spilled ones (together
+        "cold"), then in-memory ("hot") ones.  All are in date order, so each
+        bound is a binary search.
+        """
+        hot = self.customers[cust_id].transactions
+        stored = self.storage.cold_count(cust_id)
+        spilled = self.spill.count(cust_id) if self.spill is not None else 0
+        if start is None and end is None:
+            return 0, stored + spilled, 0, len(hot)
+        start_text = parse_date_bound(start) if start is not None else ""
+        end_text = parse_date_bound(end, end=True) if end is not None else "9999"
+        cold_lo, cold_hi = 0, 0
+        if stored:
+            cold_lo, cold_hi = self.storage.cold_bounds(cust_id, start_text or None,
+                                                        end_text if end is not None else None)
+        if spilled:
+            # A bound inside the stored part leaves the spilled part's bound at 0 (or all of it)
+            spill_lo, spill_hi = self.spill.bounds(cust_id, date_timestamp(start_text) if start is not None else None,
+                                                   date_timestamp(end_text) if end is not None else None)
+            cold_lo += spill_lo
+            cold_hi += spill_hi
+        hot_hi = len(hot)
+        if start is not None:
+            hot_lo = bisect.bisect_left(hot, date_timestamp(start_text), hi=hot_hi, key=lambda trans: trans.timestamp)
+        else:
+            hot_lo = 0
+        if end is not None:
+            hot_hi = bisect.bisect_right(hot, date_timestamp(end_text), lo=hot_lo, hi=hot_hi,
+                                         key=lambda trans: trans.timestamp)
+        return cold_lo, cold_hi, hot_lo, hot_hi
+
+    def _legs(self, cust_id: str, bounds: Tuple[int, int, int, int], first: int, last: int) -> List[Dict]:
+        """Positions first..last-1 of the history selected by bounds, oldest first"""
+        cold_lo, cold_hi, hot_lo, hot_hi = bounds
+        cold_count = cold_hi - cold_lo
+        last = min(last, cold_count + hot_hi - hot_lo)
+        legs: List[Dict] = []
+        if first >= last:
+            return legs
+        if first < cold_count:
+            legs += self._cold_legs(cust_id, cold_lo + first, cold_lo + min(last, cold_count))
+        if last > cold_count:
+            hot = self.customers[cust_id]["transactions"]
+            legs += hot[hot_lo + max(first - cold_count, 0):hot_lo + last - cold_count]
+        return legs
+
+    def _cold_legs(self, cust_id: str, lo: int, hi: int) -> List[Dict]:
+        """Cold positions lo..hi-1: checkpointed legs, then spilled ones"""
+        stored = self.storage.cold_count(cust_id) if self.spill is not None else hi
+        legs = self.storage.cold_history(cust_id, lo, min(hi, stored)) if lo < stored else []
+        if hi > stored:
+            legs += self.spill.history(cust_id, max(lo - stored, 0), hi - stored)
+        return legs
+
+    def history_count(self, cust_id: str, start=None, end=None) -> int:
+        """Number of transactions in a customer's history, optionally within start..end"""
+        with self._reading(cust_id):
+            cold_lo, cold_hi, hot_lo, hot_hi = self._history_bounds(cust_id, start, end)
+        return cold_hi - cold_lo + hot_hi - hot_lo
+
+    def history(self, cust_id: str, offset: int = 0, limit: int = 50, newest_first: bool = True,
+                start=None, end=None) -> List[Dict]:
+        """One page of a customer's transactions, optionally restricted to start..end
+
+        Recent transactions are in memory; older ones are read from the
+        transaction store through the per-customer history index, or from
+        spilled segments, so a page costs about the same however long the
+        history is.
+        """
+        with self._reading(cust_id):
+            bounds = self._history_bounds(cust_id, start, end)
+            total = bounds[1] - bounds[0] + bounds[3] - bounds[2]
+            if newest_first:
+                page = self._legs(cust_id, bounds, max(total - offset - limit, 0), total - offset)
+                page.reverse()
+                return page
+            return self._legs(cust_id, bounds, offset, offset + limit)
+
+    def transactions(self, cust_id: str) -> List[Dict]:
+        """A customer's full history, oldest first"""
+        return self.history(cust_id, 0, self.history_count(cust_id), newest_first=False)
+
+    def find_transaction(self, transaction_id: str) -> List[Dict]:
+        """Both legs (with customer_id) of the transfer with a transaction ID; empty if unknown"""
+        transaction_id = transaction_id.strip().upper()
+        with self._reading_all():
+            return (self.storage.cold_lookup("transaction_id", transaction_id)
+                    + self._spilled_lookup("transaction_id", transaction_id)
+                    + self.lookup.by_transaction_id(transaction_id))
+
+    def find_utr(self, utr: str) -> List[Dict]:
+        """Both legs (with customer_id) of the transfer with a UTR; empty if unknown"""
+        utr = utr.strip().upper()
+        with self._reading_all():
+            return self.storage.cold_lookup("utr", utr) + self._spilled_lookup("utr", utr) + self.lookup.by_utr(utr)
+
+    def _spilled_lookup(self, field: str, value: str) -> List[Dict]:
+        return self.spill.lookup(field, value) if self.spill is not None else []
+
+    def recent_transfers(self) -> List[Tuple[int, str, Transaction]]:
+        """(timestamp, sender ID, sender leg) of every transfer held in memory or spilled, oldest first"""
+        with self._reading_all():
+            spilled = self.spill.transfers(-2 ** 63, 2 ** 63 - 1) if self.spill is not None else []
+            with self._clock_lock:
+                return spilled + self._recent
+
+    def transfers_between(self, start, end) -> List[Dict]:
+        """Every transfer in the bank dated within start..end, as sender legs with customer_id"""
+        start_text = parse_date_bound(start)
+        end_text = parse_date_bound(end, end=True)
+        start_timestamp, end_timestamp = date_timestamp(start_text), date_timestamp(end_text)
+        with self._reading_all():
+            transfers: List[Dict] = self.storage.cold_transfers(start_text, end_text)
+            recent = self._recent
+            if self.spill is not None:
+                recent = self.spill.transfers(start_timestamp, end_timestamp) + recent
+            lo = bisect.bisect_left(recent, start_timestamp, key=lambda entry: entry[0])
+            hi = bisect.bisect_right(recent, end_timestamp, lo=lo, key=lambda entry: entry[0])
+            transfers += (dict(leg, customer_id=cust_id) for _, cust_id, leg in recent[lo:hi])
+        return transfers
+
+    def statement(self, cust_id: str, start, end) -> Dict:
+        """Statement of a customer's account for start..end with opening and closing balances"""
+        customer = self.customers[cust_id]
+        with self._reading(cust_id):
+            full = self._history_bounds(cust_id)
+            selected = self._history_bounds(cust_id, start, end)
+            # Cold records precede hot ones, so range bounds map straight onto full-history positions
+            first = selected[0] + selected[2]
+            last = selected[1] + selected[3]
+            entries = self._legs(cust_id, full, first, last)
+            previous = self._legs(cust_id, full, first - 1, first) if first > 0 else []
+            following = entries[:1] or self._legs(cust_id, full, last, last + 1)
+        if previous:
+            opening = previous[0]["balance"]
+        elif following:
+            trans = following[0]
+            opening = trans["balance"] + (trans["amount"] if trans["type"].endswith("_out") else -trans["amount"])
+        else:
+            opening = customer["balance"]
+        return {
+            "customer_id": cust_id,
+            "name": customer["name"],
+            "account_type": customer["account_type"],
+            "start": parse_date_bound(start),
+            "end": parse_date_bound(end, end=True),
+            "opening_balance": opening,
+            "closing_balance": entries[-1]["balance"] if entries else opening,
+            "total_credits": sum(t["amount"] for t in entries if not t["type"].endswith("_out")),
+            "total_debits": sum(t["amount"] for t in entries if t["type"].endswith("_out")),
+            "entries": entries,
+        }
+
+    # ----- registration -----
+
+    def register_customer(self, name: str, account_type: str, dob: str, address: str,
+                          area: str, balance: Union[str, float]) -> RegisterResult:
+        """Register a new customer and persist it"""
+        return self.register_many([(name, account_type, dob, address, area, balance)])[0]
+
+    def _new_customer(self, request: RegistrationRequest,
+                      cust_id: Optional[str] = None) -> Tuple[Optional[str], str, Optional[Customer]]:
+        """Validate a registration and allocate its ID if not given, returning (error code, customer ID, info)
+
+        The caller must hold the registry lock.
+        """
+        if isinstance(request, dict):
+            request = tuple(request.get(field) for field in REGISTRATION_FIELDS)
+        name, account_type, dob, address, area, _ = request
+        error, initial_balance = registration_error(request, self.registry)
+        if error is not None:
+            return error, "", None
+        if cust_id is None:
+            cust_id = self.registry.claim(name)
+        else:
+            self.registry.add(cust_id, name)
+        return None, cust_id, Customer(name, dob, address, area, to_paise(initial_balance), account_type)
+
+    def register_many(self, requests: Iterable[RegistrationRequest], chunk_size: int = 10000,
+                      cust_ids: Optional[Sequence[str]] = None) -> List[RegisterResult]:
+        """Register customers in bulk, returning a result per request in order
+
+        Requests are validated against everyone registered before them
+        (including earlier requests in the same call) and persisted as one
+        commit per chunk_size requests.  cust_ids, one per request, are used
+        instead of allocating IDs (for IDs allocated bank-wide elsewhere).
+        A chunk whose commit fails is forgotten again before the error is
+        raised, so its names can be registered once storage recovers.
+        """
+        self._check_storage()
+        results: List[RegisterResult] = []
+        requests = iter(requests)
+        ids = iter(cust_ids) if cust_ids is not None else itertools.repeat(None)
+        while True:
+            chunk = list(itertools.islice(requests, chunk_size))
+            if not chunk:
+                return results
+            records = []
+            first = len(results)
+            with self._registry_lock:
+                for request, given_id in zip(chunk, ids):
+                    error, cust_id, info = self._new_customer(request, given_id)
+                    if error is not None:
+                        results.append(RegisterResult(error))
+                        continue
+                    self.customers[cust_id] = info
+                    records.append(customer_record(cust_id, info))
+                    results.append(RegisterResult(None, cust_id))
+            if records:
+                try:
+                    future = self._commit(records)
+                except BaseException:
+                    self._undo_registrations(results[first:])
+                    raise
+                if future is not None:
+                    results[first:] = [result._replace(commit=future) if result.ok else result
+                                       for result in results[first:]]
+                self._notify([result.customer_id for result in results[first:] if result.ok])
+
+    def _undo_registrations(self, results: List[RegisterResult]):
+        """Forget customers registered in memory whose commit never happened"""
+        with self._registry_lock:
+            for result in results:
+                if result.ok:
+                    info = self.customers.pop(result.customer_id)
+                    self.registry.release(info["name"])
+                    self.registry.invalidate(result.customer_id)
+
+    # ----- transfers -----
+
+    def verify_customer_details(self, cust_id: str, details: Dict) -> Optional[str]:
+        """Check caller-supplied details (e.g. a KYC payload) against a customer's, returning an error code or None
+
+        details needs name, dob, address and area; they match when equal
+        ignoring case and runs of whitespace.  The customer's side is a
+        fingerprint cached by the registry, so a check costs one hash of
+        the supplied details.
+        """
+        customer = self.customers.get(cust_id)
+        if customer is None:
+            return ERR_UNKNOWN_CUSTOMER
+        try:
+            supplied = details_fingerprint(details)
+        except KeyError:
+            return ERR_MISSING_FIELDS
+        if supplied != self.registry.fingerprint(cust_id, customer):
+            return ERR_VERIFICATION_FAILED
+        return None
+
+    def _validate(self, sender_id: str, recipient_id: str, amount, trans_type: str,
+                  sender_details: Optional[Dict] = None, recipient_details: Optional[Dict] = None,
+                  remote_recipient: bool = False) -> Tuple[Optional[str], float]:
+        """Check a transfer request, returning (error code, parsed amount)
+
+        With remote_recipient the recipient's account is on another ledger
+        and is not looked up (or verified) here.  Held funds do not count as
+        available.
+        """
+        if not sender_id or not recipient_id or amount in ("", None) or not trans_type:
+            return ERR_MISSING_FIELDS, 0.0
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError, OverflowError):
+            return ERR_INVALID_AMOUNT, 0.0
+        if not math.isfinite(amount):
+            return ERR_INVALID_AMOUNT, 0.0
+        if sender_id not in self.customers:
+            return ERR_UNKNOWN_SENDER, amount
+        if not remote_recipient and recipient_id not in self.customers:
+            return ERR_UNKNOWN_RECIPIENT, amount
+        if sender_id == recipient_id:
+            return ERR_SAME_ACCOUNT, amount
+        if trans_type not in TRANSACTION_TYPES:
+            return ERR_INVALID_TYPE, amount
+        if amount <= 0:
+            return ERR_NON_POSITIVE_AMOUNT, amount
+        if amount > TRANSFER_LIMIT:
+            return ERR_LIMIT_EXCEEDED, amount
+        if self.customers[sender_id].balance_paise - self._held.get(sender_id, 0) < to_paise(amount):
+            return ERR_INSUFFICIENT_FUNDS, amount
+        if self.limits is not None:
+            breach = self.limits.check(sender_id, self.customers[sender_id]["account_type"], trans_type, amount,
+                                       time.time())
+            if breach is not None:
+                return (ERR_ROLLING_AMOUNT if breach.measure == AMOUNT else ERR_ROLLING_COUNT), amount
+        if sender_details is not None or (recipient_details is not None and not remote_recipient):
+            began = time.perf_counter() if self.metrics is not None else None
+            error = None
+            if sender_details is not None:
+                error = self.verify_customer_details(sender_id, sender_details)
+            if error is None and recipient_details is not None and not remote_recipient:
+                error = self.verify_customer_details(recipient_id, recipient_details)
+            if began is not None:
+                self._lap("verification", began)
+            if error is not None:
+                return error, amount
+        return None, amount
+
+    def _resolve_keys(self, idempotency_keys: Iterable[str]):
+        """Rebuild the results of keyed transfers made before this process started, from their legs
+
+        Called before taking any account lock: find_transaction() takes the
+        eviction lock, which eviction holds while it takes account locks.
+        """
+        for idempotency_key in idempotency_keys:
+            transaction_id = self._idempotency.get(idempotency_key)
+            if transaction_id is None or isinstance(transaction_id, TransferResult):
+                continue
+            legs = self.find_transaction(transaction_id)
+            sender_leg = next(leg for leg in legs if leg["type"].endswith("_out"))
+            # A transfer settled across ledgers has only its debit here
+            recipient_leg = next((leg for leg in legs if leg is not sender_leg), None)
+            leg_type = sender_leg["type"][:-len("_out")]
+            result = TransferResult(
+                None, sender_leg["customer_id"], sender_leg["recipient_id"], sender_leg["amount"],
+                next((name for name in TRANSACTION_TYPES if name.lower() == leg_type), leg_type),
+                sender_leg["date"], sender_leg["transaction_id"], sender_leg["utr"],
+                sender_leg["balance"], recipient_leg["balance"] if recipient_leg is not None else 0.0
+            )
+            with self._locked((), [idempotency_key]):
+                if self._idempotency.get(idempotency_key) == transaction_id:
+                    self._idempotency[idempotency_key] = result
+
+    def _previous_result(self, sender_id: str, recipient_id: str, amount, trans_type: str,
+                         idempotency_key: Optional[str]) -> Optional[TransferResult]:
+        """Result of an earlier transfer submitted with the same idempotency key, if any
+
+        The caller must hold the key's lock, having passed the key to
+        _resolve_keys() before taking it.
+        """
+        if idempotency_key is None or idempotency_key not in self._idempotency:
+            return None
+        previous = self._idempotency[idempotency_key]
+        try:
+            same_amount = round(float(amount), 2) == round(previous.amount, 2)
+        except (TypeError, ValueError):
+            same_amount = False
+        if (sender_id, recipient_id) != (previous.sender_id, previous.recipient_id) or not same_amount:
+            return TransferResult(ERR_KEY_REUSED, sender_id, recipient_id, amount, trans_type)
+        return previous
+
+    def _apply(self, sender_id: str, recipient_id: str, amount, trans_type: str,
+               idempotency_key: Optional[str] = None, sender_details: Optional[Dict] = None,
+               recipient_details: Optional[Dict] = None) -> Tuple[TransferResult, Optional[Dict]]:
+        """Validate and apply one transfer in memory, returning its result and journal record
+
+        The caller must hold the locks of both accounts (and of the
+        idempotency key); only successful transfers claim their key.
+        """
+        began = time.perf_counter() if self.metrics is not None else None
+        error, amount = self._validate(sender_id, recipient_id, amount, trans_type, sender_details,
+                                       recipient_details)
+        if began is not None:
+            began = self._lap("validation", began)
+        if error is not None:
+            return TransferResult(error, sender_id, recipient_id, amount, trans_type), None
+
+        transaction_id, utr = self.id_generator.next_ids()
+        if began is not None:
+            began = self._lap("id_generation", began)
+
+        sender = self.customers[sender_id]
+        recipient = self.customers[recipient_id]
+        amount_paise = to_paise(amount)
+        amount = from_paise(amount_paise)
+        sender.balance_paise -= amount_paise
+        recipient.balance_paise += amount_paise
+
+        # Record sender's and recipient's transactions
+        out_type, in_type = LEG_TYPES[trans_type]
+        with self._clock_lock:
+            # Stamp and log under one lock so the bank-wide recent log stays in date order
+            timestamp = int(time.time())
+            sender_leg = Transaction(timestamp, out_type, amount_paise, sender.balance_paise, recipient_id,
+                                     transaction_id, utr)
+            self._recent.append((timestamp, sender_id, sender_leg))
+        if self.limits is not None:
+            # Counted at the leg's own timestamp, so _undo() can take it back exactly
+            self.limits.record(sender_id, sender.account_type, trans_type, amount, timestamp)
+        recipient_leg = Transaction(timestamp, in_type, amount_paise, recipient.balance_paise, sender_id,
+                                    transaction_id, utr)
+        sender.transactions.append(sender_leg)
+        recipient.transactions.append(recipient_leg)
+        self.lookup.add(sender_id, sender_leg)
+        self.lookup.add(recipient_id, recipient_leg)
+        if began is not None:
+            self._lap("balance_mutation", began)
+
+        result = TransferResult(None, sender_id, recipient_id, amount, trans_type, sender_leg.date,
+                                transaction_id, utr, sender["balance"], recipient["balance"])
+        if idempotency_key is not None:
+            self._idempotency[idempotency_key] = result
+        return result, transfer_record(sender_id, sender_leg, recipient_id, recipient_leg, idempotency_key)
+
+    def _undo(self, applied: List[Tuple[TransferResult, Optional[str]]]):
+        """Reverse transfers applied in memory whose commit never happened, newest first
+
+        applied holds (result, idempotency key) of each transfer _apply()
+        made, in order; the caller still holds their locks, so each one's
+        legs are the last of both accounts' in-memory histories.
+        """
+        for result, idempotency_key in reversed(applied):
+            sender = self.customers[result.sender_id]
+            recipient = self.customers[result.recipient_id]
+            sender_leg = sender.transactions.pop()
+            recipient_leg = recipient.transactions.pop()
+            sender.balance_paise += sender_leg.amount_paise
+            recipient.balance_paise -= recipient_leg.amount_paise
+            self.lookup.discard(result.sender_id, sender_leg)
+            self.lookup.discard(result.recipient_id, recipient_leg)
+            with self._clock_lock:
+                for position in range(len(self._recent) - 1, -1, -1):
+                    if self._recent[position][2] is sender_leg:
+                        del self._recent[position]
+                        break
+            if self.limits is not None:
+                self.limits.unrecord(result.sender_id, sender.account_type, result.trans_type, result.amount,
+                                     sender_leg.timestamp)
+            if idempotency_key is not None and self._idempotency.get(idempotency_key) is result:
+                del self._idempotency[idempotency_key]
+
+    def transfer(self, sender_id: str, recipient_id: str, amount: Union[str, float], trans_type: str,
+                 idempotency_key: Optional[str] = None, sender_details: Optional[Dict] = None,
+                 recipient_details: Optional[Dict] = None) -> TransferResult:
+        """Validate, apply and persist a single transfer
+
+        A transfer resubmitted with the idempotency_key of an earlier
+        successful one returns that transfer's result and moves no money.
+        With sender_details or recipient_details, the transfer is refused
+        unless they match that customer's (see verify_customer_details).
+        """
+        self._check_storage()
+        request = unpack_request((sender_id, recipient_id, amount, trans_type, idempotency_key, sender_details,
+                                  recipient_details))
+        keys = [request[4]] if request[4] is not None else []
+        self._resolve_keys(keys)
+        with self._locked(request[:2], keys):
+            previous = self._previous_result(*request[:5])
+            if previous is not None:
+                # A replay of a committed transfer is neither applied nor rejected
+                if self.metrics is not None and not previous.ok:
+                    self._count_result(previous)
+                return previous
+            result, record = self._apply(*request)
+            # Journal while still holding the locks so legs of one account stay in order
+            if record is not None:
+                try:
+                    commit = self._commit([record])
+                except BaseException:
+                    self._undo([(result, request[4])])
+                    raise
+                result = result._replace(commit=commit)
+                if result.commit is not None and request[4] is not None:
+                    self._idempotency[request[4]] = result
+        if record is not None:
+            self._notify([result.sender_id, result.recipient_id])
+        if self.metrics is not None:
+            self._count_result(result)
+        self._maybe_evict()
+        return result
+
+    def transfer_many(self, requests: Iterable[TransferRequest]) -> List[TransferResult]:
+        """Apply a batch of transfers in order and persist them all as one commit
+
+        Each request is validated against the balances left by the requests
+        before it; rejected requests get an error result and are not applied.
+        If anything raises part way (or the commit fails), every transfer the
+        batch applied is undone before the error propagates.
+        """
+        self._check_storage()
+        requests = [unpack_request(request) for request in requests]
+        accounts = {request[0] for request in requests} | {request[1] for request in requests}
+        keys = {request[4] for request in requests if request[4] is not None}
+        self._resolve_keys(keys)
+        results = []
+        records = []
+        applied = []
+        with self._locked(accounts, keys):
+            try:
+                for request in requests:
+                    previous = self._previous_result(*request[:5])
+                    if previous is not None:
+                        results.append(previous)
+                        continue
+                    result, record = self._apply(*request)
+                    if record is not None:
+                        records.append(record)
+                        applied.append(len(results))
+                    results.append(result)
+                future = self._commit(records) if records else None
+            except BaseException:
+                self._undo([(results[position], requests[position][4]) for position in applied])
+                raise
+            if future is not None:
+                for position in applied:
+                    results[position] = results[position]._replace(commit=future)
+                    if requests[position][4] is not None:
+                        self._idempotency[requests[position][4]] = results[position]
+        if self.metrics is not None:
+            self.metrics.transfers.inc(amount=len(applied))
+            for result in results:
+                if not result.ok:
+                    self.metrics.rejections.inc(result.error)
+        if applied:
+            self._notify(sorted({cust_id for position in applied
+                                 for cust_id in (results[position].sender_id, results[position].recipient_id)}))
+        self._maybe_evict()
+        return results
+
+    def transfer_concurrent(self, requests: Iterable[TransferRequest], workers: int = 8) -> List[TransferResult]:
+        """Run independent transfers on a thread pool, returning results in request order
+
+        Unlike transfer_many() there is no ordering between requests: each
+        one commits on its own as soon as it holds its two accounts.
+        """
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transfer") as pool:
+            return list(pool.map(lambda request: self.transfer(*unpack_request(request)), requests))
+
+    # ----- transfers between ledgers -----
+
+    def reserve(self, sender_id: str, recipient_id: str, amount: Union[str, float], trans_type: str,
+                idempotency_key: Optional[str] = None, sender_details: Optional[Dict] = None,
+                recipient_details: Optional[Dict] = None) -> TransferResult:
+        """Phase one of a transfer to an account on another ledger: validate it and hold the amount
+
+        The recipient is not looked up here, and recipient_details are
+        left for the recipient's ledger to verify.  The result carries the
+        transaction ID and UTR the transfer will have; until settle_many() or
+        release() with that ID, the amount stays in holds and is not
+        available to other transfers.  Holds live in memory only, so a
+        restart drops them: whoever decided to settle must have logged that
+        decision and re-drives settle_many() after the restart.  A keyed
+        replay of an earlier transfer returns its result and holds nothing.
+        """
+        self._check_storage()
+        request = unpack_request((sender_id, recipient_id, amount, trans_type, idempotency_key, sender_details,
+                                  recipient_details))
+        sender_id, recipient_id, amount, trans_type, idempotency_key, sender_details, _ = request
+        keys = [idempotency_key] if idempotency_key is not None else []
+        self._resolve_keys(keys)
+        with self._locked([sender_id], keys):
+            previous = self._previous_result(*request[:5])
+            if previous is not None:
+                return previous
+            error, amount = self._validate(sender_id, recipient_id, amount, trans_type, sender_details,
+                                           remote_recipient=True)
+            if error is not None:
+                return TransferResult(error, sender_id, recipient_id, amount, trans_type)
+            transaction_id, utr = self.id_generator.next_ids()
+            amount_paise = to_paise(amount)
+            counted_at = time.time()
+            if self.limits is not None:
+                # Counted now, so later transfers see it; release() takes it back
+                self.limits.record(sender_id, self.customers[sender_id].account_type, trans_type,
+                                   from_paise(amount_paise), counted_at)
+            self.holds[transaction_id] = Hold(sender_id, amount_paise, trans_type, counted_at)
+            self._held[sender_id] = self._held.get(sender_id, 0) + amount_paise
+            result = TransferResult(None, sender_id, recipient_id, from_paise(amount_paise), trans_type, "",
+                                    transaction_id, utr, self.customers[sender_id]["balance"])
+            if idempotency_key is not None:
+                self._idempotency[idempotency_key] = result
+        return result
+
+    def release(self, transaction_id: str, idempotency_key: Optional[str] = None) -> bool:
+        """Abort a reserved transfer, making its amount available again; False if nothing was held"""
+        hold = self.holds.get(transaction_id)
+        if hold is None:
+            return False
+        keys = [idempotency_key] if idempotency_key is not None else []
+        with self._locked([hold.sender_id], keys):
+            if self.holds.pop(transaction_id, None) is None:
+                return False
+            self._unhold(hold)
+            if self.limits is not None:
+                self.limits.unrecord(hold.sender_id, self.customers[hold.sender_id].account_type, hold.trans_type,
+                                     from_paise(hold.amount_paise), hold.counted_at)
+            previous = self._idempotency.get(idempotency_key) if idempotency_key is not None else None
+            if isinstance(previous, TransferResult) and previous.transaction_id == transaction_id:
+                del self._idempotency[idempotency_key]
+        return True
+
+    def _unhold(self, hold: Hold):
+        remaining = self._held[hold.sender_id] - hold.amount_paise
+        if remaining:
+            self._held[hold.sender_id] = remaining
+        else:
+            del self._held[hold.sender_id]
+
+    def settle_many(self, settlements: Iterable[Settlement]) -> List[TransferResult]:
+        """Phase two: journal this ledger's side of transfers between ledgers, as one commit
+
+        A debit consumes the sender's hold; a debit whose hold is gone
+        (the ledger restarted since reserve()) is applied anyway, as the
+        decision to settle was taken against the funds held then.  A side
+        whose leg is already journaled is skipped (its result has no
+        balances), so a coordinator can re-drive settlements after a crash.
+        Otherwise results carry the sender's balance for debits and the
+        recipient's for credits.  If anything raises part way (or the commit
+        fails), every settlement the batch applied is undone, holds
+        included, before the error propagates.
+        """
+        self._check_storage()
+        settlements = list(settlements)
+        done = {position for position, settlement in enumerate(settlements)
+                if settlement.transaction_id not in self.holds and self._settled(settlement)}
+        accounts = {settlement.sender_id if settlement.debit else settlement.recipient_id
+                    for position, settlement in enumerate(settlements) if position not in done}
+        results = []
+        records = []
+        applied = []
+        with self._locked(accounts):
+            try:
+                for position, settlement in enumerate(settlements):
+                    if position in done:
+                        results.append(TransferResult(None, settlement.sender_id, settlement.recipient_id,
+                                                      from_paise(settlement.amount_paise), settlement.trans_type,
+                                                      transaction_id=settlement.transaction_id, utr=settlement.utr))
+                        continue
+                    out_type, in_type = LEG_TYPES[settlement.trans_type]
+                    if settlement.debit:
+                        cust_id, counterparty_id, leg_type = settlement.sender_id, settlement.recipient_id, out_type
+                    else:
+                        cust_id, counterparty_id, leg_type = settlement.recipient_id, settlement.sender_id, in_type
+                    customer = self.customers[cust_id]
+                    key = settlement.idempotency_key if settlement.debit else None
+                    hold = self.holds.pop(settlement.transaction_id, None)
+                    if hold is not None:
+                        self._unhold(hold)
+                    recorded = None
+                    if settlement.debit:
+                        customer.balance_paise -= settlement.amount_paise
+                        # A held debit was counted against the limits by reserve()
+                        if self.limits is not None and hold is None:
+                            recorded = time.time()
+                            self.limits.record(cust_id, customer.account_type, settlement.trans_type,
+                                               from_paise(settlement.amount_paise), recorded)
+                    else:
+                        customer.balance_paise += settlement.amount_paise
+                    with self._clock_lock:
+                        timestamp = int(time.time())
+                        leg = Transaction(timestamp, leg_type, settlement.amount_paise, customer.balance_paise,
+                                          counterparty_id, settlement.transaction_id, settlement.utr)
+                        if settlement.debit:
+                            self._recent.append((timestamp, cust_id, leg))
+                        else:
+                            self._credited.append((timestamp, cust_id))
+                    customer.transactions.append(leg)
+                    self.lookup.add(cust_id, leg)
+                    applied.append((settlement, hold, recorded, self._idempotency.get(key)))
+                    result = TransferResult(None, settlement.sender_id, settlement.recipient_id,
+                                            from_paise(settlement.amount_paise), settlement.trans_type, leg.date,
+                                            settlement.transaction_id, settlement.utr,
+                                            customer["balance"] if settlement.debit else 0.0,
+                                            0.0 if settlement.debit else customer["balance"])
+                    if key is not None:
+                        self._idempotency[key] = result
+                    records.append(leg_record(cust_id, leg, key))
+                    results.append(result)
+                future = self._commit(records) if records else None
+            except BaseException:
+                self._undo_settlements(applied)
+                raise
+            if future is not None:
+                results = [result._replace(commit=future) for result in results]
+        if self.metrics is not None:
+            self.metrics.transfers.inc(amount=sum(1 for position, settlement in enumerate(settlements)
+                                                  if settlement.debit and position not in done))
+        if accounts:
+            self._notify(sorted(accounts))
+        self._maybe_evict()
+        return results
+
+    def _undo_settlements(self, applied: List[Tuple[Settlement, Optional[Hold], Optional[float],
+                                                    Optional[Union[TransferResult, str]]]]):
+        """Reverse settlements applied in memory whose commit never happened, newest first
+
+        applied holds (settlement, hold it consumed, time its debit was
+        counted against the limits, result its idempotency key had before)
+        in order; the caller still holds the account locks, so each one's
+        leg is the last of its account's in-memory history.  Consumed holds
+        are taken again, so the settlement can be re-driven.
+        """
+        for settlement, hold, recorded, previous in reversed(applied):
+            cust_id = settlement.sender_id if settlement.debit else settlement.recipient_id
+            customer = self.customers[cust_id]
+            leg = customer.transactions.pop()
+            customer.balance_paise += leg.amount_paise if settlement.debit else -leg.amount_paise
+            self.lookup.discard(cust_id, leg)
+            with self._clock_lock:
+                if settlement.debit:
+                    for position in range(len(self._recent) - 1, -1, -1):
+                        if self._recent[position][2] is leg:
+                            del self._recent[position]
+                            break
+                else:
+                    self._credited.remove((leg.timestamp, cust_id))
+            if recorded is not None:
+                self.limits.unrecord(cust_id, customer.account_type, settlement.trans_type,
+                                     from_paise(settlement.amount_paise), recorded)
+            if settlement.debit and settlement.idempotency_key is not None:
+                if previous is None:
+                    self._idempotency.pop(settlement.idempotency_key, None)
+                else:
+                    self._idempotency[settlement.idempotency_key] = previous
+            if hold is not None:
+                self.holds[settlement.transaction_id] = hold
+                self._held[hold.sender_id] = self._held.get(hold.sender_id, 0) + hold.amount_paise
+
+    def _settled(self, settlement: Settlement) -> bool:
+        """Whether this ledger already journaled its side of a settlement"""
+        cust_id = settlement.sender_id if settlement.debit else settlement.recipient_id
+        return any(leg["customer_id"] == cust_id for leg in self.find_transaction(settlement.transaction_id))
@@ -0,0 +1,160 @@
+"""Rolling-window velocity limits on outgoing transfers"""
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from txstore import to_paise
+
+# Window lengths in seconds
+HOUR = 3600
+DAY = 86400
+
+# Buckets per window; a transfer stays counted for between one window and one window plus one bucket
+WINDOW_BUCKETS = 60
+
+# What a limit caps: the total amount sent, or the number of transfers
+AMOUNT = "amount"
+COUNT = "count"
+
+
+class Limit(NamedTuple):
+    """A cap on an account's outgoing transfers within a rolling window"""
+    window: int  # Seconds
+    max_amount: Optional[float] = None
+    max_count: Optional[int] = None
+    trans_type: Optional[str] = None  # Only transfers of this type count (None = all types)
+
+
+class Breach(NamedTuple):
+    """The limit a transfer would break and whether by amount or by count"""
+    limit: Limit
+    measure: str
+
+
+class SlidingWindow:
+    """Amount (paise) and count of transfers in a rolling window, as a ring of time buckets
+
+    Running totals are adjusted as transfers are added and buckets expire,
+    so reading them never looks at individual transfers.
+    """
+
+    __slots__ = ("bucket_seconds", "amounts", "counts", "amount", "count", "newest")
+
+    def __init__(self, window: int, buckets: int = WINDOW_BUCKETS):
+        self.bucket_seconds = max(1, window // buckets)
+        # One slot more than the window's buckets: the current, partly elapsed bucket
+        self.amounts = [0] * (buckets + 1)
+        self.counts = [0] * (buckets + 1)
+        self.amount = 0
+        self.count = 0
+        self.newest = -1  # Bucket number of the newest slot
+
+    def _advance(self, bucket: int):
+        """Expire the buckets that have left the window by the start of bucket"""
+        if bucket <= self.newest:
+            return
+        slots = len(self.amounts)
+        for expired in range(max(self.newest + 1, bucket - slots + 1), bucket + 1):
+            slot = expired % slots
+            self.amount -= self.amounts[slot]
+            self.count -= self.counts[slot]
+            self.amounts[slot] = 0
+            self.counts[slot] = 0
+        self.newest = bucket
+
+    def totals(self, now: float) -> Tuple[int, int]:
+        """(amount, count) within the window ending at now"""
+        self._advance(int(now // self.bucket_seconds))
+        return self.amount, self.count
+
+    def add(self, now: float, amount: int, count: int = 1):
+        """Count a transfer of amount paise made at now (ignored if already outside the window)
+
+        A negative amount and count take back a transfer added earlier.
+        """
+        bucket = int(now // self.bucket_seconds)
+        self._advance(bucket)
+        if bucket <= self.newest - len(self.amounts):
+            return
+        slot = bucket % len(self.amounts)
+        self.amounts[slot] += amount
+        self.counts[slot] += count
+        self.amount += amount
+        self.count += count
+
+
+class VelocityLimits:
+    """Per-account rolling limits, checked and updated in constant time per transfer
+
+    Each account is bound by the limits of its account type, unless it has
+    limits of its own, which replace them.  Every limit keeps one
+    SlidingWindow per account, created on the account's first transfer.
+    Callers serialize check() and record() per account (the ledger holds
+    the sender's account lock).
+    """
+
+    def __init__(self, by_account_type: Optional[Dict[str, List[Limit]]] = None,
+                 by_account: Optional[Dict[str, List[Limit]]] = None, buckets: int = WINDOW_BUCKETS):
+        self.by_account_type = by_account_type or {}
+        self.by_account = by_account or {}
+        self.buckets = buckets
+        self._windows: Dict[str, List[SlidingWindow]] = {}
+
+    @property
+    def longest_window(self) -> int:
+        """Seconds of history needed to rebuild every window"""
+        limits = [limit for group in (*self.by_account_type.values(), *self.by_account.values()) for limit in group]
+        return max((limit.window for limit in limits), default=0)
+
+    def limits_for(self, cust_id: str, account_type: str) -> List[Limit]:
+        """The limits that apply to an account"""
+        limits = self.by_account.get(cust_id)
+        return limits if limits is not None else self.by_account_type.get(account_type, [])
+
+    def _account_windows(self, cust_id: str, limits: List[Limit]) -> List[SlidingWindow]:
+        windows = self._windows.get(cust_id)
+        if windows is None:
+            windows = self._windows.setdefault(cust_id, [SlidingWindow(limit.window, self.buckets)
+                                                         for limit in limits])
+        return windows
+
+    def check(self, cust_id: str, account_type: str, trans_type: str, amount: float,
+              now: float) -> Optional[Breach]:
+        """The first limit an outgoing transfer would break, or None if it is allowed"""
+        limits = self.limits_for(cust_id, account_type)
+        if not limits:
+            return None
+        paise = to_paise(amount)
+        for limit, window in zip(limits, self._account_windows(cust_id, limits)):
+            if limit.trans_type is not None and limit.trans_type != trans_type:
+                continue
+            total, count = window.totals(now)
+            if limit.max_amount is not None and total + paise > to_paise(limit.max_amount):
+                return Breach(limit, AMOUNT)
+            if limit.max_count is not None and count + 1 > limit.max_count:
+                return Breach(limit, COUNT)
+        return None
+
+    def record(self, cust_id: str, account_type: str, trans_type: str, amount: float, now: float):
+        """Count an outgoing transfer against the account's limits"""
+        limits = self.limits_for(cust_id, account_type)
+        if not limits:
+            return
+        paise = to_paise(amount)
+        for limit, window in zip(limits, self._account_windows(cust_id, limits)):
+            if limit.trans_type is None or limit.trans_type == trans_type:
+                window.add(now, paise)
+
+    def unrecord(self, cust_id: str, account_type: str, trans_type: str, amount: float, now: float):
+        """Take back a transfer counted by record() with the same arguments (it was never committed)"""
+        limits = self.limits_for(cust_id, account_type)
+        if not limits:
+            return
+        paise = to_paise(amount)
+        for limit, window in zip(limits, self._account_windows(cust_id, limits)):
+            if limit.trans_type is None or limit.trans_type == trans_type:
+                window.add(now, -paise, -1)
+
+    def rebuild(self, transfers: Iterable[Tuple[str, str, str, float, float]]):
+        """Reset every window from (customer ID, account type, transaction type, amount, epoch) tuples, oldest first"""
+        self._windows = {}
+        for cust_id, account_type, trans_type, amount, when in transfers:
+            self.record(cust_id, account_type, trans_type, amount, when)
@@ -0,0 +1,92 @@
+"""Hash index from transaction ID and UTR to the legs of each transfer"""
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+from txstore import TransactionStore
+
+# Transaction ID and UTR fields of a transaction store record (the tail of RECORD_STRUCT)
+KEY_STRUCT = struct.Struct("<64x16s16s")
+
+# A leg is either a store record index or (customer ID, in-memory leg)
+LegRef = Union[int, Tuple[str, Dict]]
+
+
+class LookupIndex:
+    """Finds both legs of a transfer by transaction ID or UTR in O(1)
+
+    Legs in memory are indexed as they are appended.  Legs checkpointed
+    before startup exist only in the transaction store; they are indexed by
+    store position on the first lookup, which reads just the two key fields
+    of each record, so startup never pays for a scan of the store.
+    """
+
+    def __init__(self, store: Optional[TransactionStore] = None, store_records: int = 0):
+        self.store = store
+        self.store_records = store_records if store is not None else 0
+        self._by_id: Dict[str, List[LegRef]] = {}
+        self._by_utr: Dict[str, List[LegRef]] = {}
+        self._cold_by_id: Optional[Dict[str, List[int]]] = None
+        self._cold_by_utr: Optional[Dict[str, List[int]]] = None
+        self._cold_lock = threading.Lock()
+
+    def add(self, cust_id: str, leg: Dict):
+        """Index one in-memory leg"""
+        ref = (cust_id, leg)
+        if leg.get("transaction_id"):
+            self._by_id.setdefault(leg["transaction_id"], []).append(ref)
+        if leg.get("utr"):
+            self._by_utr.setdefault(leg["utr"], []).append(ref)
+
+    def discard(self, cust_id: str, leg: Dict):
+        """Stop indexing an in-memory leg (it has been evicted from memory)"""
+        for index, key in ((self._by_id, leg.get("transaction_id")), (self._by_utr, leg.get("utr"))):
+            refs = index.get(key)
+            if not refs:
+                continue
+            refs[:] = [ref for ref in refs if ref[1] is not leg]
+            if not refs:
+                del index[key]
+
+    def _load_cold(self):
+        """Index the store records below store_records (once)"""
+        with self._cold_lock:
+            if self._cold_by_id is not None:
+                return
+            by_id: Dict[str, List[int]] = {}
+            by_utr: Dict[str, List[int]] = {}
+            chunk = 65536
+            for start in range(0, self.store_records, chunk):
+                data = self.store._read_bytes(start, min(start + chunk, self.store_records))
+                for index, (txn_id, utr) in enumerate(KEY_STRUCT.iter_unpack(data), start):
+                    txn_id = txn_id.rstrip(b"\0").decode("ascii")
+                    utr = utr.rstrip(b"\0").decode("ascii")
+                    if txn_id:
+                        by_id.setdefault(txn_id, []).append(index)
+                    if utr:
+                        by_utr.setdefault(utr, []).append(index)
+            self._cold_by_utr = by_utr
+            self._cold_by_id = by_id
+
+    def _legs(self, cold: List[int], hot: List[LegRef]) -> List[Dict]:
+        legs = [self.store.read(index) for index in cold]
+        legs += [dict(leg, customer_id=cust_id) for cust_id, leg in hot]
+        return legs
+
+    def by_transaction_id(self, transaction_id: str) -> List[Dict]:
+        """Every leg (with customer_id) carrying a transaction ID, oldest first"""
+        if self.store_records:
+            self._load_cold()
+            cold = self._cold_by_id.get(transaction_id, [])
+        else:
+            cold = []
+        return self._legs(cold, self._by_id.get(transaction_id, []))
+
+    def by_utr(self, utr: str) -> List[Dict]:
+        """Every leg (with customer_id) carrying a UTR, oldest first"""
+        if self.store_records:
+            self._load_cold()
+            cold = self._cold_by_utr.get(utr, [])
+        else:
+            cold = []
+        return self._legs(cold, self._by_utr.get(utr, []))
@@ -0,0 +1,294 @@
+"""In-process metrics for the ledger: counters, histograms and gauges with pluggable exporters
+
+Instruments are plain Python objects updated under a short lock, so a
+transfer pays a few perf_counter() calls and bucket increments.
+Exporters read them on demand: PrometheusExporter serves the Prometheus
+text format over a local HTTP endpoint and JsonExporter dumps a JSON
+snapshot to a file.
+"""
+import bisect
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Default port of the Prometheus endpoint
+PROMETHEUS_PORT = 9108
+
+
+def _label_text(label: Optional[str], value: str) -> str:
+    if label is None:
+        return ""
+    escaped = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return f'{label}="{escaped}"'
+
+
+def _braced(*parts: str) -> str:
+    parts = [part for part in parts if part]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by one label"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label: Optional[str] = None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._lock = threading.Lock()
+        self._values: Dict[str, int] = {}
+
+    def inc(self, value: str = "", amount: int = 1):
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
+
+    def prometheus_lines(self) -> List[str]:
+        return [f"{self.name}{_braced(_label_text(self.label, value))} {count}"
+                for value, count in sorted(self.snapshot().items())]
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observations, optionally split by one label"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label: Optional[str] = None,
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # Per label value: [count per bucket (the last is +Inf), sum, count]
+        self._series: Dict[str, list] = {}
+
+    def observe(self, amount: float, value: str = ""):
+        slot = bisect.bisect_left(self.buckets, amount)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += amount
+            series[2] += 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Per label value: cumulative bucket counts keyed by upper bound, sum and count"""
+        with self._lock:
+            series = {value: (list(counts), total, count) for value, (counts, total, count) in self._series.items()}
+        result = {}
+        for value, (counts, total, count) in series.items():
+            cumulative, running = {}, 0
+            for bound, bucket_count in zip([*map(str, self.buckets), "+Inf"], counts):
+                running += bucket_count
+                cumulative[bound] = running
+            result[value] = {"buckets": cumulative, "sum": total, "count": count}
+        return result
+
+    def prometheus_lines(self) -> List[str]:
+        lines = []
+        for value, series in sorted(self.snapshot().items()):
+            label = _label_text(self.label, value)
+            for bound, count in series["buckets"].items():
+                bound_label = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_braced(label, bound_label)} {count}")
+            lines.append(f"{self.name}_sum{_braced(label)} {_number(series['sum'])}")
+            lines.append(f"{self.name}_count{_braced(label)} {series['count']}")
+        return lines
+
+
+class Gauge:
+    """A value read from a callable whenever the metrics are exported"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def snapshot(self) -> float:
+        return self.read()
+
+    def prometheus_lines(self) -> List[str]:
+        return [f"{self.name} {_number(self.snapshot())}"]
+
+
+class MetricsRegistry:
+    """Named instruments, exported together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, label: Optional[str] = None) -> Counter:
+        return self._add(Counter(name, help_text, label))
+
+    def histogram(self, name: str, help_text: str, label: Optional[str] = None,
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, label, buckets))
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> Gauge:
+        return self._add(Gauge(name, help_text, read))
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Every metric as {"type", "help", "value"}, for the JSON dump"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: {"type": metric.kind, "help": metric.help, "value": metric.snapshot()}
+                for metric in metrics}
+
+    def prometheus_text(self) -> str:
+        """Every metric in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines += metric.prometheus_lines()
+        return "\n".join(lines) + "\n"
+
+
+class LedgerMetrics:
+    """The ledger's instruments: phase timings, transfer outcomes and size gauges
+
+    Phases are validation (which includes verification), verification,
+    id_generation, balance_mutation, persistence (every commit) and
+    ui_render (observed by the GUI).
+    """
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = MetricsRegistry() if registry is None else registry
+        self.phase_seconds = self.registry.histogram("bank_transfer_phase_seconds",
+                                                     "Time spent in each phase of the transfer pipeline", "phase")
+        self.transfers = self.registry.counter("bank_transfers_total", "Transfers applied")
+        self.rejections = self.registry.counter("bank_transfers_rejected_total", "Transfers rejected, by error code",
+                                                "reason")
+
+    def observe(self, phase: str, seconds: float):
+        self.phase_seconds.observe(seconds, phase)
+
+    def watch(self, ledger):
+        """Add gauges that read a ledger's size when exported"""
+        self.registry.gauge("bank_customers", "Registered customers", lambda: len(ledger.customers))
+        self.registry.gauge("bank_history_in_memory", "Transaction legs held in memory",
+                            lambda: sum(len(info.transactions) for info in list(ledger.customers.values())))
+        self.registry.gauge("bank_history_spilled", "Transaction legs spilled to compressed segments",
+                            lambda: len(ledger.spill) if ledger.spill is not None else 0)
+        self.registry.gauge("bank_lock_contention", "Account lock acquisitions that had to wait",
+                            lambda: ledger.lock_contention)
+        self.registry.gauge("bank_compaction_failures", "Journal compactions that failed and were rolled back",
+                            lambda: ledger.storage.compaction_failures)
+
+
+class Exporter:
+    """Publishes a MetricsRegistry; start() begins publishing and close() stops"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class PrometheusExporter(Exporter):
+    """Serves /metrics (Prometheus text format) and /metrics.json on a local HTTP port"""
+
+    def __init__(self, registry: MetricsRegistry, port: int = PROMETHEUS_PORT, host: str = "127.0.0.1"):
+        super().__init__(registry)
+        self.host = host
+        self.port = port
+        self._server: Optional["ThreadingHTTPServer"] = None
+
+    def start(self):
+        # Imported here: http.server is slow to import and only the exporter needs it
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = registry.prometheus_text(), "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(registry.snapshot()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        # Port 0 picks a free port; report the real one
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class JsonExporter(Exporter):
+    """Dumps a JSON snapshot to a file every interval seconds (if given) and on close()"""
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval: Optional[float] = None):
+        super().__init__(registry)
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def dump(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.registry.snapshot(), file, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def start(self):
+        if self.interval:
+            self._thread = threading.Thread(target=self._run, name="metrics-json", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.dump()
@@ -0,0 +1,310 @@
+"""Ledger integrity audit: balance chains, counter-leg pairing and conservation of money"""
+import json
+import os
+import sqlite3
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ledger import Ledger
+from storage import CsvStorage, JournalStorage, SqliteStorage
+from txstore import RECORD_SIZE, RECORD_STRUCT, _DateCache, to_paise
+
+# Shards per worker process, so one slow shard does not hold up the whole audit
+SHARDS_PER_WORKER = 4
+
+# Customers per shard of in-memory history
+HOT_SHARD_CUSTOMERS = 5000
+
+# Records read from the transaction store at a time
+READ_CHUNK = 65536
+
+# A leg as the workers see it: customer, type, amount and balance in paise, counterparty,
+# transaction ID, UTR, date
+Leg = Tuple[str, str, int, int, str, str, str, str]
+
+# Pairing signature of a leg: transaction ID, direction ("out"/"in"), sender, recipient, amount, UTR, date
+Signature = Tuple[str, str, str, str, int, str, str]
+
+
+class Fragment(NamedTuple):
+    """A customer's legs within one shard, reduced to what chain stitching needs"""
+    opening: int  # Balance before the first leg (paise)
+    closing: int  # Balance after the last leg (paise)
+    first_transaction_id: str
+    first_date: str
+
+
+class ShardResult(NamedTuple):
+    """What a worker found in one shard of legs"""
+    legs: int
+    fragments: Dict[str, Fragment]
+    discrepancies: List[Dict]
+    partitions: List[List[Signature]]
+
+
+def discrepancy(check: str, customer_id: str = "", transaction_id: str = "", **detail) -> Dict:
+    """One entry of the report's discrepancy list"""
+    return dict(check=check, customer_id=customer_id, transaction_id=transaction_id, **detail)
+
+
+def _check_legs(legs: Iterable[Leg], partitions: int) -> ShardResult:
+    """Check the balance chain within a shard and partition its legs for pairing"""
+    fragments: Dict[str, Fragment] = {}
+    closing: Dict[str, int] = {}
+    found: List[Dict] = []
+    signatures: List[List[Signature]] = [[] for _ in range(partitions)]
+    count = 0
+    for cust_id, leg_type, amount, balance, counterparty, txn_id, utr, date in legs:
+        count += 1
+        outgoing = leg_type.endswith("_out")
+        if not outgoing and not leg_type.endswith("_in"):
+            found.append(discrepancy("unknown_leg_type", cust_id, txn_id, type=leg_type, date=date))
+            continue
+        opening = balance + amount if outgoing else balance - amount
+        previous = closing.get(cust_id)
+        if previous is None:
+            fragments[cust_id] = Fragment(opening, balance, txn_id, date)
+        elif previous != opening:
+            found.append(discrepancy("balance_chain", cust_id, txn_id, date=date, expected_paise=previous,
+                                     actual_paise=opening))
+        closing[cust_id] = balance
+        if amount <= 0:
+            found.append(discrepancy("non_positive_amount", cust_id, txn_id, date=date, amount_paise=amount))
+        if not txn_id:
+            found.append(discrepancy("missing_transaction_id", cust_id, date=date))
+            continue
+        sender, recipient = (cust_id, counterparty) if outgoing else (counterparty, cust_id)
+        partition = zlib.crc32(txn_id.encode("utf-8")) % partitions
+        signatures[partition].append((txn_id, "out" if outgoing else "in", sender, recipient, amount, utr, date))
+    for cust_id, fragment in fragments.items():
+        fragments[cust_id] = fragment._replace(closing=closing[cust_id])
+    return ShardResult(count, fragments, found, signatures)
+
+
+def _store_legs(path: str, type_names: List[str], start: int, stop: int) -> Iterable[Leg]:
+    """Legs of transaction store records start..stop-1, read straight from the file"""
+    dates = _DateCache()
+    with open(path, "rb") as file:
+        for chunk_start in range(start, stop, READ_CHUNK):
+            file.seek(chunk_start * RECORD_SIZE)
+            data = file.read((min(chunk_start + READ_CHUNK, stop) - chunk_start) * RECORD_SIZE)
+            for timestamp, amount, balance, code, cust_id, counterparty, txn_id, utr in RECORD_STRUCT.iter_unpack(data):
+                yield (cust_id.rstrip(b"\0").decode("ascii"),
+                       type_names[code - 1] if 0 < code <= len(type_names) else "",
+                       amount, balance,
+                       counterparty.rstrip(b"\0").decode("ascii"),
+                       txn_id.rstrip(b"\0").decode("ascii"),
+                       utr.rstrip(b"\0").decode("ascii"),
+                       dates.text(timestamp))
+
+
+def _sqlite_legs(path: str, start: int, stop: int) -> Iterable[Leg]:
+    """Legs of SQLite transactions with start <= seq < stop, read over a read-only connection"""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        yield from connection.execute(
+            "SELECT customer_id, type, amount_paise, balance_paise, recipient_id, transaction_id, utr, date "
+            "FROM transactions WHERE seq >= ? AND seq < ? ORDER BY seq", (start, stop))
+    finally:
+        connection.close()
+
+
+def _check_store_shard(path: str, type_names: List[str], start: int, stop: int, partitions: int) -> ShardResult:
+    return _check_legs(_store_legs(path, type_names, start, stop), partitions)
+
+
+def _check_sqlite_shard(path: str, start: int, stop: int, partitions: int) -> ShardResult:
+    return _check_legs(_sqlite_legs(path, start, stop), partitions)
+
+
+def _check_hot_shard(legs: List[Leg], partitions: int) -> ShardResult:
+    return _check_legs(legs, partitions)
+
+
+def _check_pairs(signatures: List[Signature]) -> Tuple[int, List[Dict]]:
+    """Match the out and in legs of one partition; returns (matched transfers, discrepancies)"""
+    by_id: Dict[str, Dict[str, List[Signature]]] = {}
+    for signature in signatures:
+        by_id.setdefault(signature[0], {"out": [], "in": []})[signature[1]].append(signature)
+    matched = 0
+    found: List[Dict] = []
+    for txn_id, legs in by_id.items():
+        outs, ins = legs["out"], legs["in"]
+        if len(outs) != 1 or len(ins) != 1:
+            legs_found = [{"direction": direction, "sender": sender, "recipient": recipient, "amount_paise": amount,
+                           "date": date} for _, direction, sender, recipient, amount, _, date in outs + ins]
+            check = "missing_counter_leg" if len(outs) + len(ins) == 1 else "duplicate_legs"
+            customer = outs[0][2] if outs else ins[0][3]
+            found.append(discrepancy(check, customer, txn_id, legs=legs_found))
+            continue
+        _, _, sender, recipient, amount, utr, date = outs[0]
+        _, _, in_sender, in_recipient, in_amount, in_utr, in_date = ins[0]
+        if (sender, recipient) != (in_sender, in_recipient):
+            found.append(discrepancy("counterparty_mismatch", sender, txn_id, out_leg=[sender, recipient],
+                                     in_leg=[in_sender, in_recipient]))
+        elif amount != in_amount:
+            found.append(discrepancy("amount_mismatch", sender, txn_id, out_amount_paise=amount,
+                                     in_amount_paise=in_amount))
+        elif utr != in_utr:
+            found.append(discrepancy("utr_mismatch", sender, txn_id, out_utr=utr, in_utr=in_utr))
+        elif date != in_date:
+            found.append(discrepancy("date_mismatch", sender, txn_id, out_date=date, in_date=in_date))
+        else:
+            matched += 1
+    return matched, found
+
+
+def _ranges(total: int, count: int) -> List[Tuple[int, int]]:
+    """Split 0..total into up to count contiguous, non-empty ranges"""
+    size = max(1, -(-total // count))
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def _session_history(ledger: Ledger, cust_id: str, hot: List) -> List:
+    """A customer's legs loaded or made since startup: those spilled from memory, then those still in it"""
+    if ledger.spill is None or not ledger.spill.count(cust_id):
+        return hot
+    return ledger.spill.history(cust_id, 0, ledger.spill.count(cust_id)) + hot
+
+
+def _hot_shards(ledger: Ledger) -> List[List[Leg]]:
+    """In-memory (and spilled) legs, grouped into shards of whole customers"""
+    shards: List[List[Leg]] = []
+    customers = list(ledger.customers.items())
+    for start in range(0, len(customers), HOT_SHARD_CUSTOMERS):
+        shard = [
+            (cust_id, trans.type, trans.amount_paise, trans.balance_paise, trans.recipient_id, trans.transaction_id,
+             trans.utr, trans.date)
+            for cust_id, info in customers[start:start + HOT_SHARD_CUSTOMERS]
+            for trans in _session_history(ledger, cust_id, info.transactions)
+        ]
+        if shard:
+            shards.append(shard)
+    return shards
+
+
+def reconcile(ledger: Ledger, workers: Optional[int] = None) -> Dict:
+    """Audit a loaded ledger and return the discrepancy report
+
+    Checks that each customer's running balances form an unbroken chain
+    ending at the current balance, that every transfer has exactly one
+    out leg and one in leg agreeing on parties, amount, UTR and date, and
+    that the bank's total balance equals the total before the first
+    recorded transfer.  Checkpointed history is split into record ranges
+    read by separate processes; each range's per-customer chain fragments
+    are stitched together afterwards, and legs are re-partitioned by
+    transaction ID for pairing.  No transfers may run during the audit.
+    """
+    workers = workers or os.cpu_count() or 1
+    partitions = workers * SHARDS_PER_WORKER
+    storage = ledger.storage
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        if isinstance(storage, JournalStorage):
+            store = storage.checkpointer.store
+            for start, stop in _ranges(storage.checkpointer.history_boundary, partitions):
+                futures.append(pool.submit(_check_store_shard, store.path, list(store.types.names), start, stop,
+                                           partitions))
+        elif isinstance(storage, SqliteStorage):
+            for start, stop in _ranges(storage.history_boundary, partitions):
+                # seq starts at 1
+                futures.append(pool.submit(_check_sqlite_shard, storage.path, start + 1, stop + 1, partitions))
+        # Hot shards come last: every customer's in-memory legs follow its checkpointed ones
+        for shard in _hot_shards(ledger):
+            futures.append(pool.submit(_check_hot_shard, shard, partitions))
+        shards = [future.result() for future in futures]
+
+        pairing = [[] for _ in range(partitions)]
+        for shard in shards:
+            for partition, signatures in enumerate(shard.partitions):
+                pairing[partition].extend(signatures)
+        pair_futures = [pool.submit(_check_pairs, signatures) for signatures in pairing if signatures]
+        pair_results = [future.result() for future in pair_futures]
+
+    found: List[Dict] = []
+    for shard in shards:
+        found.extend(shard.discrepancies)
+    opening_total, closing_total = _stitch_chains(ledger, shards, found)
+    sent = received = 0
+    for signatures in pairing:
+        for signature in signatures:
+            if signature[1] == "out":
+                sent += signature[4]
+            else:
+                received += signature[4]
+    for _, pair_found in pair_results:
+        found.extend(pair_found)
+    if sent != received:
+        found.append(discrepancy("money_not_conserved", sent_paise=sent, received_paise=received))
+    elif closing_total - opening_total != received - sent:
+        found.append(discrepancy("money_not_conserved", opening_paise=opening_total, closing_paise=closing_total))
+
+    checks: Dict[str, int] = {}
+    for entry in found:
+        checks[entry["check"]] = checks.get(entry["check"], 0) + 1
+    return {
+        "ok": not found,
+        "customers": len(ledger.customers),
+        "legs": sum(shard.legs for shard in shards),
+        "transfers": sum(matched for matched, _ in pair_results),
+        "totals": {"opening_paise": opening_total, "closing_paise": closing_total, "sent_paise": sent,
+                   "received_paise": received},
+        "checks": checks,
+        "discrepancies": found,
+    }
+
+
+def _stitch_chains(ledger: Ledger, shards: List[ShardResult], found: List[Dict]) -> Tuple[int, int]:
+    """Join each customer's fragments in shard order; returns the bank's (opening, closing) totals"""
+    opening_total = closing_total = 0
+    closing: Dict[str, int] = {}
+    for shard in shards:
+        for cust_id, fragment in shard.fragments.items():
+            previous = closing.get(cust_id)
+            if previous is None:
+                if cust_id not in ledger.customers:
+                    found.append(discrepancy("unknown_customer", cust_id, fragment.first_transaction_id,
+                                             date=fragment.first_date))
+                else:
+                    opening_total += fragment.opening
+            elif previous != fragment.opening:
+                found.append(discrepancy("balance_chain", cust_id, fragment.first_transaction_id,
+                                         date=fragment.first_date, expected_paise=previous,
+                                         actual_paise=fragment.opening))
+            closing[cust_id] = fragment.closing
+    for cust_id, info in ledger.customers.items():
+        balance = to_paise(info["balance"])
+        closing_total += balance
+        if cust_id not in closing:
+            # No recorded legs: the current balance is the opening balance
+            opening_total += balance
+        elif closing[cust_id] != balance:
+            found.append(discrepancy("closing_balance", cust_id, expected_paise=closing[cust_id],
+                                     actual_paise=balance))
+    return opening_total, closing_total
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (3, 4) or sys.argv[1] not in ("journal", "sqlite", "csv"):
+        print("Usage: python reconcile.py journal|sqlite|csv <journal directory, database or CSV file> [report.json]")
+        sys.exit(1)
+    mode, path = sys.argv[1], sys.argv[2]
+    storages = {"journal": JournalStorage, "sqlite": SqliteStorage, "csv": CsvStorage}
+    ledger = Ledger(mode, storage=storages[mode](path))
+    ledger.load()
+    try:
+        report = reconcile(ledger)
+    finally:
+        ledger.close()
+    output = json.dumps(report, indent=2)
+    if len(sys.argv) == 4:
+        with open(sys.argv[3], "w", encoding="utf-8") as file:
+            file.write(output)
+    else:
+        print(output)
+    print(f"{report['legs']} legs, {report['transfers']} transfers, {len(report['discrepancies'])} discrepancies",
+          file=sys.stderr)
+    sys.exit(0 if report["ok"] else 2)
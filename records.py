@@ -0,0 +1,168 @@
+"""Compact in-memory customer and transaction records"""
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from txstore import _DateCache, from_paise, to_paise
+
+# Keys of the dict-style view of a Transaction, in the order legs have always been written
+TRANSACTION_FIELDS = ("date", "type", "amount", "balance", "recipient_id", "transaction_id", "utr")
+
+# Keys of the dict-style view of a Customer
+CUSTOMER_FIELDS = ("name", "dob", "address", "area", "balance", "account_type", "transactions")
+
+# Epoch <-> DATE_FORMAT text conversions shared by every Transaction
+_dates = _DateCache(65536)
+
+
+def date_text(timestamp: int) -> str:
+    """DATE_FORMAT text of a Transaction timestamp"""
+    return _dates.text(timestamp)
+
+
+def date_timestamp(text: str) -> int:
+    """Transaction timestamp of DATE_FORMAT text (0 for an empty date)"""
+    return _dates.epoch(text)
+
+
+class _Record:
+    """Dict-style access to a __slots__ record
+
+    The ledger used to keep customers and legs as plain dicts, so records
+    still answer record["balance"], record.get(...), dict(record) and
+    iteration over their keys.  Amounts read that way are rupees, as before.
+    """
+
+    __slots__ = ()
+    FIELDS: Tuple[str, ...] = ()
+    __hash__ = None
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.FIELDS
+
+    def items(self) -> List[Tuple[str, object]]:
+        return [(key, self[key]) for key in self.FIELDS]
+
+    def values(self) -> List[object]:
+        return [self[key] for key in self.FIELDS]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.FIELDS)
+
+    def __contains__(self, key) -> bool:
+        return key in self.FIELDS
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (_Record, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+
+class Transaction(_Record):
+    """One leg of a transfer: epoch-second timestamp, amounts in paise, interned strings
+
+    Both legs of a transfer share their transaction ID and UTR objects;
+    type and recipient strings are interned, so each leg costs one small
+    object plus its integers.
+    """
+
+    __slots__ = ("timestamp", "type", "amount_paise", "balance_paise", "recipient_id", "transaction_id", "utr")
+    FIELDS = TRANSACTION_FIELDS
+
+    def __init__(self, timestamp: int, trans_type: str, amount_paise: int, balance_paise: int,
+                 recipient_id: str = "", transaction_id: str = "", utr: str = ""):
+        self.timestamp = timestamp
+        self.type = sys.intern(trans_type)
+        self.amount_paise = amount_paise
+        self.balance_paise = balance_paise
+        self.recipient_id = sys.intern(recipient_id)
+        self.transaction_id = transaction_id
+        self.utr = utr
+
+    @classmethod
+    def from_dict(cls, leg: Dict) -> "Transaction":
+        """Convert a leg in the old dict form (as journaled) to a Transaction"""
+        return cls(date_timestamp(leg["date"]), leg["type"], to_paise(leg["amount"]), to_paise(leg["balance"]),
+                   leg.get("recipient_id", ""), leg.get("transaction_id", ""), leg.get("utr", ""))
+
+    @property
+    def date(self) -> str:
+        return _dates.text(self.timestamp)
+
+    def __getitem__(self, key: str):
+        if key == "date":
+            return _dates.text(self.timestamp)
+        if key == "amount":
+            return from_paise(self.amount_paise)
+        if key == "balance":
+            return from_paise(self.balance_paise)
+        if key in ("type", "recipient_id", "transaction_id", "utr"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        if key == "date":
+            self.timestamp = date_timestamp(value)
+        elif key == "amount":
+            self.amount_paise = to_paise(value)
+        elif key == "balance":
+            self.balance_paise = to_paise(value)
+        elif key in ("type", "recipient_id"):
+            setattr(self, key, sys.intern(value))
+        elif key in ("transaction_id", "utr"):
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+
+class Customer(_Record):
+    """A customer's details, balance in paise and in-memory ("hot") history"""
+
+    __slots__ = ("name", "dob", "address", "area", "balance_paise", "account_type", "transactions")
+    FIELDS = CUSTOMER_FIELDS
+
+    def __init__(self, name: str, dob: str, address: str, area: str, balance_paise: int, account_type: str,
+                 transactions: Optional[List[Transaction]] = None):
+        self.name = name
+        self.dob = dob
+        self.address = address
+        self.area = sys.intern(area)
+        self.balance_paise = balance_paise
+        self.account_type = sys.intern(account_type)
+        self.transactions: List[Transaction] = [] if transactions is None else transactions
+
+    @classmethod
+    def from_dict(cls, info: Dict) -> "Customer":
+        """Convert a customer in the old dict form, including its history, to a Customer"""
+        return cls(info["name"], info["dob"], info["address"], info["area"], to_paise(info["balance"]),
+                   info["account_type"],
+                   [trans if isinstance(trans, Transaction) else Transaction.from_dict(trans)
+                    for trans in info.get("transactions", [])])
+
+    def __getitem__(self, key: str):
+        if key == "balance":
+            return from_paise(self.balance_paise)
+        if key in CUSTOMER_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        if key == "balance":
+            self.balance_paise = to_paise(value)
+        elif key in ("area", "account_type"):
+            setattr(self, key, sys.intern(value))
+        elif key in CUSTOMER_FIELDS:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
@@ -0,0 +1,96 @@
+"""Customer registry: normalized-name index, customer ID allocation and detail fingerprints"""
+import hashlib
+from typing import Dict, Optional, Tuple
+
+CUSTOMER_ID_PREFIX = "CUST"
+
+# Customer fields covered by the verification fingerprint
+FINGERPRINT_FIELDS = ("name", "dob", "address", "area")
+
+
+def normalize_name(name: str) -> str:
+    """Case- and whitespace-insensitive form of a customer name"""
+    return " ".join(name.split()).casefold()
+
+
+def details_fingerprint(details: Dict) -> bytes:
+    """Digest of a customer's normalized identifying details (KeyError if a field is missing)"""
+    text = "\x1f".join(normalize_name(str(details[field])) for field in FINGERPRINT_FIELDS)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def customer_number(cust_id: str) -> int:
+    """Numeric part of a CUSTnnn ID (0 for IDs in any other format)"""
+    digits = cust_id[len(CUSTOMER_ID_PREFIX):]
+    if cust_id.startswith(CUSTOMER_ID_PREFIX) and digits.isdigit():
+        return int(digits)
+    return 0
+
+
+class CustomerRegistry:
+    """Index of registered names and the allocator for new customer IDs
+
+    IDs are handed out as CUST001, CUST002, ... strictly above the highest
+    one ever registered, whatever the number of customers.  Every
+    registration is journaled with its ID, so rebuild() restores the
+    allocator along with the name index after a restart.  Callers
+    serialize access (the ledger holds its registry lock), except for
+    fingerprint(), which only ever caches the value for the details it read.
+    """
+
+    def __init__(self):
+        self._names: Dict[str, str] = {}
+        self._next_number = 1
+        # Customer ID -> (details the fingerprint was computed from, fingerprint)
+        self._fingerprints: Dict[str, Tuple[Tuple, bytes]] = {}
+
+    def rebuild(self, customers: Dict[str, Dict]):
+        """Index every customer and move the allocator past the highest ID"""
+        self._names = {}
+        self._fingerprints = {}
+        highest = 0
+        for cust_id, info in customers.items():
+            self._names.setdefault(normalize_name(info["name"]), cust_id)
+            highest = max(highest, customer_number(cust_id))
+        self._next_number = highest + 1
+
+    def find(self, name: str) -> Optional[str]:
+        """ID of the customer registered under name, if any"""
+        return self._names.get(normalize_name(name))
+
+    def add(self, cust_id: str, name: str):
+        """Index a customer whose ID was chosen elsewhere (e.g. imported)"""
+        self._names[normalize_name(name)] = cust_id
+        self.invalidate(cust_id)
+        self._next_number = max(self._next_number, customer_number(cust_id) + 1)
+
+    def claim(self, name: str) -> Optional[str]:
+        """Allocate the next customer ID to name, or return None if the name is taken"""
+        key = normalize_name(name)
+        if key in self._names:
+            return None
+        cust_id = f"{CUSTOMER_ID_PREFIX}{self._next_number:03d}"
+        self._next_number += 1
+        self._names[key] = cust_id
+        return cust_id
+
+    def release(self, name: str):
+        """Forget a name claimed for a registration that then failed (its ID is not handed out again)"""
+        self._names.pop(normalize_name(name), None)
+
+    def fingerprint(self, cust_id: str, info: Dict) -> bytes:
+        """Fingerprint of a customer's details, cached until any of them changes
+
+        The cache entry keeps the details it was computed from, so an update
+        made any way (info["address"] = ..., an import, a reload) is noticed
+        by comparing them rather than by hashing again.
+        """
+        details = tuple(info[field] for field in FINGERPRINT_FIELDS)
+        cached = self._fingerprints.get(cust_id)
+        if cached is None or cached[0] != details:
+            cached = self._fingerprints[cust_id] = (details, details_fingerprint(info))
+        return cached[1]
+
+    def invalidate(self, cust_id: str):
+        """Drop a customer's cached fingerprint after its details change"""
+        self._fingerprints.pop(cust_id, None)
@@ -0,0 +1,377 @@
+"""asyncio HTTP/JSON front end to the ledger for other systems
+
+Endpoints (request and response bodies are JSON):
+
+    POST /customers                      register (name, account_type, dob, address, area, balance)
+    POST /transfers                      transfer (sender_id, recipient_id, amount, type,
+                                         optional idempotency_key, sender_details and
+                                         recipient_details)
+    POST /transfers/batch                {"transfers": [...]}, applied in order as one commit
+    GET  /customers/<id>/balance
+    GET  /customers/<id>/history         ?offset=0&limit=50&order=newest|oldest&start=YYYY-MM-DD&end=YYYY-MM-DD
+    GET  /metrics                        Prometheus text, when the ledger is instrumented
+
+Ledger calls that can block (locks, disk, fsync) run on a thread pool.
+They reach it through a bounded queue: when the queue stays full for
+QUEUE_TIMEOUT seconds, the request is answered 503 with Retry-After.
+Clients that wait for their reply before sending the next request are
+slowed down at the same rate.  Successful writes are answered once they
+are durable, even with asynchronous commits.
+"""
+import asyncio
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from ledger import ERR_INVALID_AMOUNT, ERR_UNKNOWN_CUSTOMER, ERROR_MESSAGES, Ledger, RegisterResult, TransferResult
+
+# Largest request body accepted
+MAX_BODY_BYTES = 1 << 20
+
+# Largest batch accepted by POST /transfers/batch
+MAX_BATCH = 10000
+
+# Largest history page
+MAX_PAGE = 1000
+
+# Requests waiting for a ledger thread, and how long a request waits for room before a 503
+QUEUE_SIZE = 1024
+QUEUE_TIMEOUT = 1.0
+
+# Threads running blocking ledger calls
+WORKERS = 16
+
+
+class HttpError(Exception):
+    """An error answered with a status code and a JSON body"""
+
+    def __init__(self, status: int, error: str, message: str = ""):
+        super().__init__(message or error)
+        self.status = status
+        self.error = error
+        self.message = message or error
+
+
+def transfer_json(result: TransferResult) -> Dict:
+    """JSON body of a transfer result"""
+    return {
+        "ok": result.ok,
+        "error": result.error,
+        "message": result.message,
+        "sender_id": result.sender_id,
+        "recipient_id": result.recipient_id,
+        "amount": result.amount,
+        "type": result.trans_type,
+        "date": result.date,
+        "transaction_id": result.transaction_id,
+        "utr": result.utr,
+        "sender_balance": result.sender_balance,
+        "recipient_balance": result.recipient_balance,
+    }
+
+
+def register_json(result: RegisterResult) -> Dict:
+    """JSON body of a registration result"""
+    return {"ok": result.ok, "error": result.error, "message": result.message, "customer_id": result.customer_id}
+
+
+def check_amount(amount):
+    """Raise a 400 unless amount is absent (the ledger reports it missing), a finite number or numeric text"""
+    if amount is None or amount == "":
+        return
+    if isinstance(amount, bool) or not isinstance(amount, (str, int, float)):
+        value = math.nan
+    else:
+        try:
+            value = float(amount)
+        except (ValueError, OverflowError):
+            value = math.nan
+    if not math.isfinite(value):
+        raise HttpError(400, ERR_INVALID_AMOUNT, ERROR_MESSAGES[ERR_INVALID_AMOUNT])
+
+
+def transfer_request(body: Dict) -> Tuple:
+    """Ledger transfer request from a JSON object"""
+    if not isinstance(body, dict):
+        raise HttpError(400, "invalid_request", "Each transfer must be a JSON object")
+    check_amount(body.get("amount"))
+    for field in ("sender_details", "recipient_details"):
+        if body.get(field) is not None and not isinstance(body[field], dict):
+            raise HttpError(400, "invalid_request", f"{field} must be a JSON object")
+    return (str(body.get("sender_id") or "").strip().upper(), str(body.get("recipient_id") or "").strip().upper(),
+            body.get("amount"), str(body.get("type") or "").strip(), body.get("idempotency_key"),
+            body.get("sender_details"), body.get("recipient_details"))
+
+
+class BankServer:
+    """Serves the ledger over HTTP/1.1 with keep-alive connections"""
+
+    def __init__(self, ledger: Ledger, host: str = "127.0.0.1", port: int = 8080, workers: int = WORKERS,
+                 queue_size: int = QUEUE_SIZE, queue_timeout: float = QUEUE_TIMEOUT):
+        self.ledger = ledger
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ledger")
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: List[asyncio.Task] = []
+        # Requests answered 503 because the queue stayed full
+        self.rejected = 0
+
+    async def start(self):
+        """Listen and start the workers (port 0 picks a free port, stored in self.port)"""
+        self._queue = asyncio.Queue(self._queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._server = await asyncio.start_server(self._connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Serving the ledger on http://{self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        """Stop accepting connections and finish queued work"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._queue is not None:
+            await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        self._executor.shutdown(wait=True)
+
+    # ----- ledger calls -----
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            call, future = await self._queue.get()
+            try:
+                result = await loop.run_in_executor(self._executor, call)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    async def _submit(self, call: Callable):
+        """Run a blocking ledger call through the bounded queue"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self._queue.put((call, future)), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HttpError(503, "overloaded", "Too many requests in flight; retry shortly")
+        return await future
+
+    @staticmethod
+    async def _durable(commit):
+        """Wait until an asynchronous commit is on disk"""
+        if commit is not None:
+            await asyncio.wrap_future(commit)
+
+    # ----- endpoints -----
+
+    async def register(self, body: Dict) -> Tuple[int, Dict]:
+        if not isinstance(body, dict):
+            raise HttpError(400, "invalid_request", "Expected a JSON object")
+        request = tuple(body.get(field) for field in ("name", "account_type", "dob", "address", "area", "balance"))
+        result = await self._submit(lambda: self.ledger.register_many([request])[0])
+        await self._durable(result.commit)
+        return (201 if result.ok else 400), register_json(result)
+
+    async def transfer(self, body: Dict) -> Tuple[int, Dict]:
+        request = transfer_request(body)
+        result = await self._submit(lambda: self.ledger.transfer(*request))
+        await self._durable(result.commit)
+        return (200 if result.ok else 400), transfer_json(result)
+
+    async def transfer_batch(self, body: Dict) -> Tuple[int, Dict]:
+        transfers = body.get("transfers") if isinstance(body, dict) else None
+        if not isinstance(transfers, list):
+            raise HttpError(400, "invalid_request", 'Expected {"transfers": [...]}')
+        if len(transfers) > MAX_BATCH:
+            raise HttpError(413, "batch_too_large", f"At most {MAX_BATCH} transfers per batch")
+        requests = [transfer_request(transfer) for transfer in transfers]
+        results = await self._submit(lambda: self.ledger.transfer_many(requests))
+        for commit in {id(result.commit): result.commit for result in results}.values():
+            await self._durable(commit)
+        return 200, {"results": [transfer_json(result) for result in results],
+                     "applied": sum(result.ok for result in results)}
+
+    def _customer(self, cust_id: str):
+        customer = self.ledger.customers.get(cust_id)
+        if customer is None:
+            raise HttpError(404, ERR_UNKNOWN_CUSTOMER, ERROR_MESSAGES[ERR_UNKNOWN_CUSTOMER])
+        return customer
+
+    async def balance(self, cust_id: str) -> Tuple[int, Dict]:
+        customer = self._customer(cust_id)
+        return 200, {"customer_id": cust_id, "name": customer["name"], "account_type": customer["account_type"],
+                     "balance": customer["balance"]}
+
+    async def history(self, cust_id: str, query: Dict[str, List[str]]) -> Tuple[int, Dict]:
+        self._customer(cust_id)
+        try:
+            offset = int(query.get("offset", ["0"])[0])
+            limit = min(int(query.get("limit", ["50"])[0]), MAX_PAGE)
+        except ValueError:
+            raise HttpError(400, "invalid_request", "offset and limit must be integers")
+        if offset < 0 or limit < 0:
+            raise HttpError(400, "invalid_request", "offset and limit must not be negative")
+        newest_first = query.get("order", ["newest"])[0] != "oldest"
+        start = query.get("start", [None])[0]
+        end = query.get("end", [None])[0]
+
+        def page():
+            total = self.ledger.history_count(cust_id, start, end)
+            return total, self.ledger.history(cust_id, offset, limit, newest_first, start, end)
+
+        try:
+            total, legs = await self._submit(page)
+        except ValueError as e:
+            raise HttpError(400, "invalid_date", str(e))
+        return 200, {"customer_id": cust_id, "total": total, "offset": offset,
+                     "transactions": [dict(leg) for leg in legs]}
+
+    async def _dispatch(self, method: str, path: str, query: Dict[str, List[str]], body: bytes):
+        """Route a request; returns (status, JSON payload) or (status, text) for /metrics"""
+        parts = [part for part in path.split("/") if part]
+        if method == "GET" and parts == ["metrics"] and self.ledger.metrics is not None:
+            return 200, self.ledger.metrics.registry.prometheus_text()
+        if method == "GET" and len(parts) == 3 and parts[0] == "customers":
+            cust_id = parts[1].upper()
+            if parts[2] == "balance":
+                return await self.balance(cust_id)
+            if parts[2] == "history":
+                return await self.history(cust_id, query)
+        if method == "POST" and parts in (["customers"], ["transfers"], ["transfers", "batch"]):
+            try:
+                payload = json.loads(body or b"null")
+            except ValueError:
+                raise HttpError(400, "invalid_json", "Request body is not valid JSON")
+            if parts == ["customers"]:
+                return await self.register(payload)
+            if parts == ["transfers"]:
+                return await self.transfer(payload)
+            return await self.transfer_batch(payload)
+        raise HttpError(404, "not_found", f"No endpoint for {method} {path}")
+
+    # ----- HTTP -----
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HttpError as e:
+                    writer.write(self._response(e.status, {"error": e.error, "message": e.message}, False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                url = urlsplit(target)
+                retry_after = False
+                try:
+                    status, payload = await self._dispatch(method, url.path, parse_qs(url.query), body)
+                except HttpError as e:
+                    status, payload = e.status, {"error": e.error, "message": e.message}
+                    retry_after = e.status == 503
+                except Exception as e:
+                    status, payload = 500, {"error": "internal_error", "message": str(e)}
+                writer.write(self._response(status, payload, keep_alive, retry_after))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        """(method, target, headers, body) of the next request, or None when the client hung up"""
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split()
+        except ValueError:
+            raise HttpError(400, "bad_request", "Malformed request line")
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise HttpError(400, "bad_request", "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, "body_too_large", f"Request bodies are limited to {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    @staticmethod
+    def _response(status: int, payload, keep_alive: bool, retry_after: bool = False) -> bytes:
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if retry_after:
+            head.append("Retry-After: 1")
+        return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+
+
+def main():
+    import argparse
+    import os
+
+    from journal import FsyncPolicy
+    from metrics import LedgerMetrics
+
+    parser = argparse.ArgumentParser(description="Serve the ledger over HTTP/JSON")
+    parser.add_argument("--mode", default="journal", choices=["journal", "sqlite", "csv"])
+    parser.add_argument("--data-dir", default=".", help="holds bank_journal/, bank.sqlite3 or bank_transactions.csv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--fsync-every", type=int, default=1, help="fsync the journal every N commits")
+    parser.add_argument("--async-commit", action="store_true", help="group-commit journal writes")
+    parser.add_argument("--metrics", action="store_true", help="instrument the ledger and serve GET /metrics")
+    args = parser.parse_args()
+
+    ledger = Ledger(args.mode, os.path.join(args.data_dir, "bank_journal"),
+                    os.path.join(args.data_dir, "bank_transactions.csv"), FsyncPolicy.every(args.fsync_every),
+                    async_commit=args.async_commit, sqlite_path=os.path.join(args.data_dir, "bank.sqlite3"),
+                    metrics=LedgerMetrics() if args.metrics else None)
+    ledger.load()
+    server = BankServer(ledger, args.host, args.port, args.workers, args.queue_size)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ledger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,634 @@
+"""Sharded ledger: customers partitioned by ID across worker processes, with two-phase cross-shard transfers
+
+Each shard is a journal-mode Ledger in its own process and directory,
+owning the customers whose ID hashes to it, so shards apply transfers on
+separate cores.  ShardedLedger routes every request to the owning shard.
+A transfer whose accounts live on different shards runs in two phases:
+
+1. reserve: the sender's shard validates the transfer and holds the
+   amount, while the recipient's shard confirms the account exists;
+2. settle: the router appends the decision to its own fsynced decision
+   log, then each shard journals its leg (Ledger.settle_many()).
+
+A transfer is committed exactly when its decision is logged.  If a shard
+dies before that, its holds die with it and the transfer is rejected; if
+it dies after, the router restarts it and re-drives the logged
+settlements, which are idempotent by transaction ID, before the shard
+serves anything else.  Either way no money is created or lost.
+Decisions left unsettled when the router itself stops are re-driven by
+the next start().
+"""
+import multiprocessing
+import os
+import signal
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from idgen import SnowflakeGenerator
+from journal import FsyncPolicy, Journal
+from limits import VelocityLimits
+from ledger import (DEFAULT_CUSTOMERS, ERR_SHARD_UNAVAILABLE, ERR_UNKNOWN_RECIPIENT, REGISTRATION_FIELDS, Ledger,
+                    RegisterResult, RegistrationRequest, Settlement, TransferRequest, TransferResult,
+                    registration_error, unpack_request)
+from registry import CustomerRegistry
+from txstore import to_paise
+
+# Subdirectories of a sharded ledger: one per shard, plus the router's decision log
+SHARD_DIR_PREFIX = "shard-"
+DECISION_DIR = "decisions"
+
+# Roll (and drop) the decision log once it is this large and nothing is left unsettled
+DECISION_LOG_ROLL_BYTES = 64 * 1024 * 1024
+
+# Seconds close() waits for a worker to exit before terminating it
+SHUTDOWN_TIMEOUT = 10
+
+# Read-only Ledger methods the router forwards to a shard
+QUERY_METHODS = {"balance", "history", "history_count", "statement", "find_transaction", "find_utr"}
+
+
+def shard_of(cust_id: str, shards: int) -> int:
+    """Shard owning a customer ID (a stable hash: unlike hash(), the same in every process)"""
+    return zlib.crc32(cust_id.encode("utf-8")) % shards
+
+
+class ShardUnavailable(Exception):
+    """A worker died (or could not be reached) during a request"""
+
+    def __init__(self, index: int):
+        super().__init__(f"Shard {index} is unavailable")
+        self.index = index
+
+
+# ----- worker process -----
+
+def _prepare(ledger: Ledger, transfers: List[TransferRequest], reserves: List[TransferRequest],
+             probes: List[Tuple[str, Optional[Dict]]]) -> Tuple[List[TransferResult], List[Tuple[TransferResult, bool]],
+                                                            List[Optional[str]]]:
+    """Phase one on a shard: same-shard transfers, reservations (with whether they hold funds) and recipient checks
+
+    Each probe is (recipient ID, recipient details or None) and gets an
+    error code, or None if the recipient exists (and its details match).
+    """
+    results = ledger.transfer_many(transfers) if transfers else []
+    reserved = []
+    try:
+        for request in reserves:
+            result = ledger.reserve(*request)
+            reserved.append((result, result.ok and result.transaction_id in ledger.holds))
+    except BaseException:
+        # The router never learns of these holds, so it could not release them
+        for (result, held), request in zip(reserved, reserves):
+            if held:
+                ledger.release(result.transaction_id, unpack_request(request)[4])
+        raise
+    checks = []
+    for cust_id, details in probes:
+        if cust_id not in ledger.customers:
+            checks.append(ERR_UNKNOWN_RECIPIENT)
+        else:
+            checks.append(ledger.verify_customer_details(cust_id, details) if details is not None else None)
+    return results, reserved, checks
+
+
+def _settle(ledger: Ledger, settlements: List[Settlement],
+            releases: List[Tuple[str, Optional[str]]]) -> List[TransferResult]:
+    """Phase two on a shard: release aborted holds and journal this shard's legs of committed transfers"""
+    for transaction_id, idempotency_key in releases:
+        ledger.release(transaction_id, idempotency_key)
+    return ledger.settle_many(settlements)
+
+
+def _register(ledger: Ledger, requests: List[RegistrationRequest], cust_ids: List[str]) -> List[RegisterResult]:
+    return ledger.register_many(requests, cust_ids=cust_ids)
+
+
+def _names(ledger: Ledger) -> Dict[str, Dict]:
+    return {cust_id: {"name": info["name"]} for cust_id, info in ledger.customers.items()}
+
+
+def _totals(ledger: Ledger) -> Tuple[int, int, int]:
+    """(customers, sum of balances in paise, sum of holds in paise)"""
+    return (len(ledger.customers), sum(info.balance_paise for info in ledger.customers.values()),
+            sum(hold.amount_paise for hold in ledger.holds.values()))
+
+
+def _query(ledger: Ledger, method: str, args: tuple):
+    if method not in QUERY_METHODS:
+        raise ValueError(f"Not a ledger query: {method}")
+    return getattr(ledger, method)(*args)
+
+
+# Requests a worker answers: name -> handler(ledger, *args)
+_HANDLERS = {
+    "prepare": _prepare,
+    "settle": _settle,
+    "register": _register,
+    "names": _names,
+    "totals": _totals,
+    "query": _query,
+}
+
+
+def _run_shard(connection, index: int, directory: str, fsync_policy: Optional[FsyncPolicy],
+               checkpoint_every: int, customers: Dict[str, Dict], velocity_limits: Optional[VelocityLimits]):
+    """Worker process: own one shard's Ledger and answer the router until it closes the connection
+
+    Requests are handled one at a time, so the shard's ledger sees a single
+    thread.  Exceptions are sent back for the router to raise.
+    """
+    # Ctrl+C reaches the whole process group; let the router stop the shard cleanly instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ledger = Ledger("journal", os.path.join(directory, "journal"), os.path.join(directory, "bank.csv"),
+                    fsync_policy, checkpoint_every, customers=customers, id_generator=SnowflakeGenerator(index),
+                    velocity_limits=velocity_limits)
+    ledger.load()
+    try:
+        while True:
+            try:
+                op, args = connection.recv()
+            except EOFError:
+                break
+            if op == "close":
+                break
+            try:
+                reply = _HANDLERS[op](ledger, *args)
+            except Exception as error:
+                reply = error
+            connection.send(reply)
+    finally:
+        ledger.close()
+        connection.close()
+
+
+# ----- router -----
+
+class ShardedLedger:
+    """Routes registrations, transfers and queries to shard worker processes
+
+    The router allocates customer IDs bank-wide (names are unique across
+    shards) and places each customer on shard_of(ID).  Calls are
+    thread-safe; each shard answers one request at a time, so throughput
+    comes from batching (transfer_many()) and from spreading work over
+    shards, which run in parallel.  Workers are spawned, so a script that
+    starts one must do so under if __name__ == "__main__".
+    """
+
+    def __init__(self, directory: str = "bank_shards", shards: int = 4, fsync_policy: Optional[FsyncPolicy] = None,
+                 checkpoint_every: int = 10000, customers: Optional[Dict[str, Dict]] = None,
+                 velocity_limits: Optional[VelocityLimits] = None):
+        if shards < 1:
+            raise ValueError("A sharded ledger needs at least one shard")
+        self.directory = directory
+        self.shards = shards
+        self.fsync_policy = fsync_policy
+        self.checkpoint_every = checkpoint_every
+        self.customers = DEFAULT_CUSTOMERS if customers is None else customers
+        # Each shard enforces these on the senders it owns, reservations included
+        self.velocity_limits = velocity_limits
+        self.registry = CustomerRegistry()
+        self._registry_lock = threading.Lock()
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: List[Optional[Tuple[multiprocessing.Process, object]]] = [None] * shards
+        self._locks = [threading.Lock() for _ in range(shards)]
+        # Bumped whenever a worker is replaced: holds taken before then are gone
+        self._generations = [0] * shards
+        self._decisions: Optional[Journal] = None
+        self._decision_lock = threading.Lock()
+        # Logged decisions not yet confirmed by both shards: transaction ID -> (debit, credit)
+        self._unsettled: Dict[str, Tuple[Settlement, Settlement]] = {}
+        # Number of workers replaced after dying
+        self.restarts = 0
+
+    def shard_of(self, cust_id: str) -> int:
+        return shard_of(cust_id, self.shards)
+
+    # ----- lifecycle -----
+
+    def start(self) -> "ShardedLedger":
+        """Start the workers, settle anything the last run left undecided and index customer names"""
+        os.makedirs(self.directory, exist_ok=True)
+        for index in range(self.shards):
+            self._spawn(index)
+        self._decisions = Journal(os.path.join(self.directory, DECISION_DIR), FsyncPolicy.always())
+        self._recover()
+        names: Dict[str, Dict] = {}
+        for reply in self._scatter({index: ("names", ()) for index in range(self.shards)}).values():
+            names.update(self._raise(reply))
+        with self._registry_lock:
+            self.registry.rebuild(names)
+        return self
+
+    def close(self):
+        """Stop the workers (each flushes and closes its ledger) and close the decision log"""
+        for index in range(self.shards):
+            with self._locks[index]:
+                if self._workers[index] is None:
+                    continue
+                process, connection = self._workers[index]
+                try:
+                    connection.send(("close", ()))
+                except OSError:
+                    pass
+                process.join(SHUTDOWN_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+                connection.close()
+                self._workers[index] = None
+        if self._decisions is not None:
+            self._decisions.close()
+            self._decisions = None
+
+    def __enter__(self) -> "ShardedLedger":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _spawn(self, index: int):
+        directory = os.path.join(self.directory, f"{SHARD_DIR_PREFIX}{index}")
+        customers = {cust_id: info for cust_id, info in self.customers.items() if self.shard_of(cust_id) == index}
+        connection, child = self._context.Pipe()
+        process = self._context.Process(target=_run_shard, name=f"ledger-shard-{index}", daemon=True,
+                                        args=(child, index, directory, self.fsync_policy, self.checkpoint_every,
+                                              customers, self.velocity_limits))
+        process.start()
+        child.close()
+        self._workers[index] = (process, connection)
+
+    def _recover(self):
+        """Re-drive every settlement the decision log holds without a matching "settled" record, then drop the log"""
+        for record in self._decisions.replay():
+            if record.get("op") == "settle":
+                for fields in record["transfers"]:
+                    debit = Settlement(*fields[:6], True, fields[6])
+                    self._unsettled[debit.transaction_id] = (debit, debit._replace(debit=False, idempotency_key=None))
+            elif record.get("op") == "settled":
+                for transaction_id in record["transfers"]:
+                    self._unsettled.pop(transaction_id, None)
+        if self._unsettled:
+            print(f"Settling {len(self._unsettled)} cross-shard transfers left by the last run")
+            by_shard: Dict[int, List[Settlement]] = {}
+            for pair in self._unsettled.values():
+                for settlement in pair:
+                    by_shard.setdefault(self._side_shard(settlement), []).append(settlement)
+            for reply in self._scatter({index: ("settle", (settlements, []))
+                                        for index, settlements in by_shard.items()}).values():
+                # A shard that died here was restarted and re-driven already
+                if not isinstance(reply, ShardUnavailable):
+                    self._raise(reply)
+            self._unsettled.clear()
+        self._drop_decisions()
+
+    def _drop_decisions(self):
+        """Start a fresh decision log segment and delete the old ones (nothing in them is unsettled)"""
+        self._decisions.roll()
+        for segment in self._decisions.sealed_segments():
+            os.remove(self._decisions.segment_path(segment))
+
+    # ----- talking to workers -----
+
+    @staticmethod
+    def _raise(reply):
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def _exchange(self, index: int, op: str, args: tuple):
+        """One request/reply with a worker (the caller holds its lock)"""
+        if self._workers[index] is None:
+            raise ShardUnavailable(index)
+        _, connection = self._workers[index]
+        try:
+            connection.send((op, args))
+            return connection.recv()
+        except (EOFError, OSError) as error:
+            raise ShardUnavailable(index) from error
+
+    def _scatter(self, requests: Dict[int, Tuple[str, tuple]]) -> Dict[int, object]:
+        """Send one request to each of several shards, then collect the replies
+
+        The shards work on their requests in parallel.  A shard whose worker
+        died is replaced before its lock is released, and its reply is a
+        ShardUnavailable.  Locks are taken in shard order, so concurrent
+        callers cannot deadlock.
+        """
+        indexes = sorted(requests)
+        for index in indexes:
+            self._locks[index].acquire()
+        try:
+            replies: Dict[int, object] = {}
+            for index in indexes:
+                try:
+                    if self._workers[index] is None:
+                        raise ShardUnavailable(index)
+                    self._workers[index][1].send(requests[index])
+                except (OSError, ShardUnavailable):
+                    replies[index] = ShardUnavailable(index)
+            for index in indexes:
+                if index in replies:
+                    continue
+                try:
+                    replies[index] = self._workers[index][1].recv()
+                except (EOFError, OSError):
+                    replies[index] = ShardUnavailable(index)
+            for index, reply in replies.items():
+                if isinstance(reply, ShardUnavailable):
+                    self._revive(index)
+            return replies
+        finally:
+            for index in reversed(indexes):
+                self._locks[index].release()
+
+    def _call(self, index: int, op: str, *args):
+        """One request to one shard; raises ShardUnavailable (after replacing the worker) if it died"""
+        reply = self._scatter({index: (op, args)})[index]
+        return self._raise(reply)
+
+    def _revive(self, index: int):
+        """Replace a dead worker and re-drive the logged settlements it may have missed (the caller holds its lock)
+
+        The new worker reloads the shard from its journal, so holds taken by
+        the old one are gone; bumping the generation first keeps a transfer
+        reserved on the old worker from being decided afterwards.
+        """
+        if self._workers[index] is not None:
+            process, connection = self._workers[index]
+            connection.close()
+            if process.is_alive():
+                process.kill()
+            process.join()
+            self._workers[index] = None
+        with self._decision_lock:
+            self._generations[index] += 1
+            pending = [settlement for pair in self._unsettled.values() for settlement in pair
+                       if self._side_shard(settlement) == index]
+        print(f"Restarting ledger shard {index}")
+        self._spawn(index)
+        self.restarts += 1
+        if pending:
+            self._raise(self._exchange(index, "settle", (pending, [])))
+
+    def _side_shard(self, settlement: Settlement) -> int:
+        return self.shard_of(settlement.sender_id if settlement.debit else settlement.recipient_id)
+
+    # ----- registration -----
+
+    def register_customer(self, name: str, account_type: str, dob: str, address: str,
+                          area: str, balance) -> RegisterResult:
+        """Register a new customer on its shard"""
+        return self.register_many([(name, account_type, dob, address, area, balance)])[0]
+
+    def register_many(self, requests: Iterable[RegistrationRequest]) -> List[RegisterResult]:
+        """Register customers in bulk, returning a result per request in order
+
+        Requests are validated and IDs and name uniqueness settled here,
+        bank-wide, so only valid requests claim a name; each shard then
+        commits its own customers as one commit.
+        """
+        requests = [tuple(request.get(field) for field in REGISTRATION_FIELDS) if isinstance(request, dict)
+                    else tuple(request) for request in requests]
+        results: List[Optional[RegisterResult]] = [None] * len(requests)
+        with self._registry_lock:
+            by_shard: Dict[int, List[Tuple[int, str]]] = {}
+            for position, request in enumerate(requests):
+                error, _ = registration_error(request, self.registry)
+                if error is not None:
+                    results[position] = RegisterResult(error)
+                    continue
+                cust_id = self.registry.claim(str(request[0]))
+                by_shard.setdefault(self.shard_of(cust_id), []).append((position, cust_id))
+            replies = self._scatter({index: ("register", ([requests[position] for position, _ in placed],
+                                                          [cust_id for _, cust_id in placed]))
+                                     for index, placed in by_shard.items()})
+            for index, placed in by_shard.items():
+                reply = replies[index]
+                if isinstance(reply, ShardUnavailable):
+                    # The registration may have reached the journal; keep its name taken
+                    for position, _ in placed:
+                        results[position] = RegisterResult(ERR_SHARD_UNAVAILABLE)
+                    continue
+                for (position, _), result in zip(placed, self._raise(reply)):
+                    if not result.ok:
+                        self.registry.release(str(requests[position][0] or ""))
+                    results[position] = result
+        return results
+
+    # ----- transfers -----
+
+    def transfer(self, sender_id: str, recipient_id: str, amount, trans_type: str,
+                 idempotency_key: Optional[str] = None, sender_details: Optional[Dict] = None,
+                 recipient_details: Optional[Dict] = None) -> TransferResult:
+        """Validate, apply and persist a single transfer (see transfer_many())"""
+        return self.transfer_many([(sender_id, recipient_id, amount, trans_type, idempotency_key,
+                                    sender_details, recipient_details)])[0]
+
+    def transfer_many(self, requests: Iterable[TransferRequest]) -> List[TransferResult]:
+        """Apply a batch of transfers, returning a result per request in order
+
+        Each shard applies its same-shard transfers as one commit and then
+        reserves the cross-shard ones it sends, all in one round trip; one
+        decision-log append and one settle round trip per shard finish the
+        cross-shard ones.  So unlike Ledger.transfer_many() the batch is not
+        a single commit, and a cross-shard transfer is validated against the
+        balances left by every same-shard transfer in the batch.  A request
+        whose shard died before it was decided gets ERR_SHARD_UNAVAILABLE;
+        retry it with an idempotency key if it may have been applied.
+        """
+        requests = [unpack_request(request) for request in requests]
+        results: List[Optional[TransferResult]] = [None] * len(requests)
+        local: Dict[int, List[int]] = {}
+        remote: Dict[int, List[int]] = {}
+        # Recipient shard -> positions of the cross-shard requests whose recipient it checks
+        probes: Dict[int, List[int]] = {}
+        for position, request in enumerate(requests):
+            sender_shard, recipient_shard = self.shard_of(request[0]), self.shard_of(request[1])
+            if sender_shard == recipient_shard:
+                local.setdefault(sender_shard, []).append(position)
+            else:
+                remote.setdefault(sender_shard, []).append(position)
+                probes.setdefault(recipient_shard, []).append(position)
+        indexes = set(local) | set(remote) | set(probes)
+        with self._decision_lock:
+            generations = list(self._generations)
+        replies = self._scatter({index: ("prepare", ([requests[position] for position in local.get(index, [])],
+                                                     [requests[position] for position in remote.get(index, [])],
+                                                     [(requests[position][1], requests[position][6])
+                                                      for position in probes.get(index, [])]))
+                                 for index in indexes})
+        down = {index for index, reply in replies.items() if isinstance(reply, ShardUnavailable)}
+        failed = [reply for index, reply in replies.items() if index not in down and isinstance(reply, Exception)]
+        if failed:
+            # Nothing of the batch is decided: free what the other shards hold for it before raising
+            self._release_reserved(replies, remote, requests)
+            raise failed[0]
+        # Position -> the recipient shard's verdict on that request's recipient
+        checks: Dict[int, Optional[str]] = {}
+        for index, reply in replies.items():
+            if index not in down:
+                checks.update(zip(probes.get(index, []), reply[2]))
+
+        def unavailable(position: int) -> TransferResult:
+            sender_id, recipient_id, amount, trans_type = requests[position][:4]
+            return TransferResult(ERR_SHARD_UNAVAILABLE, sender_id, recipient_id, amount, trans_type)
+
+        for index, positions in local.items():
+            applied = replies[index][0] if index not in down else [unavailable(position) for position in positions]
+            for position, result in zip(positions, applied):
+                results[position] = result
+
+        # Decide each reservation: settle it, or release it
+        decided: List[Tuple[int, TransferResult]] = []
+        releases: Dict[int, List[Tuple[str, Optional[str]]]] = {}
+        for index, positions in remote.items():
+            if index in down:
+                for position in positions:
+                    results[position] = unavailable(position)
+                continue
+            for position, (result, held) in zip(positions, replies[index][1]):
+                recipient_id, idempotency_key = requests[position][1], requests[position][4]
+                if not held:
+                    # Rejected, or a keyed replay of a transfer already made
+                    results[position] = result
+                elif position not in checks or checks[position] is not None:
+                    releases.setdefault(index, []).append((result.transaction_id, idempotency_key))
+                    error = ERR_SHARD_UNAVAILABLE if self.shard_of(recipient_id) in down else checks[position]
+                    results[position] = TransferResult(error, *requests[position][:2], result.amount,
+                                                       result.trans_type)
+                else:
+                    decided.append((position, result))
+        settlements = self._log_decisions(decided, requests, generations, results)
+
+        by_shard: Dict[int, Tuple[List[Settlement], List[Tuple[str, Optional[str]]]]] = {}
+        for debit, credit in settlements.values():
+            by_shard.setdefault(self._side_shard(debit), ([], []))[0].append(debit)
+            by_shard.setdefault(self._side_shard(credit), ([], []))[0].append(credit)
+        for index, released in releases.items():
+            by_shard.setdefault(index, ([], []))[1].extend(released)
+        if by_shard:
+            legs: Dict[Tuple[str, bool], TransferResult] = {}
+            for index, reply in self._scatter({index: ("settle", work) for index, work in by_shard.items()}).items():
+                # A shard that died here was restarted and re-driven, so its legs are settled even without a reply
+                if not isinstance(reply, ShardUnavailable):
+                    for settlement, result in zip(by_shard[index][0], self._raise(reply)):
+                        legs[settlement.transaction_id, settlement.debit] = result
+            self._mark_settled(list(settlements))
+            for position, result in decided:
+                if result.transaction_id not in settlements:
+                    continue
+                debit = legs.get((result.transaction_id, True))
+                credit = legs.get((result.transaction_id, False))
+                results[position] = result._replace(
+                    date=debit.date if debit is not None else "",
+                    sender_balance=debit.sender_balance if debit is not None else 0.0,
+                    recipient_balance=credit.recipient_balance if credit is not None else 0.0)
+        return results
+
+    def _release_reserved(self, replies: Dict[int, object], remote: Dict[int, List[int]], requests: List[tuple]):
+        """Release every hold the prepare replies report, for a batch that will not be decided"""
+        releases: Dict[int, List[Tuple[str, Optional[str]]]] = {}
+        for index, positions in remote.items():
+            reply = replies[index]
+            if isinstance(reply, Exception):
+                continue
+            for position, (result, held) in zip(positions, reply[1]):
+                if held:
+                    releases.setdefault(index, []).append((result.transaction_id, requests[position][4]))
+        if releases:
+            # A shard that died meanwhile was restarted, which dropped its holds anyway
+            self._scatter({index: ("settle", ([], released)) for index, released in releases.items()})
+
+    def _log_decisions(self, decided: List[Tuple[int, TransferResult]], requests: List[tuple],
+                       generations: List[int],
+                       results: List[Optional[TransferResult]]) -> Dict[str, Tuple[Settlement, Settlement]]:
+        """Durably decide to settle reservations whose hold survived; returns transaction ID -> (debit, credit)
+
+        A reservation made on a worker that has since been replaced lost its
+        hold, so it is rejected instead.
+        """
+        settlements: Dict[str, Tuple[Settlement, Settlement]] = {}
+        if not decided:
+            return settlements
+        fields = []
+        with self._decision_lock:
+            for position, result in decided:
+                if self._generations[self.shard_of(result.sender_id)] != generations[self.shard_of(result.sender_id)]:
+                    results[position] = TransferResult(ERR_SHARD_UNAVAILABLE, result.sender_id, result.recipient_id,
+                                                       result.amount, result.trans_type)
+                    continue
+                idempotency_key = requests[position][4]
+                debit = Settlement(result.transaction_id, result.sender_id, result.recipient_id,
+                                   to_paise(result.amount), result.trans_type, result.utr, True, idempotency_key)
+                settlements[debit.transaction_id] = (debit, debit._replace(debit=False, idempotency_key=None))
+                fields.append(list(debit[:6]) + [idempotency_key])
+            if fields:
+                self._decisions.append({"op": "settle", "transfers": fields})
+                self._unsettled.update(settlements)
+        return settlements
+
+    def _mark_settled(self, transaction_ids: List[str]):
+        """Record that both legs of these transfers are journaled, dropping the log when nothing is pending"""
+        if not transaction_ids:
+            return
+        with self._decision_lock:
+            for transaction_id in transaction_ids:
+                self._unsettled.pop(transaction_id, None)
+            self._decisions.append({"op": "settled", "transfers": transaction_ids})
+            if not self._unsettled and self._decisions.end_offset >= DECISION_LOG_ROLL_BYTES:
+                self._drop_decisions()
+
+    # ----- queries -----
+
+    def _query(self, cust_id: str, method: str, *args):
+        return self._call(self.shard_of(cust_id), "query", method, (cust_id, *args))
+
+    def balance(self, cust_id: str) -> float:
+        """Current balance of a customer"""
+        return self._query(cust_id, "balance")
+
+    def history_count(self, cust_id: str, start=None, end=None) -> int:
+        """Number of transactions in a customer's history, optionally within start..end"""
+        return self._query(cust_id, "history_count", start, end)
+
+    def history(self, cust_id: str, offset: int = 0, limit: int = 50, newest_first: bool = True,
+                start=None, end=None) -> List[Dict]:
+        """One page of a customer's transactions (see Ledger.history())"""
+        return self._query(cust_id, "history", offset, limit, newest_first, start, end)
+
+    def statement(self, cust_id: str, start, end) -> Dict:
+        """Statement of a customer's account for start..end"""
+        return self._query(cust_id, "statement", start, end)
+
+    def find_transaction(self, transaction_id: str) -> List[Dict]:
+        """Both legs (with customer_id) of a transfer, from whichever shards hold them"""
+        return self._find("find_transaction", transaction_id)
+
+    def find_utr(self, utr: str) -> List[Dict]:
+        """Both legs (with customer_id) of the transfer with a UTR"""
+        return self._find("find_utr", utr)
+
+    def _find(self, method: str, value: str) -> List[Dict]:
+        legs: List[Dict] = []
+        for reply in self._scatter({index: ("query", (method, (value,))) for index in range(self.shards)}).values():
+            if isinstance(reply, ShardUnavailable):
+                raise reply
+            legs += self._raise(reply)
+        return legs
+
+    def totals(self) -> Dict[str, int]:
+        """Customers, sum of balances and sum of holds (paise) across shards, for checking money is conserved
+
+        Between requests, with nothing unsettled, the balance sum only
+        changes by registrations.
+        """
+        totals = {"customers": 0, "balance_paise": 0, "held_paise": 0}
+        for reply in self._scatter({index: ("totals", ()) for index in range(self.shards)}).values():
+            if isinstance(reply, ShardUnavailable):
+                raise reply
+            customers, balance_paise, held_paise = self._raise(reply)
+            totals["customers"] += customers
+            totals["balance_paise"] += balance_paise
+            totals["held_paise"] += held_paise
+        return totals
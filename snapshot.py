@@ -0,0 +1,297 @@
+"""Snapshot checkpoints and background compaction of the journal into the transaction store"""
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from history_index import HistoryIndex
+from journal import Journal, apply_record, list_segments, read_records, record_keys, segment_name
+from time_index import TimeIndex
+from txstore import TransactionStore, append_segment
+
+SNAPSHOT_NAME = "snapshot.json"
+# Where earlier versions moved folded segments; migrated into the store on load
+ARCHIVE_DIR = "archive"
+
+# Customer fields kept in a snapshot (history lives in the transaction store)
+SNAPSHOT_FIELDS = ["name", "dob", "address", "area", "balance", "account_type"]
+
+
+def customer_state(customers: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Copy balances and details, leaving out transaction history"""
+    return {cust_id: {field: info[field] for field in SNAPSHOT_FIELDS} for cust_id, info in customers.items()}
+
+
+def snapshot_exists(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, SNAPSHOT_NAME))
+
+
+def load_snapshot(directory: str) -> Optional[Dict]:
+    """Read the latest snapshot in a journal directory, if any"""
+    path = os.path.join(directory, SNAPSHOT_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_snapshot(directory: str, state: Dict[str, Dict], position: Tuple[int, int], store_records: int,
+                   history_heads: Dict[str, Tuple[int, int]], idempotency_keys: Dict[str, str],
+                   extra: Optional[Dict] = None):
+    """Atomically replace the snapshot with state as of the journal position
+
+    store_records is the length of the transaction store holding every leg
+    folded so far; anything past it on disk is an unfinished compaction.
+    history_heads is the history index's heads table for those records and
+    idempotency_keys maps each client key folded so far to its transaction ID.
+    Keys in extra are stored alongside (the bulk importer keeps its progress there).
+    """
+    path = os.path.join(directory, SNAPSHOT_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        snapshot = {"version": 4, "segment": position[0], "offset": position[1],
+                    "store_records": store_records, "history_index": history_heads,
+                    "idempotency_keys": idempotency_keys, "customers": state}
+        snapshot.update(extra or {})
+        json.dump(snapshot, file, separators=(",", ":"), ensure_ascii=False)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    _fsync_directory(directory)
+
+
+def _fsync_directory(directory: str):
+    """Make a rename in directory durable where the platform allows it"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Checkpointer:
+    """Fold sealed journal segments into a snapshot so startup only replays the tail
+
+    Every `every_records` commits the journal is rolled and a background
+    thread folds the sealed segments into a new snapshot of balances and
+    customer details.  The legs of folded segments are appended to the
+    binary transaction store, which keeps the older history, and the
+    segments are then deleted.
+    """
+
+    def __init__(self, journal: Journal, every_records: int = 10000):
+        self.journal = journal
+        self.every_records = every_records
+        self.store = TransactionStore(journal.directory)
+        self.index = HistoryIndex(self.store)
+        self.time_index = TimeIndex(self.store)
+        self._state: Dict[str, Dict] = {}
+        self._keys: Dict[str, str] = {}
+        self._position = (1, 0)
+        self._since_checkpoint = 0
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        # Store records below this index are not in memory after load()
+        self.history_boundary = 0
+        # History index heads covering exactly the records below history_boundary
+        self._cold_heads: Dict[str, Tuple[int, int]] = {}
+        # Idempotency key -> transaction ID of every keyed transfer found by load()
+        self.idempotency_keys: Dict[str, str] = {}
+        # Compactions that failed (and were rolled back), and the error of the latest one
+        self.failures = 0
+        self.last_error: Optional[Exception] = None
+
+    def load(self, customers: Dict[str, Dict]) -> int:
+        """Load the snapshot into customers and replay the journal tail after it
+
+        customers should hold the built-in defaults; they are the base state
+        when no snapshot has been written yet.  Returns the number of journal
+        records replayed.
+        """
+        snapshot = load_snapshot(self.journal.directory)
+        if snapshot is None:
+            self._state = customer_state(customers)
+            # Nothing has been checkpointed, so anything in the store is from an unfinished compaction
+            self.store.truncate(0)
+            self.index.load({}, 0)
+        else:
+            self._state = snapshot["customers"]
+            self._keys = snapshot.get("idempotency_keys", {})
+            self._position = (snapshot["segment"], snapshot["offset"])
+            customers.clear()
+            for cust_id, info in self._state.items():
+                customers[cust_id] = dict(info, transactions=[])
+            if "store_records" in snapshot:
+                # Drop legs appended by a compaction that never wrote its snapshot
+                self.store.truncate(snapshot["store_records"])
+                if "history_index" in snapshot:
+                    self.index.load(snapshot["history_index"], snapshot["store_records"])
+                else:
+                    self.index.rebuild()
+            else:
+                self._migrate_archive()
+        # A crash between writing a snapshot and deleting its segments leaves them behind
+        self._remove_segments([s for s in list_segments(self.journal.directory) if s < self._position[0]])
+        self.history_boundary = len(self.store)
+        self._cold_heads = self.index.snapshot_heads()
+        self.time_index.load(self.history_boundary)
+        self.idempotency_keys = dict(self._keys)
+        count = 0
+        for record in self.journal.replay(self._position):
+            apply_record(customers, record)
+            self.idempotency_keys.update(record_keys(record))
+            count += 1
+        self._since_checkpoint = count
+        return count
+
+    @property
+    def state(self) -> Dict[str, Dict]:
+        """Balances and details as of the last checkpoint, keyed by customer ID (no history)"""
+        return self._state
+
+    def record_committed(self, count: int = 1):
+        """Note new journal commits and start a checkpoint when one is due"""
+        with self._lock:
+            self._since_checkpoint += count
+            due = self._since_checkpoint >= self.every_records
+        if due:
+            self.checkpoint()
+
+    def checkpoint(self, wait: bool = False) -> bool:
+        """Roll the journal and fold everything sealed into a new snapshot
+
+        Returns False if a previous compaction is still running.  With wait,
+        a failed compaction raises its error here.
+        """
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return False
+            self.journal.roll()
+            self._since_checkpoint = 0
+            failures = self.failures
+            self._worker = threading.Thread(target=self._compact, name="journal-compaction", daemon=True)
+            self._worker.start()
+        if wait:
+            self._worker.join()
+            if self.failures != failures:
+                raise self.last_error
+        return True
+
+    def _compact(self):
+        """Fold sealed segments into the snapshot (runs on the compaction thread)
+
+        On failure the store and its indexes are cut back to where they were
+        and the checkpointed state is left alone, so the next checkpoint folds
+        the same segments again without duplicating legs.
+        """
+        records = len(self.store)
+        heads = self.index.snapshot_heads()
+        state = {cust_id: dict(info) for cust_id, info in self._state.items()}
+        keys = dict(self._keys)
+        try:
+            sealed = self.journal.sealed_segments()
+            if not sealed:
+                return
+            for segment in sealed:
+                path = self.journal.segment_path(segment)
+                offset = self._position[1] if segment == self._position[0] else 0
+                for _, _, record in read_records(path, offset):
+                    apply_record(state, record, keep_history=False)
+                    keys.update(record_keys(record))
+                append_segment(self.store, path, offset, self._index_legs)
+            self.store.sync()
+            self.index.sync()
+            self.time_index.sync()
+            position = (sealed[-1] + 1, 0)
+            write_snapshot(self.journal.directory, state, position, len(self.store), self.index.snapshot_heads(), keys)
+        except Exception as e:
+            self.store.truncate(records)
+            self.index.load(heads, records)
+            self.time_index.load(records)
+            self.failures += 1
+            self.last_error = e
+            print(f"Error during journal compaction (rolled back): {e}")
+            return
+        self._state, self._keys, self._position = state, keys, position
+        self._remove_segments(sealed)
+        print(f"Checkpointed {len(sealed)} journal segment(s); snapshot now at segment {self._position[0]}")
+
+    def append_packed(self, data: bytes, cust_ids: List[str]):
+        """Append packed legs that bypass the journal (bulk import) and index them
+
+        Only call this while no compaction is running; the legs become part
+        of the checkpointed history at the next save().
+        """
+        first = self.store.append_packed(data)
+        self.index.add(first, cust_ids)
+        self.time_index.update(first + len(cust_ids))
+
+    def save(self, extra: Optional[Dict] = None):
+        """Write a snapshot of the current checkpointed state and store right away"""
+        self.store.sync()
+        self.index.sync()
+        self.time_index.sync()
+        write_snapshot(self.journal.directory, self._state, self._position, len(self.store),
+                       self.index.snapshot_heads(), self._keys, extra)
+
+    def _index_legs(self, first: int, legs: List[Dict]):
+        self.index.add(first, [leg["customer_id"] for leg in legs])
+        self.time_index.update(first + len(legs))
+
+    def _remove_segments(self, segments: List[int]):
+        for segment in segments:
+            os.remove(self.journal.segment_path(segment))
+
+    def _migrate_archive(self):
+        """Move history from the old JSON archive directory into the store"""
+        archive_dir = os.path.join(self.journal.directory, ARCHIVE_DIR)
+        segments = list_segments(archive_dir)
+        if not segments:
+            return
+        self.store.truncate(0)
+        self.index.rebuild()
+        for segment in segments:
+            append_segment(self.store, os.path.join(archive_dir, segment_name(segment)), 0, self._index_legs)
+        self.store.sync()
+        self.index.sync()
+        write_snapshot(self.journal.directory, self._state, self._position, len(self.store),
+                       self.index.snapshot_heads(), self._keys)
+        for segment in segments:
+            os.remove(os.path.join(archive_dir, segment_name(segment)))
+        os.rmdir(archive_dir)
+        print(f"Migrated {len(segments)} archived segment(s) into {self.store.path}")
+
+    def cold_count(self, cust_id: str) -> int:
+        """Number of a customer's transactions that were checkpointed before load()"""
+        head = self._cold_heads.get(cust_id)
+        return head[1] if head else 0
+
+    def cold_bounds(self, cust_id: str, start: int, end: int) -> Tuple[int, int]:
+        """Positions [lo, hi) of a customer's checkpointed transactions timestamped within start..end"""
+        return self.index.bounds(cust_id, self._cold_heads.get(cust_id), start, end)
+
+    def cold_history(self, cust_id: str, lo: int, hi: int) -> List[Dict]:
+        """A customer's checkpointed transactions at positions lo..hi-1, oldest first"""
+        return self.index.legs(cust_id, self._cold_heads.get(cust_id), lo, hi)
+
+    def cold_transfers(self, start: int, end: int) -> Iterator[Dict]:
+        """Sender legs of checkpointed transfers timestamped within start..end, in store order"""
+        for lo, hi in self.time_index.candidates(start, end, self.history_boundary):
+            for chunk in range(lo, hi, 4096):
+                stamps = self.store.timestamps(chunk, min(chunk + 4096, hi))
+                for offset, stamp in enumerate(stamps):
+                    if start <= stamp <= end:
+                        leg = self.store.read(chunk + offset)
+                        if leg["type"].endswith("_out"):
+                            yield leg
+
+    def close(self):
+        """Wait for a running compaction to finish"""
+        worker = self._worker
+        if worker is not None:
+            worker.join()
+        self.time_index.close()
+        self.index.close()
+        self.store.close()
@@ -0,0 +1,573 @@
+"""Pluggable persistence for the ledger: journal, legacy CSV and SQLite backends"""
+import contextlib
+import csv
+import datetime
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from journal import FsyncPolicy, Journal, apply_record, customer_record, flatten_record
+from lookup_index import LookupIndex
+from snapshot import Checkpointer, load_snapshot, snapshot_exists
+from txstore import DATE_FORMAT, from_paise, to_paise
+from writer import GroupCommitWriter
+
+# Column layout of the legacy CSV data file
+CSV_HEADER = ["Customer ID", "Name", "Account Type", "DOB", "Address", "Area", "Date", "Type", "Amount", "Balance", "Recipient ID", "Transaction ID", "UTR"]
+
+
+def date_epoch(text: str) -> int:
+    """Epoch seconds of a DATE_FORMAT timestamp (local time, as in the transaction store)"""
+    return int(datetime.datetime.strptime(text, DATE_FORMAT).timestamp())
+
+
+def save_csv(customers: Dict[str, Dict], path: str):
+    """Save all transactions and customer details to a CSV file"""
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADER)
+        for cust_id, info in customers.items():
+            for trans in info["transactions"]:
+                writer.writerow([
+                    cust_id,
+                    info["name"],
+                    info["account_type"],
+                    info["dob"],
+                    info["address"],
+                    info["area"],
+                    trans["date"],
+                    trans["type"],
+                    trans["amount"],
+                    trans["balance"],
+                    trans.get("recipient_id", ""),
+                    trans.get("transaction_id", ""),
+                    trans.get("utr", "")
+                ])
+            # Write customer details even if no transactions; the Balance column keeps their balance
+            if not info["transactions"]:
+                writer.writerow([
+                    cust_id,
+                    info["name"],
+                    info["account_type"],
+                    info["dob"],
+                    info["address"],
+                    info["area"],
+                    "", "", "", info["balance"], "", "", ""
+                ])
+    print(f"Transactions and customer details saved to {path}")
+
+
+def load_csv(customers: Dict[str, Dict], path: str):
+    """Load transactions and customer details from a CSV file if it exists
+
+    A customer's balance is the running balance of their last transaction
+    row, or the Balance column of their details row.  Customers missing
+    from customers (registered after the defaults) are added.
+    """
+    if not os.path.exists(path):
+        print(f"No transaction file found at {path}. Starting fresh.")
+        return
+    with open(path, 'r') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)  # Skip header
+        if header != CSV_HEADER:
+            print(f"Invalid CSV header in {path}. Expected {CSV_HEADER}, got {header}")
+            return
+        for row in reader:
+            if len(row) < 6:
+                print(f"Skipping invalid row: {row}")
+                continue
+            cust_id = row[0].upper()
+            if len(row) >= 13 and row[6]:  # Transaction row
+                try:
+                    trans = {
+                        "date": row[6],
+                        "type": row[7],
+                        "amount": float(row[8]),
+                        "balance": float(row[9]),
+                        "recipient_id": row[10],
+                        "transaction_id": row[11],
+                        "utr": row[12]
+                    }
+                except ValueError as e:
+                    print(f"Skipping invalid transaction row {row}: {e}")
+                    continue
+                info = csv_customer(customers, cust_id, row)
+                info["transactions"].append(trans)
+                info["balance"] = trans["balance"]
+            else:  # Customer details row
+                info = csv_customer(customers, cust_id, row)
+                if len(row) >= 10 and row[9]:
+                    try:
+                        info["balance"] = float(row[9])
+                    except ValueError as e:
+                        print(f"Skipping invalid balance in row {row}: {e}")
+    print(f"Transactions and customer details loaded from {path}")
+
+
+def csv_customer(customers: Dict[str, Dict], cust_id: str, row: List[str]) -> Dict:
+    """The customer a CSV row belongs to, added if unknown, with its details updated from the row"""
+    info = customers.get(cust_id)
+    if info is None:
+        info = customers[cust_id] = {"balance": 0.0, "transactions": []}
+    info["name"] = row[1]
+    info["account_type"] = row[2]
+    info["dob"] = row[3]
+    info["address"] = row[4]
+    info["area"] = row[5]
+    return info
+
+
+class Storage:
+    """Where a ledger keeps its customers and transactions
+
+    load() fills the ledger's customers dict and commit() persists a list of
+    journal records ("customer", "transfer" and "batch" ops, see journal.py)
+    as one atomic unit.  Backends that keep older history out of memory
+    serve it through the cold_* methods: "cold" transactions are the ones
+    persisted before load(), addressed by their position in a customer's
+    history.  The base implementation keeps everything in memory.
+    """
+
+    def load(self, customers: Dict[str, Dict]):
+        raise NotImplementedError
+
+    def load_balances(self, customers: Dict[str, Dict]):
+        """Fill customers with details and balances only, for read-only use; backends that can skip history do"""
+        self.load(customers)
+
+    def commit(self, records: List[Dict]) -> Optional[Future]:
+        """Persist records; returns a Future if durability is reached later"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Wait until every commit so far is durable"""
+
+    def close(self):
+        """Release files and connections"""
+
+    @property
+    def idempotency_keys(self) -> Dict[str, str]:
+        """Idempotency key -> transaction ID of keyed transfers found by load()"""
+        return {}
+
+    @property
+    def compaction_failures(self) -> int:
+        """Background compactions that failed (and were rolled back) since load()"""
+        return 0
+
+    @property
+    def failure(self) -> Optional[BaseException]:
+        """Error that left storage behind memory (e.g. a failed asynchronous commit); None while healthy"""
+        return None
+
+    @property
+    def directory(self) -> str:
+        """Where this backend's files live (node IDs for new transactions are leased here)"""
+        raise NotImplementedError
+
+    def cold_count(self, cust_id: str) -> int:
+        return 0
+
+    def cold_bounds(self, cust_id: str, start: Optional[str], end: Optional[str]) -> Tuple[int, int]:
+        """Positions [lo, hi) of cold transactions dated within start..end (None = unbounded)"""
+        return 0, 0
+
+    def cold_history(self, cust_id: str, lo: int, hi: int) -> List[Dict]:
+        """Cold transactions at positions lo..hi-1, oldest first"""
+        return []
+
+    def cold_transfers(self, start: str, end: str) -> List[Dict]:
+        """Sender legs (with customer_id) of cold transfers dated within start..end"""
+        return []
+
+    def cold_lookup(self, field: str, value: str) -> List[Dict]:
+        """Cold legs (with customer_id) whose field ("transaction_id" or "utr") equals value"""
+        return []
+
+
+class CsvStorage(Storage):
+    """The legacy single CSV file, rewritten in full on every commit"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._customers: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        return os.path.dirname(os.path.abspath(self.path))
+
+    def load(self, customers: Dict[str, Dict]):
+        load_csv(customers, self.path)
+        self._customers = customers
+
+    def commit(self, records: List[Dict]) -> Optional[Future]:
+        with self._lock:
+            save_csv(self._customers, self.path)
+        return None
+
+
+class JournalStorage(Storage):
+    """Append-only journal with snapshot checkpoints and the binary transaction store
+
+    With async_commit, commits are handed to a group-commit writer thread
+    and commit() returns a Future instead of waiting for disk.  A read_only
+    storage supports load_balances() only and writes no file, so it can
+    read a journal another process is appending to.
+    """
+
+    def __init__(self, directory: str, seed_csv: Optional[str] = None, fsync_policy: Optional[FsyncPolicy] = None,
+                 checkpoint_every: int = 10000, async_commit: bool = False, group_commit_delay_ms: float = 0.0,
+                 read_only: bool = False):
+        self.seed_csv = seed_csv
+        self.journal = Journal(directory, fsync_policy, read_only)
+        # The transaction store and its indexes are only needed (and repaired) by load()
+        self.checkpointer = None if read_only else Checkpointer(self.journal, checkpoint_every)
+        self.writer = None
+        if async_commit:
+            self.writer = GroupCommitWriter(self.journal, max_delay_ms=group_commit_delay_ms)
+        self._lookup = LookupIndex()
+
+    def load(self, customers: Dict[str, Dict]):
+        if self.checkpointer is None:
+            raise ValueError(f"{self.journal.directory} is open read-only: only balances can be loaded")
+        if self.journal.is_empty() and not snapshot_exists(self.journal.directory):
+            # First run in journal mode: seed the journal from the legacy CSV
+            if self.seed_csv is not None and os.path.exists(self.seed_csv):
+                load_csv(customers, self.seed_csv)
+                self.journal.append_many(
+                    customer_record(cust_id, info, include_history=True) for cust_id, info in customers.items()
+                )
+                print(f"Seeded {self.journal.directory} from {self.seed_csv}")
+            self.checkpointer.load(customers)
+        else:
+            count = self.checkpointer.load(customers)
+            print(f"Loaded snapshot and replayed {count} journal records from {self.journal.directory}")
+        self._lookup = LookupIndex(self.checkpointer.store, self.checkpointer.history_boundary)
+
+    def load_balances(self, customers: Dict[str, Dict]):
+        """Read the snapshot and fold the journal tail into balances, leaving the store and its indexes untouched"""
+        snapshot = load_snapshot(self.journal.directory)
+        if snapshot is None and self.journal.is_empty():
+            # Nothing in journal mode yet: the first load() seeds the journal
+            if self.journal.read_only:
+                if self.seed_csv is not None and os.path.exists(self.seed_csv):
+                    load_csv(customers, self.seed_csv)
+                return
+            self.load(customers)
+            return
+        position = (1, 0)
+        if snapshot is not None:
+            position = (snapshot["segment"], snapshot["offset"])
+            customers.clear()
+            customers.update(snapshot["customers"])
+        for record in self.journal.replay(position):
+            apply_record(customers, record, keep_history=False)
+
+    def commit(self, records: List[Dict]) -> Optional[Future]:
+        record = records[0] if len(records) == 1 else {"op": "batch", "records": records}
+        future = None
+        if self.writer is not None:
+            future = self.writer.submit(record)
+        else:
+            self.journal.append(record)
+        self.checkpointer.record_committed(len(records))
+        return future
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        """Finish background compaction and flush the journal"""
+        if self.writer is not None:
+            self.writer.close()
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+        self.journal.close()
+
+    @property
+    def idempotency_keys(self) -> Dict[str, str]:
+        return self.checkpointer.idempotency_keys
+
+    @property
+    def compaction_failures(self) -> int:
+        return self.checkpointer.failures
+
+    @property
+    def failure(self) -> Optional[BaseException]:
+        return self.writer.failed if self.writer is not None else None
+
+    @property
+    def directory(self) -> str:
+        return self.journal.directory
+
+    def cold_count(self, cust_id: str) -> int:
+        return self.checkpointer.cold_count(cust_id)
+
+    def cold_bounds(self, cust_id: str, start: Optional[str], end: Optional[str]) -> Tuple[int, int]:
+        return self.checkpointer.cold_bounds(cust_id, date_epoch(start) if start else -2 ** 63,
+                                             date_epoch(end) if end else 2 ** 63 - 1)
+
+    def cold_history(self, cust_id: str, lo: int, hi: int) -> List[Dict]:
+        return self.checkpointer.cold_history(cust_id, lo, hi)
+
+    def cold_transfers(self, start: str, end: str) -> List[Dict]:
+        return list(self.checkpointer.cold_transfers(date_epoch(start), date_epoch(end)))
+
+    def cold_lookup(self, field: str, value: str) -> List[Dict]:
+        if field == "utr":
+            return self._lookup.by_utr(value)
+        return self._lookup.by_transaction_id(value)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    dob TEXT NOT NULL,
+    address TEXT NOT NULL,
+    area TEXT NOT NULL,
+    balance_paise INTEGER NOT NULL,
+    account_type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    seq INTEGER PRIMARY KEY,
+    customer_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    type TEXT NOT NULL,
+    amount_paise INTEGER NOT NULL,
+    balance_paise INTEGER NOT NULL,
+    recipient_id TEXT NOT NULL,
+    transaction_id TEXT NOT NULL,
+    utr TEXT NOT NULL,
+    pos INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_customer_seq ON transactions (customer_id, seq);
+CREATE INDEX IF NOT EXISTS transactions_customer_date ON transactions (customer_id, date);
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions (date);
+CREATE INDEX IF NOT EXISTS transactions_transaction_id ON transactions (transaction_id);
+CREATE INDEX IF NOT EXISTS transactions_utr ON transactions (utr);
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    transaction_id TEXT NOT NULL
+);
+"""
+
+# Created after any migration, as databases from before the pos column lack it
+SQLITE_POSITION_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS transactions_customer_pos ON transactions (customer_id, pos)"
+
+# Statements are kept as constants so sqlite3's statement cache reuses their prepared form
+SQL_UPSERT_CUSTOMER = ("INSERT OR REPLACE INTO customers (id, name, dob, address, area, balance_paise, account_type) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?)")
+# A leg's pos is its position in its customer's history, one past the last one (a lookup in the pos index)
+SQL_INSERT_LEG = ("INSERT INTO transactions (customer_id, date, type, amount_paise, balance_paise, recipient_id, "
+                  "transaction_id, utr, pos) VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, "
+                  "(SELECT COALESCE(MAX(pos) + 1, 0) FROM transactions WHERE customer_id = ?1))")
+SQL_UPDATE_BALANCE = "UPDATE customers SET balance_paise = ? WHERE id = ?"
+SQL_INSERT_KEY = "INSERT OR IGNORE INTO idempotency_keys (key, transaction_id) VALUES (?, ?)"
+SQL_LEG_COLUMNS = "customer_id, date, type, amount_paise, balance_paise, recipient_id, transaction_id, utr"
+
+
+def _leg_row(cust_id: str, leg: Dict) -> Tuple:
+    return (cust_id, leg["date"], leg["type"], to_paise(leg["amount"]), to_paise(leg["balance"]),
+            leg.get("recipient_id", ""), leg.get("transaction_id", ""), leg.get("utr", ""))
+
+
+def _row_leg(row: Tuple, with_customer: bool = False) -> Dict:
+    leg = {
+        "date": row[1],
+        "type": row[2],
+        "amount": from_paise(row[3]),
+        "balance": from_paise(row[4]),
+        "recipient_id": row[5],
+        "transaction_id": row[6],
+        "utr": row[7],
+    }
+    if with_customer:
+        leg["customer_id"] = row[0]
+    return leg
+
+
+class SqliteStorage(Storage):
+    """SQLite database in WAL mode with one writer connection and a pool of readers
+
+    Each commit is a single transaction, so both legs of a transfer and both
+    balance updates land together.  In WAL mode readers see the last
+    committed state without waiting for a write in progress, so history
+    queries never queue behind transfers.  Only balances and details are
+    loaded into memory; history from before load() is read on demand.
+    Each leg stores its position in its customer's history (pos), so a
+    page of history is a range lookup in the (customer_id, pos) index and
+    the number of legs per customer before load() is counted once, by load().
+    """
+
+    def __init__(self, path: str, seed_csv: Optional[str] = None, readers: int = 4, synchronous: str = "FULL"):
+        self.path = path
+        self.seed_csv = seed_csv
+        self._writer = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute(f"PRAGMA synchronous={synchronous}")
+        self._writer.executescript(SQLITE_SCHEMA)
+        self._add_positions()
+        self._writer.execute(SQLITE_POSITION_INDEX)
+        self._write_lock = threading.Lock()
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(readers):
+            connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            self._readers.put(connection)
+        self._reader_count = readers
+        # Transactions with seq up to this were persisted before load()
+        self.history_boundary = 0
+        # Number of each customer's transactions with seq up to history_boundary
+        self._cold_counts: Dict[str, int] = {}
+        self._keys: Dict[str, str] = {}
+
+    def _add_positions(self):
+        """Give a database from before the pos column each leg's position in its customer's history"""
+        columns = [row[1] for row in self._writer.execute("PRAGMA table_info(transactions)")]
+        if "pos" in columns:
+            return
+        self._writer.execute("BEGIN IMMEDIATE")
+        try:
+            self._writer.execute("ALTER TABLE transactions ADD COLUMN pos INTEGER")
+            counts: Dict[str, int] = {}
+            positions = []
+            for seq, cust_id in self._writer.execute("SELECT seq, customer_id FROM transactions ORDER BY seq"):
+                positions.append((counts.get(cust_id, 0), seq))
+                counts[cust_id] = positions[-1][0] + 1
+            self._writer.executemany("UPDATE transactions SET pos = ? WHERE seq = ?", positions)
+        except BaseException:
+            self._writer.execute("ROLLBACK")
+            raise
+        self._writer.execute("COMMIT")
+        print(f"Numbered {len(positions)} transactions of {len(counts)} customers in {self.path}")
+
+    @contextlib.contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection from the pool"""
+        connection = self._readers.get()
+        try:
+            yield connection
+        finally:
+            self._readers.put(connection)
+
+    @property
+    def directory(self) -> str:
+        return os.path.dirname(os.path.abspath(self.path))
+
+    def load(self, customers: Dict[str, Dict]):
+        with self._reader() as connection:
+            rows = connection.execute(
+                "SELECT id, name, dob, address, area, balance_paise, account_type FROM customers").fetchall()
+            self._set_boundary(connection)
+            self._keys = dict(connection.execute("SELECT key, transaction_id FROM idempotency_keys"))
+        if not rows:
+            # New database: store the built-in customers, or seed from the legacy CSV
+            if self.seed_csv is not None and os.path.exists(self.seed_csv):
+                load_csv(customers, self.seed_csv)
+                print(f"Seeded {self.path} from {self.seed_csv}")
+            self.commit([customer_record(cust_id, info, include_history=True) for cust_id, info in customers.items()])
+            for info in customers.values():
+                info["transactions"] = []
+            with self._reader() as connection:
+                self._set_boundary(connection)
+            return
+        customers.clear()
+        for cust_id, name, dob, address, area, balance, account_type in rows:
+            customers[cust_id] = {"name": name, "dob": dob, "address": address, "area": area,
+                                  "balance": from_paise(balance), "account_type": account_type, "transactions": []}
+        print(f"Loaded {len(rows)} customers from {self.path}")
+
+    def _set_boundary(self, connection: sqlite3.Connection):
+        """Mark everything persisted so far as history from before load(), counting it per customer"""
+        self.history_boundary = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM transactions").fetchone()[0]
+        self._cold_counts = dict(connection.execute(
+            "SELECT customer_id, COUNT(*) FROM transactions WHERE seq <= ? GROUP BY customer_id",
+            (self.history_boundary,)))
+
+    def commit(self, records: List[Dict]) -> Optional[Future]:
+        customers = []
+        legs = []
+        balances = []
+        keys = []
+        for record in records:
+            for inner in flatten_record(record):
+                if inner.get("op") == "customer":
+                    customers.append((inner["id"], inner["name"], inner["dob"], inner["address"], inner["area"],
+                                      to_paise(inner["balance"]), inner["account_type"]))
+                    legs += [_leg_row(inner["id"], trans) for trans in inner.get("transactions", [])]
+                elif inner.get("op") == "transfer":
+                    for leg in inner["legs"]:
+                        legs.append(_leg_row(leg["customer_id"], leg))
+                        balances.append((to_paise(leg["balance"]), leg["customer_id"]))
+                    if inner.get("key") is not None:
+                        keys.append((inner["key"], inner["legs"][0]["transaction_id"]))
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                self._writer.executemany(SQL_UPSERT_CUSTOMER, customers)
+                self._writer.executemany(SQL_INSERT_LEG, legs)
+                self._writer.executemany(SQL_UPDATE_BALANCE, balances)
+                self._writer.executemany(SQL_INSERT_KEY, keys)
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._writer.execute("COMMIT")
+        return None
+
+    def close(self):
+        for _ in range(self._reader_count):
+            self._readers.get().close()
+        # A second close() must not wait for readers that are already closed
+        self._reader_count = 0
+        self._writer.close()
+
+    @property
+    def idempotency_keys(self) -> Dict[str, str]:
+        return self._keys
+
+    def cold_count(self, cust_id: str) -> int:
+        return self._cold_counts.get(cust_id, 0)
+
+    def cold_bounds(self, cust_id: str, start: Optional[str], end: Optional[str]) -> Tuple[int, int]:
+        count = self.cold_count(cust_id)
+        with self._reader() as connection:
+            # A customer's legs are in date order, so each bound is the position of the first leg past it
+            lo = self._first_position(connection, cust_id, ">=", start, count) if start else 0
+            hi = self._first_position(connection, cust_id, ">", end, count) if end else count
+        return lo, hi
+
+    @staticmethod
+    def _first_position(connection: sqlite3.Connection, cust_id: str, operator: str, date: str, count: int) -> int:
+        row = connection.execute(f"SELECT pos FROM transactions WHERE customer_id = ? AND date {operator} ? "
+                                 "ORDER BY date, seq LIMIT 1", (cust_id, date)).fetchone()
+        return count if row is None else min(row[0], count)
+
+    def cold_history(self, cust_id: str, lo: int, hi: int) -> List[Dict]:
+        if lo >= hi:
+            return []
+        with self._reader() as connection:
+            rows = connection.execute(
+                f"SELECT {SQL_LEG_COLUMNS} FROM transactions WHERE customer_id = ? AND pos BETWEEN ? AND ? "
+                "ORDER BY pos", (cust_id, lo, hi - 1)).fetchall()
+        return [_row_leg(row) for row in rows]
+
+    def cold_transfers(self, start: str, end: str) -> List[Dict]:
+        with self._reader() as connection:
+            rows = connection.execute(
+                f"SELECT {SQL_LEG_COLUMNS} FROM transactions WHERE date BETWEEN ? AND ? AND seq <= ? "
+                "AND type LIKE '%\\_out' ESCAPE '\\' ORDER BY seq", (start, end, self.history_boundary)).fetchall()
+        return [_row_leg(row, with_customer=True) for row in rows]
+
+    def cold_lookup(self, field: str, value: str) -> List[Dict]:
+        column = "utr" if field == "utr" else "transaction_id"
+        with self._reader() as connection:
+            rows = connection.execute(
+                f"SELECT {SQL_LEG_COLUMNS} FROM transactions WHERE {column} = ? AND seq <= ? ORDER BY seq",
+                (value, self.history_boundary)).fetchall()
+        return [_row_leg(row, with_customer=True) for row in rows]
@@ -0,0 +1,51 @@
+"""Shared fixtures: the modules live at the repository root, next to 123.py"""
+import contextlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import Ledger  # noqa: E402
+
+
+@pytest.fixture
+def open_ledger(tmp_path):
+    """Open (and load) a ledger over files in tmp_path; everything opened is closed after the test"""
+    opened = []
+
+    def make(mode: str = "journal", **kwargs) -> Ledger:
+        ledger = Ledger(mode, str(tmp_path / "bank_journal"), str(tmp_path / "bank_transactions.csv"),
+                        sqlite_path=str(tmp_path / "bank.sqlite3"), **kwargs)
+        ledger.load()
+        opened.append(ledger)
+        return ledger
+
+    yield make
+    for ledger in opened:
+        ledger.close()
+
+
+@pytest.fixture
+def write_limit(capsys):
+    """Context manager making the OS refuse file writes past a byte offset (EFBIG), like a full disk
+
+    Output is captured in memory meanwhile (capsys), so only the code under
+    test writes to files while the limit is in force.
+    """
+    resource = pytest.importorskip("resource")
+    import signal
+
+    @contextlib.contextmanager
+    def limit(size: int):
+        soft, hard = resource.getrlimit(resource.RLIMIT_FSIZE)
+        previous = signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+        resource.setrlimit(resource.RLIMIT_FSIZE, (size, hard))
+        try:
+            yield
+        finally:
+            resource.setrlimit(resource.RLIMIT_FSIZE, (soft, hard))
+            signal.signal(signal.SIGXFSZ, previous)
+
+    return limit
@@ -0,0 +1,58 @@
+"""cli.py as scripts run it: exit status and messages, never a traceback"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli.py")
+
+
+def run(tmp_path, *args):
+    return subprocess.run([sys.executable, CLI, "--data-dir", str(tmp_path), *args], capture_output=True, text=True)
+
+
+@pytest.mark.parametrize("amount", ["nan", "inf", "abc", "1e999"])
+def test_transfer_rejects_bad_amounts(tmp_path, amount):
+    done = run(tmp_path, "transfer", "CUST001", "CUST002", amount)
+    assert done.returncode == 1
+    assert "Invalid amount" in done.stderr and "Traceback" not in done.stderr
+
+
+def test_batch_transfer_reports_bad_rows_and_files(tmp_path):
+    batch = tmp_path / "batch.csv"
+    batch.write_text("sender_id,recipient_id,amount,type\nCUST001,CUST002,nan,UPI\nCUST001,CUST002,5,UPI\n",
+                     encoding="utf-8")
+    done = run(tmp_path, "batch-transfer", str(batch))
+    assert done.returncode == 1
+    assert "Row 2: Invalid amount" in done.stderr and "1 transfers applied, 1 rejected" in done.stderr
+    assert run(tmp_path, "balance", "CUST001").stdout.split() == ["CUST001", "995.00"]
+
+    batch.write_bytes(b"\xff\xfe not utf-8")
+    done = run(tmp_path, "batch-transfer", str(batch))
+    assert done.returncode == 1
+    assert "Cannot read" in done.stderr and "Traceback" not in done.stderr
+
+
+def test_read_only_commands_leave_a_torn_tail_alone(tmp_path):
+    assert run(tmp_path, "transfer", "CUST001", "CUST002", "5").returncode == 0
+    journal_dir = tmp_path / "bank_journal"
+    segment = journal_dir / sorted(name for name in os.listdir(journal_dir) if name.endswith(".log"))[-1]
+    # What a writer in another process may not have finished appending yet
+    with open(segment, "ab") as file:
+        file.write(b'deadbeef {"op": "transfer", "legs": [')
+    size = os.path.getsize(segment)
+    files = sorted(os.listdir(journal_dir))
+
+    assert run(tmp_path, "balance", "CUST001").stdout.split() == ["CUST001", "995.00"]
+    done = run(tmp_path, "--json", "export", "--format", "json")
+    assert done.returncode == 0 and '"balance": 1505.0' in done.stdout
+    assert os.path.getsize(segment) == size
+    assert sorted(os.listdir(journal_dir)) == files
+
+
+@pytest.mark.parametrize("paging", [["--limit", "-1"], ["--offset", "-5"]])
+def test_history_rejects_negative_paging(tmp_path, paging):
+    done = run(tmp_path, "history", "CUST001", *paging)
+    assert done.returncode == 1
+    assert "offset and limit must not be negative" in done.stderr and done.stdout == ""
@@ -0,0 +1,67 @@
+"""Bulk imports: rows the transaction store cannot hold are rejected, never written"""
+import csv
+
+from importer import CUSTOMER_IMPORT_HEADER, Importer
+from storage import CSV_HEADER
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        csv.writer(file).writerows([header] + rows)
+    return str(path)
+
+
+def rejects(path):
+    with open(path, newline="", encoding="utf-8") as file:
+        return [row[-2:] for row in list(csv.reader(file))[1:]]
+
+
+def test_balances_too_large_for_the_store_are_rejected(tmp_path, open_ledger):
+    source = write_csv(tmp_path / "customers.csv", CUSTOMER_IMPORT_HEADER, [
+        ["IMP001", "Huge", "Savings", "1990-01-01", "1 Rd", "Downtown", "1e17"],
+        ["IMP002", "Fine", "Savings", "1990-01-01", "2 Rd", "Downtown", "10000000000000"],
+    ])
+    report = Importer(str(tmp_path / "bank_journal")).import_file(source)
+    assert (report.customers, report.rejected) == (1, 1)
+    assert rejects(source + ".rejects.csv") == [["2", "balance larger than 10000000000000"]]
+
+    legacy = write_csv(tmp_path / "legacy.csv", CSV_HEADER, [
+        ["IMP003", "Legacy", "Savings", "1990-01-01", "3 Rd", "Downtown", "2024-01-01 10:00:00", "upi_in",
+         "5", "1e17", "IMP002", "TXN1", "UTR1"],
+    ])
+    report = Importer(str(tmp_path / "bank_journal")).import_file(legacy)
+    assert (report.transactions, report.rejected) == (0, 1)
+
+    ledger = open_ledger()
+    assert ledger.balance("IMP002") == 10 ** 13
+    ledger.storage.checkpointer.checkpoint(wait=True)
+
+
+def test_non_finite_numbers_are_rejected(tmp_path, open_ledger):
+    source = write_csv(tmp_path / "customers.csv", CUSTOMER_IMPORT_HEADER, [
+        ["IMP001", "Not A Number", "Savings", "1990-01-01", "1 Rd", "Downtown", "nan"],
+        ["IMP002", "Infinite", "Savings", "1990-01-01", "2 Rd", "Downtown", "inf"],
+    ])
+    legacy = write_csv(tmp_path / "legacy.csv", CSV_HEADER, [
+        ["IMP003", "Legacy", "Savings", "1990-01-01", "3 Rd", "Downtown", "2024-01-01 10:00:00", "upi_in",
+         "inf", "5", "IMP004", "TXN1", "UTR1"],
+        ["IMP003", "Legacy", "Savings", "1990-01-01", "3 Rd", "Downtown", "2024-01-01 10:00:00", "upi_in",
+         "1e307", "5", "IMP004", "TXN1", "UTR1"],
+    ])
+    assert Importer(str(tmp_path / "bank_journal")).import_file(source).rejected == 2
+    assert Importer(str(tmp_path / "bank_journal")).import_file(legacy).rejected == 2
+    assert [error for _, error in rejects(source + ".rejects.csv")] == ["balance is not a finite number"] * 2
+
+    ledger = open_ledger()
+    assert sorted(ledger.customers) == ["IMP003"]
+    assert ledger.transactions("IMP003") == []
+
+
+def test_details_only_legacy_rows_keep_their_balance(tmp_path, open_ledger):
+    legacy = write_csv(tmp_path / "legacy.csv", CSV_HEADER, [
+        ["IMP001", "Saver", "Savings", "1990-01-01", "1 Rd", "Downtown", "", "", "", "750.5", "", "", ""],
+        ["IMP002", "Spender", "Current", "1990-01-01", "2 Rd", "Downtown", "", "", "", "-1", "", "", ""],
+    ])
+    report = Importer(str(tmp_path / "bank_journal")).import_file(legacy)
+    assert (report.customers, report.rejected) == (1, 1)
+    assert open_ledger().balance("IMP001") == 750.5
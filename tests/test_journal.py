@@ -0,0 +1,21 @@
+"""Journal appends that fail part way must leave nothing behind"""
+import os
+
+import pytest
+
+from journal import Journal
+
+
+def test_failed_append_is_cut_back(tmp_path, write_limit):
+    journal = Journal(str(tmp_path))
+    journal.append({"op": "test", "n": 1})
+    size = journal.end_offset
+    with write_limit(size + 10):
+        with pytest.raises(OSError):
+            journal.append({"op": "test", "n": 2, "padding": "x" * 100})
+    assert os.path.getsize(journal.segment_path(journal.segment)) == size == journal.end_offset
+    journal.append({"op": "test", "n": 3})
+    journal.close()
+    reopened = Journal(str(tmp_path))
+    assert [record["n"] for record in reopened.replay()] == [1, 3]
+    reopened.close()
@@ -0,0 +1,313 @@
+"""Ledger behaviour that has to hold across restarts: validation, recovery, reloads and idempotent replay"""
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from ledger import (DEFAULT_CUSTOMERS, ERR_BALANCE_TOO_LARGE, ERR_INSUFFICIENT_FUNDS, ERR_INVALID_AMOUNT,
+                    ERR_KEY_REUSED, ERR_MISSING_FIELDS, ERR_ROLLING_COUNT, ERR_VERIFICATION_FAILED, TRANSACTION_TYPES,
+                    Settlement)
+from limits import DAY, Limit, VelocityLimits
+from txstore import MAX_BALANCE_PAISE, RECORD_SIZE
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Customers of the built-in default set used by these tests
+CUST_IDS = [f"CUST{number:03d}" for number in range(1, 11)]
+
+
+def state(ledger):
+    """Balances and full histories of every customer, for comparing two ledgers"""
+    return {cust_id: (ledger.balance(cust_id), [dict(trans) for trans in ledger.transactions(cust_id)])
+            for cust_id in sorted(ledger.customers)}
+
+
+def random_transfers(count, seed=7):
+    rng = random.Random(seed)
+    return [(*rng.sample(CUST_IDS, 2), rng.randint(1, 40), rng.choice(TRANSACTION_TYPES)) for _ in range(count)]
+
+
+@pytest.mark.parametrize("amount", ["nan", "NaN", "inf", "-inf", "1e999", "abc", float("nan"), float("inf"),
+                                    10 ** 400, [5], {"amount": 5}])
+def test_bad_amounts_are_rejected(open_ledger, amount):
+    ledger = open_ledger()
+    before = state(ledger)
+    assert ledger.transfer("CUST001", "CUST002", amount, "UPI").error == ERR_INVALID_AMOUNT
+    results = ledger.transfer_many([("CUST001", "CUST002", amount, "UPI"), ("CUST001", "CUST002", 5, "UPI")])
+    assert [result.error for result in results] == [ERR_INVALID_AMOUNT, None]
+    assert ledger.balance("CUST001") == before["CUST001"][0] - 5
+    assert len(ledger.transactions("CUST001")) == 1
+
+
+@pytest.mark.parametrize("amount", ["", None])
+def test_missing_amount_is_reported_as_missing(open_ledger, amount):
+    assert open_ledger().transfer("CUST001", "CUST002", amount, "UPI").error == ERR_MISSING_FIELDS
+
+
+def test_balances_too_large_for_the_store_are_rejected(open_ledger):
+    ledger = open_ledger(checkpoint_every=10 ** 6)
+    rich = ("Rich Customer", "Savings", "1990-01-01", "1 Test Rd", "Downtown")
+    for balance in ["1e17", "1e307", MAX_BALANCE_PAISE / 100 + 0.01]:
+        assert ledger.register_customer(*rich, balance).error == ERR_BALANCE_TOO_LARGE
+    registered = ledger.register_customer(*rich, MAX_BALANCE_PAISE / 100)
+    assert registered.ok
+    assert ledger.transfer(registered.customer_id, "CUST001", 1, "UPI").ok
+    # The largest balance still fits the store, so compaction keeps working
+    ledger.storage.checkpointer.checkpoint(wait=True)
+    expected = state(ledger)
+    ledger.close()
+    assert state(open_ledger()) == expected
+
+
+@pytest.mark.parametrize("mode", ["journal", "sqlite", "csv"])
+def test_reload_matches_memory(open_ledger, mode):
+    ledger = open_ledger(mode, checkpoint_every=7)
+    registered = ledger.register_customer("Test Customer", "Savings", "1990-01-01", "1 Test Rd", "Downtown", 5000)
+    assert registered.ok
+    requests = random_transfers(60) + [(registered.customer_id, "CUST001", 123.45, "Bank Transfer")]
+    for first in range(0, len(requests), 9):
+        ledger.transfer_many(requests[first:first + 9])
+    ledger.transfer("CUST002", "CUST003", 7.5, "Net Banking", "single-key")
+    expected = state(ledger)
+    ledger.close()
+
+    assert state(open_ledger(mode)) == expected
+
+
+def test_crash_without_close_loses_nothing_committed(open_ledger, tmp_path):
+    """A process killed after its commits returned keeps every transfer, with no duplicates"""
+    script = f"""
+import json, os, sys
+sys.path.insert(0, {ROOT!r})
+from ledger import Ledger
+from journal import FsyncPolicy
+ledger = Ledger("journal", {str(tmp_path / "bank_journal")!r}, {str(tmp_path / "bank_transactions.csv")!r},
+                FsyncPolicy.every(1), checkpoint_every=5)
+ledger.load()
+for request in {random_transfers(23)!r}:
+    ledger.transfer(*request)
+ledger.storage.checkpointer.checkpoint(wait=True)
+ledger.transfer("CUST004", "CUST005", 1, "UPI")
+sys.stderr.write(json.dumps({{cust_id: ledger.balance(cust_id) for cust_id in ledger.customers}}))
+os._exit(0)
+"""
+    crashed = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=str(tmp_path))
+    assert crashed.returncode == 0, crashed.stderr
+    balances = json.loads(crashed.stderr.strip().splitlines()[-1])
+
+    ledger = open_ledger()
+    assert {cust_id: ledger.balance(cust_id) for cust_id in ledger.customers} == balances
+    assert sum(len(ledger.transactions(cust_id)) for cust_id in CUST_IDS) == 2 * 24
+
+
+def test_torn_journal_tail_is_truncated(open_ledger, tmp_path):
+    ledger = open_ledger()
+    for request in random_transfers(15):
+        ledger.transfer(*request)
+    expected = state(ledger)
+    ledger.close()
+    journal_dir = tmp_path / "bank_journal"
+    last = sorted(name for name in os.listdir(journal_dir) if name.endswith(".log"))[-1]
+    with open(journal_dir / last, "ab") as file:
+        file.write(b'deadbeef {"op": "transfer", "legs": [')
+
+    ledger = open_ledger()
+    assert state(ledger) == expected
+    assert ledger.transfer("CUST001", "CUST002", 1, "UPI").ok
+    expected = state(ledger)
+    ledger.close()
+    assert state(open_ledger()) == expected
+
+
+@pytest.mark.parametrize("mode", ["journal", "sqlite"])
+def test_idempotent_replay_after_reload(open_ledger, mode):
+    ledger = open_ledger(mode)
+    first = ledger.transfer("CUST001", "CUST002", 250, "UPI", "order-1")
+    assert first.ok
+    # A replay in the same batch as other work moves no money either
+    results = ledger.transfer_many([("CUST001", "CUST002", 250, "UPI", "order-1"),
+                                    ("CUST003", "CUST004", 10, "Net Banking", "order-2")])
+    assert results[0].transaction_id == first.transaction_id and results[1].ok
+    expected = state(ledger)
+    ledger.close()
+
+    ledger = open_ledger(mode)
+    replay = ledger.transfer("CUST001", "CUST002", 250, "UPI", "order-1")
+    assert (replay.ok, replay.transaction_id, replay.utr) == (True, first.transaction_id, first.utr)
+    assert ledger.transfer("CUST001", "CUST002", 999, "UPI", "order-1").error == ERR_KEY_REUSED
+    replays = ledger.transfer_many([("CUST003", "CUST004", 10, "Net Banking", "order-2")])
+    assert replays[0].transaction_id == results[1].transaction_id
+    assert state(ledger) == expected
+
+
+def test_failed_journal_write_is_undone(open_ledger, write_limit):
+    """A transfer whose journal write fails is undone in memory and never comes back from disk"""
+    ledger = open_ledger()
+    ledger.transfer("CUST001", "CUST002", 5, "UPI")
+    expected = state(ledger)
+    journal = ledger.storage.journal
+
+    with write_limit(journal.end_offset + 20):
+        with pytest.raises(OSError):
+            ledger.transfer("CUST001", "CUST002", 100, "UPI", "retry-me")
+        with pytest.raises(OSError):
+            ledger.transfer_many(random_transfers(5))
+    assert state(ledger) == expected
+
+    # The key was never used, so the retry is a new transfer
+    assert ledger.transfer("CUST001", "CUST002", 100, "UPI", "retry-me").ok
+    expected = state(ledger)
+    ledger.close()
+    assert state(open_ledger()) == expected
+
+
+def test_failed_sqlite_write_is_undone(open_ledger, write_limit, tmp_path):
+    """A transfer whose WAL write fails is undone like one whose journal write fails"""
+    ledger = open_ledger("sqlite")
+    ledger.transfer("CUST001", "CUST002", 5, "UPI")
+    expected = state(ledger)
+
+    with write_limit(os.path.getsize(tmp_path / "bank.sqlite3-wal")):
+        with pytest.raises(sqlite3.Error):
+            ledger.transfer("CUST001", "CUST002", 100, "UPI", "retry-me")
+    assert state(ledger) == expected
+
+    assert ledger.transfer("CUST001", "CUST002", 100, "UPI", "retry-me").ok
+    expected = state(ledger)
+    ledger.close()
+    assert state(open_ledger("sqlite")) == expected
+
+
+def test_failed_registration_is_undone(open_ledger, write_limit):
+    """A registration whose journal write fails leaves neither the customer nor its name behind"""
+    ledger = open_ledger()
+    request = ("Test Customer", "Savings", "1990-01-01", "1 Test Rd", "Downtown", 5000)
+    customers = set(ledger.customers)
+
+    with write_limit(ledger.storage.journal.end_offset + 20):
+        with pytest.raises(OSError):
+            ledger.register_customer(*request)
+    assert set(ledger.customers) == customers
+
+    # The name was never taken
+    registered = ledger.register_customer(*request)
+    assert registered.ok
+    ledger.close()
+    assert open_ledger().balance(registered.customer_id) == 5000
+
+
+def test_failed_settlement_is_undone(open_ledger, write_limit):
+    """Settlements whose journal write fails leave balances, holds and keys as reserve() left them"""
+    ledger = open_ledger()
+    reserved = ledger.reserve("CUST001", "REMOTE1", 100, "UPI", "order-1")
+    assert reserved.ok
+    settlements = [Settlement(reserved.transaction_id, "CUST001", "REMOTE1", 10000, "UPI", reserved.utr, True,
+                              "order-1"),
+                   Settlement("TXNREMOTE", "REMOTE2", "CUST002", 2500, "UPI", "UTRREMOTE", False)]
+    expected = state(ledger)
+    holds = dict(ledger.holds)
+
+    with write_limit(ledger.storage.journal.end_offset + 20):
+        with pytest.raises(OSError):
+            ledger.settle_many(settlements)
+    assert state(ledger) == expected
+    assert ledger.holds == holds
+    assert ledger.transfer("CUST001", "CUST002", ledger.balance("CUST001"), "UPI").error == ERR_INSUFFICIENT_FUNDS
+    assert ledger.reserve("CUST001", "REMOTE1", 100, "UPI", "order-1") == reserved
+
+    # Re-driven, the settlement applies once and survives a reload
+    settled = ledger.settle_many(settlements)
+    assert [result.ok for result in settled] == [True, True]
+    assert not ledger.holds
+    expected = state(ledger)
+    ledger.close()
+    assert state(open_ledger()) == expected
+
+
+def test_reservations_count_against_velocity_limits(open_ledger):
+    ledger = open_ledger(velocity_limits=VelocityLimits({"Savings": [Limit(DAY, max_count=2)]}))
+    first = ledger.reserve("CUST001", "REMOTE1", 10, "UPI")
+    second = ledger.reserve("CUST001", "REMOTE2", 10, "UPI")
+    assert first.ok and second.ok
+    assert ledger.transfer("CUST001", "CUST002", 10, "UPI").error == ERR_ROLLING_COUNT
+    assert ledger.release(second.transaction_id)
+    # Settling a held transfer does not count it a second time
+    ledger.settle_many([Settlement(first.transaction_id, "CUST001", "REMOTE1", 1000, "UPI", first.utr, True)])
+    assert ledger.transfer("CUST001", "CUST002", 10, "UPI").ok
+    assert ledger.reserve("CUST001", "REMOTE2", 10, "UPI").error == ERR_ROLLING_COUNT
+
+
+def test_failed_compaction_is_rolled_back(open_ledger, write_limit):
+    ledger = open_ledger(checkpoint_every=10 ** 6)
+    for request in random_transfers(20):
+        ledger.transfer(*request)
+    checkpointer = ledger.storage.checkpointer
+    stored = len(checkpointer.store)
+
+    # The store takes a few of the 40 legs before the disk is full
+    with write_limit(RECORD_SIZE * 5 + RECORD_SIZE // 2):
+        with pytest.raises(OSError):
+            checkpointer.checkpoint(wait=True)
+    assert len(checkpointer.store) == stored
+    assert os.path.getsize(checkpointer.store.path) == stored * RECORD_SIZE
+    assert ledger.storage.compaction_failures == 1
+
+    checkpointer.checkpoint(wait=True)
+    assert len(checkpointer.store) == stored + 40
+    expected = state(ledger)
+    ledger.close()
+    assert state(open_ledger()) == expected
+
+
+def test_lookups_of_non_ascii_ids_find_nothing(open_ledger, tmp_path):
+    ledger = open_ledger(hot_days=0, spill_dir=str(tmp_path / "bank_spill"))
+    result = ledger.transfer("CUST001", "CUST002", 5, "UPI")
+    # Legs are stamped in whole seconds; once one has passed, both spill
+    time.sleep(1.1)
+    assert ledger.evict() == 2
+    assert len(ledger.find_utr(result.utr)) == 2
+    assert ledger.find_utr("é") == []
+    assert ledger.find_transaction("ü") == []
+
+
+def test_details_are_verified_against_current_values(open_ledger):
+    ledger = open_ledger()
+    sender = dict(DEFAULT_CUSTOMERS["CUST001"])
+    recipient = dict(DEFAULT_CUSTOMERS["CUST002"])
+    assert ledger.transfer("CUST001", "CUST002", 5, "UPI", sender_details=sender, recipient_details=recipient).ok
+    assert ledger.transfer("CUST001", "CUST002", 5, "UPI", recipient_details=sender).error == ERR_VERIFICATION_FAILED
+    ledger.customers["CUST001"]["address"] = "9 New Street"
+    assert ledger.transfer("CUST001", "CUST002", 5, "UPI", sender_details=sender).error == ERR_VERIFICATION_FAILED
+    moved = dict(sender, address="9  new street")
+    assert ledger.transfer("CUST001", "CUST002", 5, "UPI", sender_details=moved).ok
+
+
+def test_failed_async_commit_stops_writes_until_reload(open_ledger, write_limit):
+    ledger = open_ledger(async_commit=True)
+    committed = ledger.transfer("CUST001", "CUST002", 5, "UPI")
+    committed.commit.result()
+    expected = state(ledger)
+
+    with write_limit(ledger.storage.journal.end_offset + 20):
+        failed = ledger.transfer("CUST001", "CUST002", 100, "UPI", "order-1")
+        with pytest.raises(OSError):
+            failed.commit.result()
+    # Neither new transfers nor keyed replays of the lost one are answered from memory
+    with pytest.raises(OSError):
+        ledger.transfer("CUST003", "CUST004", 1, "UPI")
+    with pytest.raises(OSError):
+        ledger.transfer("CUST001", "CUST002", 100, "UPI", "order-1")
+    with pytest.raises(OSError):
+        ledger.register_customer("Late Customer", "Savings", "1990-01-01", "1 Rd", "Downtown", 10)
+    ledger.close()
+
+    ledger = open_ledger(async_commit=True)
+    assert state(ledger) == expected
+    retried = ledger.transfer("CUST001", "CUST002", 100, "UPI", "order-1")
+    retried.commit.result()
+    assert retried.transaction_id != failed.transaction_id
@@ -0,0 +1,43 @@
+"""The HTTP server as clients see it: malformed requests get a 400 with an error code, never a 500"""
+import asyncio
+import json
+
+import pytest
+
+from ledger import DEFAULT_CUSTOMERS
+from server import BankServer
+
+
+def post(ledger, path, payload):
+    """Status and JSON body of one POST to a server started on a free port"""
+    async def exchange():
+        server = BankServer(ledger, port=0, workers=1)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection(server.host, server.port)
+            body = json.dumps(payload).encode("utf-8")
+            writer.write(f"POST {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+                         .encode("latin-1") + body)
+            response = await reader.read()
+            writer.close()
+        finally:
+            await server.close()
+        head, _, body = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+
+    return asyncio.run(exchange())
+
+
+@pytest.mark.parametrize("field", ["sender_details", "recipient_details"])
+@pytest.mark.parametrize("details", ["CUST001", ["Charan"], 5])
+def test_details_that_are_not_objects_are_rejected(open_ledger, field, details):
+    ledger = open_ledger()
+    transfer = {"sender_id": "CUST001", "recipient_id": "CUST002", "amount": 5, "type": "UPI", field: details}
+    for path, payload in [("/transfers", transfer), ("/transfers/batch", {"transfers": [transfer]})]:
+        status, body = post(ledger, path, payload)
+        assert (status, body["error"]) == (400, "invalid_request")
+    assert ledger.transactions("CUST001") == []
+
+    transfer[field] = dict(DEFAULT_CUSTOMERS["CUST001" if field == "sender_details" else "CUST002"])
+    status, body = post(ledger, "/transfers", transfer)
+    assert status == 200 and body["ok"]
@@ -0,0 +1,60 @@
+"""Sharded ledger: holds are never stranded, whatever phase one of a batch does"""
+import pytest
+
+from ledger import ERR_ROLLING_AMOUNT
+from limits import DAY, Limit, VelocityLimits
+from sharding import ShardedLedger, shard_of
+
+# Customers of the default set on each of two shards
+SHARD_0 = ["CUST004", "CUST005", "CUST006"]
+SHARD_1 = ["CUST001", "CUST002", "CUST003"]
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    assert {shard_of(cust_id, 2) for cust_id in SHARD_0} == {0} and {shard_of(cust_id, 2) for cust_id in SHARD_1} == {1}
+    opened = []
+
+    def make(**kwargs) -> ShardedLedger:
+        ledger = ShardedLedger(str(tmp_path / "bank_shards"), shards=2, **kwargs).start()
+        opened.append(ledger)
+        return ledger
+
+    yield make
+    for ledger in opened:
+        ledger.close()
+
+
+def balances(ledger):
+    return {cust_id: ledger.balance(cust_id) for cust_id in SHARD_0 + SHARD_1}
+
+
+def test_failed_prepare_releases_every_hold(sharded):
+    ledger = sharded()
+    before = balances(ledger)
+    # A string where the sender's details belong makes phase one raise on that shard
+    failing = [
+        # Reserved on shard 0, which succeeds; the other request fails shard 1
+        [("CUST004", "CUST001", 100, "UPI", "order-1"), ("CUST002", "CUST003", 5, "UPI", None, "not details")],
+        # Shard 0 holds the first reservation before the second one raises
+        [("CUST004", "CUST001", 100, "UPI", "order-1"), ("CUST005", "CUST002", 5, "UPI", None, "not details")],
+    ]
+    for requests in failing:
+        with pytest.raises(TypeError):
+            ledger.transfer_many(requests)
+        assert ledger.totals()["held_paise"] == 0
+        assert balances(ledger) == before
+
+    # The key was released with its hold, so the transfer is made now
+    result = ledger.transfer("CUST004", "CUST001", before["CUST004"], "UPI", "order-1")
+    assert result.ok and ledger.balance("CUST004") == 0
+
+
+def test_shards_enforce_velocity_limits(sharded):
+    ledger = sharded(velocity_limits=VelocityLimits({"Savings": [Limit(DAY, max_amount=150)]}))
+    assert ledger.transfer("CUST005", "CUST001", 100, "UPI").ok
+    # Cross-shard and same-shard transfers count against the same window
+    assert ledger.transfer("CUST005", "CUST002", 60, "UPI").error == ERR_ROLLING_AMOUNT
+    assert ledger.transfer("CUST005", "CUST006", 60, "UPI").error == ERR_ROLLING_AMOUNT
+    results = ledger.transfer_many([("CUST005", "CUST001", 40, "UPI"), ("CUST005", "CUST002", 40, "UPI")])
+    assert [result.error for result in results] == [None, ERR_ROLLING_AMOUNT]
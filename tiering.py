@@ -0,0 +1,255 @@
+"""Compressed, immutable segment files for history evicted from memory
+
+The ledger keeps only recent legs in memory.  Older legs are spilled here:
+each spill() packs the evicted legs of every customer it covers as
+transaction store records, grouped by customer, and writes them as one
+zlib-compressed segment that is never modified again.  Segments are
+derived data (the journal or database still holds every leg), so the
+spill directory is emptied whenever a SpilledHistory is created.
+"""
+import bisect
+import os
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from records import Transaction
+from txstore import ID_WIDTH, RECORD_SIZE, RECORD_STRUCT, TIMESTAMP_STRUCT, _fixed
+
+SEGMENT_PREFIX = "history-"
+SEGMENT_SUFFIX = ".seg"
+
+# Byte offsets of the transaction ID and UTR fields within a record
+KEY_OFFSETS = {"transaction_id": RECORD_STRUCT.size - 2 * ID_WIDTH, "utr": RECORD_STRUCT.size - ID_WIDTH}
+
+# Decompressed segments kept in memory for reads
+CACHE_SEGMENTS = 16
+
+# zlib level for segment files (spills run with account locks held, so favour speed)
+COMPRESSION_LEVEL = 1
+
+
+class Extent(NamedTuple):
+    """A run of one customer's spilled legs inside a segment"""
+    segment: int
+    start: int  # Record index within the decompressed segment
+    count: int
+    first_timestamp: int
+    last_timestamp: int
+
+
+class Segment(NamedTuple):
+    """Index of one segment file: its time range and the hashes of its keys"""
+    path: str
+    records: int
+    first_timestamp: int
+    last_timestamp: int
+    key_hashes: array  # Sorted crc32 of every transaction ID and UTR in the segment
+
+
+def _key_hash(value: str) -> int:
+    return zlib.crc32(value.encode("ascii"))
+
+
+class SpilledHistory:
+    """Legs evicted from memory, in compressed segments with a small in-memory index
+
+    Per customer, the index holds the extents of its spilled legs in
+    history order, so a history page maps onto whole-segment reads.  Per
+    segment it holds the time range and sorted 32-bit hashes of the
+    transaction IDs and UTRs, so lookups open only candidate segments.
+    Reads go through an LRU cache of decompressed segments.
+    """
+
+    def __init__(self, directory: str, cache_segments: int = CACHE_SEGMENTS):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                os.remove(os.path.join(directory, name))
+        self.cache_segments = cache_segments
+        self._lock = threading.Lock()
+        self._segments: List[Segment] = []
+        self._extents: Dict[str, List[Extent]] = {}
+        # Per customer, position of each extent's first leg in its spilled history (plus the total)
+        self._offsets: Dict[str, List[int]] = {}
+        self._cache: "OrderedDict[int, bytes]" = OrderedDict()
+        self._types: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __len__(self) -> int:
+        return sum(segment.records for segment in self._segments)
+
+    def _code(self, name: str) -> int:
+        code = self._codes.get(name)
+        if code is None:
+            if len(self._types) >= 255:
+                raise ValueError("Too many distinct transaction types")
+            self._types.append(name)
+            code = self._codes[name] = len(self._types)
+        return code
+
+    def spill(self, legs: Dict[str, List[Transaction]]):
+        """Write one segment from each customer's oldest in-memory legs, oldest first
+
+        Every customer's legs must be newer than any it already has spilled.
+        """
+        legs = {cust_id: run for cust_id, run in legs.items() if run}
+        if not legs:
+            return
+        with self._lock:
+            number = len(self._segments)
+            chunks: List[bytes] = []
+            extents: List[Tuple[str, Extent]] = []
+            hashes: List[int] = []
+            start = 0
+            for cust_id, run in legs.items():
+                customer = _fixed(cust_id, "Customer ID")
+                for trans in run:
+                    chunks.append(RECORD_STRUCT.pack(
+                        trans.timestamp, trans.amount_paise, trans.balance_paise, self._code(trans.type), customer,
+                        _fixed(trans.recipient_id, "Recipient ID"), _fixed(trans.transaction_id, "Transaction ID"),
+                        _fixed(trans.utr, "UTR")))
+                    if trans.transaction_id:
+                        hashes.append(_key_hash(trans.transaction_id))
+                    if trans.utr:
+                        hashes.append(_key_hash(trans.utr))
+                extents.append((cust_id, Extent(number, start, len(run), run[0].timestamp, run[-1].timestamp)))
+                start += len(run)
+            data = b"".join(chunks)
+            path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(zlib.compress(data, COMPRESSION_LEVEL))
+            os.replace(tmp_path, path)
+            self._segments.append(Segment(path, start, min(extent.first_timestamp for _, extent in extents),
+                                          max(extent.last_timestamp for _, extent in extents),
+                                          array("I", sorted(set(hashes)))))
+            for cust_id, extent in extents:
+                self._extents.setdefault(cust_id, []).append(extent)
+                offsets = self._offsets.setdefault(cust_id, [0])
+                offsets.append(offsets[-1] + extent.count)
+            self._remember(number, data)
+
+    def _remember(self, number: int, data: bytes):
+        self._cache[number] = data
+        self._cache.move_to_end(number)
+        while len(self._cache) > self.cache_segments:
+            self._cache.popitem(last=False)
+
+    def _data(self, number: int) -> bytes:
+        """Decompressed contents of a segment, through the LRU cache"""
+        with self._lock:
+            data = self._cache.get(number)
+            if data is not None:
+                self._cache.move_to_end(number)
+                self.cache_hits += 1
+                return data
+            self.cache_misses += 1
+            path = self._segments[number].path
+        with open(path, "rb") as file:
+            data = zlib.decompress(file.read())
+        with self._lock:
+            self._remember(number, data)
+        return data
+
+    def _unpack(self, data: bytes, index: int) -> Tuple[str, Transaction]:
+        timestamp, amount, balance, code, customer, counterparty, txn_id, utr = \
+            RECORD_STRUCT.unpack_from(data, index * RECORD_SIZE)
+        trans = Transaction(timestamp, self._types[code - 1], amount, balance,
+                            counterparty.rstrip(b"\0").decode("ascii"), txn_id.rstrip(b"\0").decode("ascii"),
+                            utr.rstrip(b"\0").decode("ascii"))
+        return customer.rstrip(b"\0").decode("ascii"), trans
+
+    def count(self, cust_id: str) -> int:
+        """Number of spilled legs of a customer"""
+        offsets = self._offsets.get(cust_id)
+        return offsets[-1] if offsets else 0
+
+    def _snapshot(self, cust_id: str) -> Tuple[List[Extent], List[int]]:
+        with self._lock:
+            return list(self._extents.get(cust_id, [])), list(self._offsets.get(cust_id, [0]))
+
+    def _position(self, cust_id: str, timestamp: int, after: bool) -> int:
+        """Spilled legs of a customer dated before timestamp (or at or before it, if after)"""
+        extents, offsets = self._snapshot(cust_id)
+        if not extents:
+            return 0
+        # First extent that reaches past timestamp; everything before it is counted whole
+        if after:
+            number = bisect.bisect_right(extents, timestamp, key=lambda extent: extent.last_timestamp)
+        else:
+            number = bisect.bisect_left(extents, timestamp, key=lambda extent: extent.last_timestamp)
+        if number == len(extents):
+            return offsets[-1]
+        extent = extents[number]
+        data = self._data(extent.segment)
+        records = range(extent.start, extent.start + extent.count)
+        find = bisect.bisect_right if after else bisect.bisect_left
+        inside = find(records, timestamp,
+                      key=lambda index: TIMESTAMP_STRUCT.unpack_from(data, index * RECORD_SIZE)[0])
+        return offsets[number] + inside
+
+    def bounds(self, cust_id: str, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+        """Positions [lo, hi) of a customer's spilled legs dated within start..end (None = unbounded)"""
+        lo = self._position(cust_id, start, after=False) if start is not None else 0
+        hi = self._position(cust_id, end, after=True) if end is not None else self.count(cust_id)
+        return lo, hi
+
+    def history(self, cust_id: str, lo: int, hi: int) -> List[Transaction]:
+        """A customer's spilled legs at positions lo..hi-1, oldest first"""
+        extents, offsets = self._snapshot(cust_id)
+        legs: List[Transaction] = []
+        number = max(bisect.bisect_right(offsets, lo) - 1, 0)
+        while number < len(extents) and offsets[number] < hi:
+            extent = extents[number]
+            data = self._data(extent.segment)
+            first = extent.start + max(lo - offsets[number], 0)
+            last = extent.start + min(hi - offsets[number], extent.count)
+            legs += (self._unpack(data, index)[1] for index in range(first, last))
+            number += 1
+        return legs
+
+    def transfers(self, start: int, end: int) -> List[Tuple[int, str, Transaction]]:
+        """(timestamp, sender ID, sender leg) of spilled transfers dated within start..end, oldest first"""
+        transfers: List[Tuple[int, str, Transaction]] = []
+        for number, segment in enumerate(list(self._segments)):
+            if segment.last_timestamp < start or segment.first_timestamp > end:
+                continue
+            data = self._data(number)
+            for index in range(segment.records):
+                timestamp, = TIMESTAMP_STRUCT.unpack_from(data, index * RECORD_SIZE)
+                if start <= timestamp <= end:
+                    cust_id, trans = self._unpack(data, index)
+                    if trans.type.endswith("_out"):
+                        transfers.append((timestamp, cust_id, trans))
+        # Segments interleave in time once customers spill at different moments; sort() is stable
+        transfers.sort(key=lambda entry: entry[0])
+        return transfers
+
+    def lookup(self, field: str, value: str) -> List[Dict]:
+        """Spilled legs (with customer_id) whose field ("transaction_id" or "utr") equals value"""
+        try:
+            key = value.encode("ascii")
+        except UnicodeEncodeError:
+            # Transaction IDs and UTRs are ASCII, so nothing spilled can match
+            return []
+        wanted = zlib.crc32(key)
+        offset = KEY_OFFSETS[field]
+        legs: List[Dict] = []
+        for number, segment in enumerate(list(self._segments)):
+            hashes = segment.key_hashes
+            position = bisect.bisect_left(hashes, wanted)
+            if position == len(hashes) or hashes[position] != wanted:
+                continue
+            data = self._data(number)
+            for index in range(segment.records):
+                start = index * RECORD_SIZE + offset
+                if data[start:start + ID_WIDTH].rstrip(b"\0") == key:
+                    cust_id, trans = self._unpack(data, index)
+                    legs.append(dict(trans, customer_id=cust_id))
+        return legs
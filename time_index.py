@@ -0,0 +1,91 @@
+"""Block min/max timestamp index over the transaction store for bank-wide range queries"""
+import bisect
+import os
+import struct
+from typing import List, Tuple
+
+from txstore import TransactionStore
+
+BLOCK_FILE = "transactions.blk"
+BLOCK_STRUCT = struct.Struct("<qq")
+
+# Store records summarized by one block entry
+BLOCK_RECORDS = 4096
+
+
+class TimeIndex:
+    """Min/max timestamp of every full block of BLOCK_RECORDS store records
+
+    The store is appended in (nearly) time order, so the running maximum and
+    the trailing minimum of the blocks are both sorted.  Bisecting them
+    finds the only blocks that can hold records in a time range; the
+    partial block at the end of the store is always scanned.
+    """
+
+    def __init__(self, store: TransactionStore, block_records: int = BLOCK_RECORDS):
+        self.store = store
+        self.block_records = block_records
+        self.path = os.path.join(store.directory, BLOCK_FILE)
+        self.blocks: List[Tuple[int, int]] = []
+        self._prefix_max: List[int] = []
+        self._suffix_min: List[int] = []
+        self._file = open(self.path, "a+b")
+
+    def load(self, records: int):
+        """Read block summaries for the first `records` store records, building any missing ones"""
+        self._file.seek(0)
+        data = self._file.read()
+        full = records // self.block_records
+        self.blocks = [BLOCK_STRUCT.unpack_from(data, offset)
+                       for offset in range(0, min(len(data), full * BLOCK_STRUCT.size), BLOCK_STRUCT.size)]
+        self._file.truncate(len(self.blocks) * BLOCK_STRUCT.size)
+        self._prefix_max = []
+        for _, block_max in self.blocks:
+            self._prefix_max.append(max(block_max, self._prefix_max[-1]) if self._prefix_max else block_max)
+        self._suffix_min = []
+        self.update(records)
+
+    def update(self, records: int):
+        """Summarize blocks completed since the last call (store now holds `records`)"""
+        added = []
+        while (len(self.blocks) + 1) * self.block_records <= records:
+            start = len(self.blocks) * self.block_records
+            stamps = self.store.timestamps(start, start + self.block_records)
+            block = (min(stamps), max(stamps))
+            self.blocks.append(block)
+            self._prefix_max.append(max(block[1], self._prefix_max[-1]) if self._prefix_max else block[1])
+            added.append(BLOCK_STRUCT.pack(*block))
+        if added:
+            self._file.write(b"".join(added))
+            self._file.flush()
+            self._suffix_min = []
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def candidates(self, start: int, end: int, records: int) -> List[Tuple[int, int]]:
+        """Store index ranges [lo, hi) of the first `records` that may hold times in start..end"""
+        blocks = self.blocks[:records // self.block_records]
+        if not self._suffix_min or len(self._suffix_min) != len(self.blocks):
+            suffix, low = [], None
+            for block_min, _ in reversed(self.blocks):
+                low = block_min if low is None else min(low, block_min)
+                suffix.append(low)
+            suffix.reverse()
+            self._suffix_min = suffix
+        # Blocks before first_block end before start; blocks from last_block on begin after end
+        first_block = bisect.bisect_left(self._prefix_max, start, hi=len(blocks))
+        last_block = bisect.bisect_right(self._suffix_min, end, hi=len(blocks))
+        lo = first_block * self.block_records
+        summarized = len(blocks) * self.block_records
+        hi = max(lo, min(last_block, len(blocks)) * self.block_records)
+        # Records past the last full block have no summary and are always scanned
+        if hi >= summarized:
+            return [(lo, records)] if lo < records else []
+        ranges = [(lo, hi)] if lo < hi else []
+        if summarized < records:
+            ranges.append((summarized, records))
+        return ranges
+
+    def close(self):
+        self._file.close()
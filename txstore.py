@@ -0,0 +1,416 @@
+"""Compact on-disk format: a customer table plus a fixed-width binary transaction log
+
+transactions.bin is a headerless array of RECORD_SIZE-byte little-endian
+records, so record i lives at byte i * RECORD_SIZE and the whole file can
+be mapped with mmap and viewed with numpy.frombuffer(..., numpy_dtype()).
+Amounts and balances are int64 paise, timestamps int64 epoch seconds and
+transaction types uint8 codes interned in types.json.
+"""
+import csv
+import datetime
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from journal import flatten_record, read_records
+
+CUSTOMER_TABLE = "customers.csv"
+TRANSACTION_LOG = "transactions.bin"
+TYPE_TABLE = "types.json"
+
+CUSTOMER_HEADER = ["Customer ID", "Name", "Account Type", "DOB", "Address", "Area", "Balance (paise)"]
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# timestamp, amount, balance, type code, padding, customer, counterparty, transaction ID, UTR
+RECORD_FORMAT = "<qqqB7x16s16s16s16s"
+RECORD_STRUCT = struct.Struct(RECORD_FORMAT)
+RECORD_SIZE = RECORD_STRUCT.size
+TIMESTAMP_STRUCT = struct.Struct("<q")
+
+ID_WIDTH = 16
+
+# Largest balance the int64 paise fields may hold: ₹10 lakh crore, far inside int64 and exact as a float
+MAX_BALANCE_PAISE = 10 ** 15
+
+
+def numpy_dtype():
+    """numpy structured dtype matching RECORD_FORMAT (requires numpy)"""
+    import numpy as np
+    return np.dtype([
+        ("timestamp", "<i8"),
+        ("amount", "<i8"),
+        ("balance", "<i8"),
+        ("type_code", "u1"),
+        ("_pad", "V7"),
+        ("customer_id", "S16"),
+        ("counterparty_id", "S16"),
+        ("transaction_id", "S16"),
+        ("utr", "S16"),
+    ])
+
+
+def to_paise(amount: float) -> int:
+    """Convert a rupee amount to integer paise"""
+    return int(round(amount * 100))
+
+
+def from_paise(paise: int) -> float:
+    """Convert integer paise back to rupees"""
+    return paise / 100
+
+
+def _fixed(value: str, field: str) -> bytes:
+    encoded = value.encode("ascii")
+    if len(encoded) > ID_WIDTH:
+        raise ValueError(f"{field} {value!r} is longer than {ID_WIDTH} bytes")
+    return encoded
+
+
+class TypeTable:
+    """Interned transaction type strings, persisted as a JSON list (code = index + 1)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.names: List[str] = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.names = json.load(file)
+        self.codes: Dict[str, int] = {name: index + 1 for index, name in enumerate(self.names)}
+
+    def code(self, name: str) -> int:
+        """Code of a type name, interning it on first use"""
+        code = self.codes.get(name)
+        if code is not None:
+            return code
+        with self._lock:
+            if name not in self.codes:
+                if len(self.names) >= 255:
+                    raise ValueError("Too many distinct transaction types")
+                self.names.append(name)
+                self.codes[name] = len(self.names)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as file:
+                    json.dump(self.names, file)
+                os.replace(tmp_path, self.path)
+            return self.codes[name]
+
+    def name(self, code: int) -> str:
+        return self.names[code - 1] if 0 < code <= len(self.names) else ""
+
+
+class _DateCache:
+    """Memoized date string <-> epoch conversion (many legs share a timestamp)"""
+
+    def __init__(self, size: int = 4096):
+        self.size = size
+        self._to_epoch: Dict[str, int] = {}
+        self._to_text: Dict[int, str] = {}
+
+    def epoch(self, text: str) -> int:
+        value = self._to_epoch.get(text)
+        if value is None:
+            if len(self._to_epoch) >= self.size:
+                self._to_epoch.clear()
+            value = int(datetime.datetime.strptime(text, DATE_FORMAT).timestamp()) if text else 0
+            self._to_epoch[text] = value
+        return value
+
+    def text(self, epoch: int) -> str:
+        value = self._to_text.get(epoch)
+        if value is None:
+            if len(self._to_text) >= self.size:
+                self._to_text.clear()
+            value = datetime.datetime.fromtimestamp(epoch).strftime(DATE_FORMAT) if epoch else ""
+            self._to_text[epoch] = value
+        return value
+
+
+class TransactionStore:
+    """Append-only fixed-width transaction log with its type table
+
+    Legs go in and come out as the ledger's transaction dicts plus a
+    "customer_id" key.  Records are addressed by index.  Writes are
+    unbuffered and an append that fails is cut back off the file, so a
+    partial record never shifts the ones appended after it.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, TRANSACTION_LOG)
+        self.types = TypeTable(os.path.join(directory, TYPE_TABLE))
+        self._dates = _DateCache()
+        self._lock = threading.Lock()
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size % RECORD_SIZE:
+            # A torn final record from a crash mid-append
+            size -= size % RECORD_SIZE
+            with open(self.path, "r+b") as file:
+                file.truncate(size)
+        self._count = size // RECORD_SIZE
+        self._file = open(self.path, "ab", buffering=0)
+        # Separate handle for positional reads, which need no seek and no lock
+        self._reader = open(self.path, "rb")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def pack(self, leg: Dict) -> bytes:
+        """Encode one leg as a fixed-width record"""
+        return RECORD_STRUCT.pack(
+            self._dates.epoch(leg["date"]),
+            to_paise(leg["amount"]),
+            to_paise(leg["balance"]),
+            self.types.code(leg["type"]),
+            _fixed(leg["customer_id"], "Customer ID"),
+            _fixed(leg.get("recipient_id", ""), "Recipient ID"),
+            _fixed(leg.get("transaction_id", ""), "Transaction ID"),
+            _fixed(leg.get("utr", ""), "UTR"),
+        )
+
+    def unpack(self, data: bytes, offset: int = 0) -> Dict:
+        """Decode the record at offset in data back into a leg dict"""
+        timestamp, amount, balance, code, cust_id, counterparty, txn_id, utr = RECORD_STRUCT.unpack_from(data, offset)
+        return {
+            "customer_id": cust_id.rstrip(b"\0").decode("ascii"),
+            "date": self._dates.text(timestamp),
+            "type": self.types.name(code),
+            "amount": from_paise(amount),
+            "balance": from_paise(balance),
+            "recipient_id": counterparty.rstrip(b"\0").decode("ascii"),
+            "transaction_id": txn_id.rstrip(b"\0").decode("ascii"),
+            "utr": utr.rstrip(b"\0").decode("ascii"),
+        }
+
+    def append_many(self, legs: Iterable[Dict]) -> int:
+        """Append legs and return the index of the first one"""
+        return self.append_packed(b"".join(self.pack(leg) for leg in legs))
+
+    def append_packed(self, data: bytes) -> int:
+        """Append already packed records and return the index of the first one"""
+        with self._lock:
+            first = self._count
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[self._file.write(view):]
+            except BaseException:
+                os.ftruncate(self._file.fileno(), first * RECORD_SIZE)
+                raise
+            self._count += len(data) // RECORD_SIZE
+        return first
+
+    def sync(self):
+        """Force appended records to disk"""
+        with self._lock:
+            os.fsync(self._file.fileno())
+
+    def truncate(self, count: int):
+        """Drop every record from index count on"""
+        with self._lock:
+            if count < self._count:
+                self._file.truncate(count * RECORD_SIZE)
+                self._count = count
+
+    def read_range(self, start: int, stop: int) -> List[Dict]:
+        """Decode records start..stop-1"""
+        stop = min(stop, self._count)
+        if start >= stop:
+            return []
+        data = self._read_bytes(start, stop)
+        return [self.unpack(data, offset) for offset in range(0, len(data), RECORD_SIZE)]
+
+    def _read_bytes(self, start: int, stop: int) -> bytes:
+        return os.pread(self._reader.fileno(), (stop - start) * RECORD_SIZE, start * RECORD_SIZE)
+
+    def timestamp(self, index: int) -> int:
+        """Epoch timestamp of one record without decoding the rest"""
+        return TIMESTAMP_STRUCT.unpack(os.pread(self._reader.fileno(), TIMESTAMP_STRUCT.size, index * RECORD_SIZE))[0]
+
+    def timestamps(self, start: int, stop: int) -> List[int]:
+        """Epoch timestamps of records start..stop-1"""
+        stop = min(stop, self._count)
+        if start >= stop:
+            return []
+        data = self._read_bytes(start, stop)
+        return [TIMESTAMP_STRUCT.unpack_from(data, offset)[0] for offset in range(0, len(data), RECORD_SIZE)]
+
+    def read(self, index: int) -> Dict:
+        """Decode a single record"""
+        return self.read_range(index, index + 1)[0]
+
+    def iter_records(self, chunk: int = 65536) -> Iterator[Dict]:
+        """Stream every record in order"""
+        for start in range(0, self._count, chunk):
+            yield from self.read_range(start, start + chunk)
+
+    def mmap(self) -> Optional[mmap.mmap]:
+        """Read-only memory map of the log (None while it is empty)"""
+        if self._count == 0:
+            return None
+        with open(self.path, "rb") as file:
+            return mmap.mmap(file.fileno(), self._count * RECORD_SIZE, access=mmap.ACCESS_READ)
+
+    def to_numpy(self):
+        """Zero-copy numpy structured array over the log (requires numpy)"""
+        import numpy as np
+        view = self.mmap()
+        if view is None:
+            return np.zeros(0, dtype=numpy_dtype())
+        return np.frombuffer(view, dtype=numpy_dtype())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._reader.close()
+
+
+def legs_of(record: Dict) -> Iterator[Dict]:
+    """Yield every leg (with customer_id) carried by a journal record"""
+    for inner in flatten_record(record):
+        if inner.get("op") == "transfer":
+            yield from inner["legs"]
+        elif inner.get("op") == "customer":
+            for trans in inner.get("transactions", []):
+                yield dict(trans, customer_id=inner["id"])
+
+
+def append_segment(store: TransactionStore, path: str, start: int = 0,
+                   on_append: Optional[Callable[[int, List[Dict]], None]] = None) -> int:
+    """Append the legs of a journal segment to the store and return how many were added
+
+    on_append(first_index, legs) is called after each appended chunk.
+    """
+    added = 0
+    batch: List[Dict] = []
+    for _, _, record in read_records(path, start):
+        batch.extend(legs_of(record))
+        if len(batch) >= 10000:
+            first = store.append_many(batch)
+            if on_append is not None:
+                on_append(first, batch)
+            added += len(batch)
+            batch = []
+    if batch:
+        first = store.append_many(batch)
+        if on_append is not None:
+            on_append(first, batch)
+        added += len(batch)
+    return added
+
+
+def write_customer_table(path: str, customers: Dict[str, Dict]):
+    """Write the normalized customer table, one row per customer ID"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(CUSTOMER_HEADER)
+        for cust_id, info in customers.items():
+            writer.writerow([cust_id, info["name"], info["account_type"], info["dob"],
+                             info["address"], info["area"], to_paise(info["balance"])])
+    os.replace(tmp_path, path)
+
+
+def read_customer_table(path: str) -> Dict[str, Dict]:
+    """Read the customer table into customer dicts with empty histories"""
+    customers: Dict[str, Dict] = {}
+    with open(path, "r", newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header != CUSTOMER_HEADER:
+            raise ValueError(f"Invalid customer table header in {path}: {header}")
+        for row in reader:
+            customers[row[0]] = {
+                "name": row[1],
+                "account_type": row[2],
+                "dob": row[3],
+                "address": row[4],
+                "area": row[5],
+                "balance": from_paise(int(row[6])),
+                "transactions": [],
+            }
+    return customers
+
+
+def convert_csv(csv_path: str, directory: str, defaults: Optional[Dict[str, Dict]] = None) -> Tuple[int, int]:
+    """Convert the legacy 13-column CSV into a customer table and transaction log
+
+    Rows are streamed, so the CSV may be larger than memory.  A customer's
+    balance is the running balance of their last transaction row, the
+    Balance column of their details row, or the balance in defaults.
+    Returns (customers written, transactions written).
+    """
+    from storage import CSV_HEADER
+
+    store = TransactionStore(directory)
+    if len(store):
+        store.close()
+        raise ValueError(f"{store.path} already contains records")
+    customers: Dict[str, Dict] = {}
+    for cust_id, info in (defaults or {}).items():
+        customers[cust_id] = {key: info[key] for key in ("name", "dob", "address", "area", "balance", "account_type")}
+    batch: List[bytes] = []
+    written = 0
+    with open(csv_path, "r", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header != CSV_HEADER:
+            store.close()
+            raise ValueError(f"Invalid CSV header in {csv_path}. Expected {CSV_HEADER}, got {header}")
+        for row in reader:
+            if len(row) < 6:
+                print(f"Skipping invalid row: {row}")
+                continue
+            cust_id = row[0].upper()
+            info = customers.setdefault(cust_id, {"balance": 0.0})
+            info.update(name=row[1], account_type=row[2], dob=row[3], address=row[4], area=row[5])
+            if len(row) >= 13 and row[6]:
+                try:
+                    leg = {
+                        "customer_id": cust_id,
+                        "date": row[6],
+                        "type": row[7],
+                        "amount": float(row[8]),
+                        "balance": float(row[9]),
+                        "recipient_id": row[10],
+                        "transaction_id": row[11],
+                        "utr": row[12],
+                    }
+                    batch.append(store.pack(leg))
+                except ValueError as e:
+                    print(f"Skipping invalid transaction row {row}: {e}")
+                    continue
+                info["balance"] = leg["balance"]
+                if len(batch) >= 10000:
+                    store.append_packed(b"".join(batch))
+                    written += len(batch)
+                    batch = []
+            elif len(row) >= 10 and row[9]:
+                try:
+                    info["balance"] = float(row[9])
+                except ValueError as e:
+                    print(f"Skipping invalid balance in row {row}: {e}")
+    if batch:
+        store.append_packed(b"".join(batch))
+        written += len(batch)
+    store.sync()
+    store.close()
+    write_customer_table(os.path.join(directory, CUSTOMER_TABLE), customers)
+    return len(customers), written
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        print("Usage: python txstore.py <legacy.csv> <output directory>")
+        sys.exit(1)
+    from ledger import DEFAULT_CUSTOMERS
+
+    counts = convert_csv(sys.argv[1], sys.argv[2], DEFAULT_CUSTOMERS)
+    print(f"Converted {counts[0]} customers and {counts[1]} transactions into {sys.argv[2]}")
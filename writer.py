@@ -0,0 +1,111 @@
+"""Background group-commit writer for the journal"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from journal import Journal
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """Dedicated thread that writes queued journal records in groups
+
+    Records submitted while a write+fsync is in progress (or within
+    max_delay_ms of the first one) are coalesced into a single write and a
+    single fsync.  Each submission gets a Future that resolves once its
+    record is durable, so callers never block on disk themselves.
+
+    A group that fails to write fails for good: later records were built
+    on the failed ones (they carry absolute balances), so the writer fails
+    every record still queued, sets failed and refuses new submissions.
+    """
+
+    def __init__(self, journal: Journal, max_batch: int = 1000, max_delay_ms: float = 0.0):
+        self.journal = journal
+        self.max_batch = max_batch
+        self.max_delay_ms = max_delay_ms
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._submit_lock = threading.Lock()
+        # Error of the group that failed; once set, nothing more is written
+        self.failed: Optional[BaseException] = None
+        # Number of records written and write+fsync groups used for them
+        self.records_written = 0
+        self.groups_written = 0
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict) -> Future:
+        """Queue a record for the next group commit"""
+        future: Future = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise ValueError("Writer is closed")
+            if self.failed is not None:
+                raise OSError(f"Journal writer stopped after a failed group commit: {self.failed}")
+            self._queue.put((record, future))
+        return future
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until everything submitted so far is durable"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            barrier: Future = Future()
+            self._queue.put((None, barrier))
+        barrier.result(timeout)
+
+    def close(self):
+        """Write out the queue, then stop the writer thread"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _next_group(self, first) -> Tuple[List, bool]:
+        """Collect items that arrived together with first; returns (group, stop)"""
+        group = [first]
+        deadline = time.monotonic() + self.max_delay_ms / 1000
+        while len(group) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return group, True
+            group.append(item)
+        return group, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            group, stop = self._next_group(first)
+            records = [record for record, _ in group if record is not None]
+            if self.failed is not None:
+                for _, future in group:
+                    future.set_exception(self.failed)
+                continue
+            try:
+                if records:
+                    self.journal.append_many(records)
+                    self.journal.sync()
+                    self.records_written += len(records)
+                    self.groups_written += 1
+            except Exception as e:
+                print(f"Error writing journal group, refusing further commits: {e}")
+                with self._submit_lock:
+                    self.failed = e
+                for _, future in group:
+                    future.set_exception(e)
+                continue
+            for _, future in group:
+                future.set_result(None)